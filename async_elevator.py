@@ -0,0 +1,328 @@
+"""
+Asyncio-native elevator cars
+Each car runs as a task on the server's event loop and waits on a shared tick
+scheduler instead of owning an OS thread, so callbacks publish directly to
+subscribers without crossing threads. The fuzzy inference (~12 ms) is the one
+part that runs off the loop, on a single worker thread, so a moving car does
+not stall requests and the other cars' ticks.
+"""
+
+import asyncio
+import logging
+import math
+import sys
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from elevator_fuzzy_controller import ElevatorFuzzyController
+from metrics import (CONTROL_TICK_SECONDS, CONTROL_TICK_JITTER_SECONDS, FLOOR_REQUEST_TO_START_SECONDS,
+                     COMPUTE_CONTROL_SECONDS)
+from control_scheduler import CONTROL_TICK_OVERRUNS, CONTROL_TICKS_SKIPPED
+from simple_elevator_controller import SimpleElevatorController
+from tracer import TRACER
+
+logger = logging.getLogger(__name__)
+
+# Typical fuzzy compute time, used to size a fleet before any compute was measured
+FUZZY_COMPUTE_ESTIMATE_S = 0.012
+
+
+class AsyncTickScheduler:
+    """
+    Absolute-deadline tick source shared by every car on one event loop
+    Cars await next_tick(); one timer wakes all of them together each period
+    """
+
+    def __init__(self, period: float = 0.2):
+        self.period = period
+        self.tick_index = 0
+        self.overruns = 0
+        self.skipped_ticks = 0
+        self.jitter_max = 0.0
+        self._jitter_sum = 0.0
+        self._jitter_sum_sq = 0.0
+        self._windows: List[dict] = []
+        self._waiters: List[asyncio.Future] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start ticking on the running event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def next_tick(self) -> int:
+        """Wait for the next tick and return its index"""
+        return await self.tick_future()
+
+    def tick_future(self) -> asyncio.Future:
+        """Future resolved with the next tick index; resolving it early just drops the wait"""
+        self.start()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        return waiter
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_deadline = loop.time() + self.period
+        while True:
+            delay = next_deadline - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            lateness = max(0.0, loop.time() - next_deadline)
+            if lateness > self.period:
+                # Skip missed ticks rather than firing them back to back
+                missed = math.floor(lateness / self.period)
+                self.overruns += 1
+                self.skipped_ticks += missed
+                CONTROL_TICK_OVERRUNS.inc()
+                CONTROL_TICKS_SKIPPED.inc(missed)
+                self.tick_index += missed
+                next_deadline += missed * self.period
+                lateness -= missed * self.period
+                for window in self._windows:
+                    window['overruns'] += 1
+                    window['skipped_ticks'] += missed
+            CONTROL_TICK_JITTER_SECONDS.observe(lateness)
+            self._jitter_sum += lateness
+            self._jitter_sum_sq += lateness * lateness
+            self.jitter_max = max(self.jitter_max, lateness)
+            for window in self._windows:
+                window['jitter_sum'] += lateness
+                window['jitter_sum_sq'] += lateness * lateness
+                window['jitter_max'] = max(window['jitter_max'], lateness)
+
+            self.tick_index += 1
+            next_deadline += self.period
+            waiters, self._waiters = self._waiters, []
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(self.tick_index)
+
+    def stats(self) -> dict:
+        """Same keys as FixedRateScheduler.stats(), over the scheduler's lifetime"""
+        return self._summary(self.tick_index, self.overruns, self.skipped_ticks,
+                             self._jitter_sum, self._jitter_sum_sq, self.jitter_max)
+
+    def open_window(self) -> dict:
+        """Start counting ticks, overruns and jitter for one movement"""
+        window = {'start_tick': self.tick_index, 'overruns': 0, 'skipped_ticks': 0,
+                  'jitter_sum': 0.0, 'jitter_sum_sq': 0.0, 'jitter_max': 0.0}
+        self._windows.append(window)
+        return window
+
+    def close_window(self, window: dict) -> dict:
+        """Stop counting for window and return its stats() over just that span"""
+        if window in self._windows:
+            self._windows.remove(window)
+        return self._summary(self.tick_index - window['start_tick'], window['overruns'], window['skipped_ticks'],
+                             window['jitter_sum'], window['jitter_sum_sq'], window['jitter_max'])
+
+    def _summary(self, ticks: int, overruns: int, skipped: int,
+                 jitter_sum: float, jitter_sum_sq: float, jitter_max: float) -> dict:
+        fired = ticks - skipped
+        mean = jitter_sum / fired if fired else 0.0
+        variance = max(0.0, jitter_sum_sq / fired - mean * mean) if fired else 0.0
+        return {
+            'period_s': self.period,
+            'ticks': ticks,
+            'overruns': overruns,
+            'skipped_ticks': skipped,
+            'jitter_mean_s': mean,
+            'jitter_std_s': math.sqrt(variance),
+            'jitter_max_s': jitter_max
+        }
+
+
+class AsyncElevatorCar(SimpleElevatorController):
+    """
+    Elevator car whose movements run as tasks on an asyncio event loop
+    Same interface as SimpleElevatorController; move_to_floor may be called from
+    the loop itself or from any other thread. A car built outside the loop needs
+    the loop passed in. The fuzzy compute runs on executor, which must be
+    single-threaded when cars share a controller (AsyncCarFleet's is)
+    """
+
+    def __init__(self, ticker: AsyncTickScheduler, loop: Optional[asyncio.AbstractEventLoop] = None,
+                 controller: Optional[ElevatorFuzzyController] = None, car_id: str = "car_1",
+                 executor: Optional[Executor] = None):
+        super().__init__(controller, car_id)
+        self.ticker = ticker
+        if loop is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                pass
+        self.loop = loop
+        self.executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'fuzzy-{car_id}')
+        self.movement_task: Optional[asyncio.Task] = None
+        self.tick_waiter: Optional[asyncio.Future] = None
+
+    def _start_movement(self):
+        """Schedule the movement as a task on the car's event loop"""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if running is not None and (self.loop is None or running is self.loop):
+            self.loop = running
+            self.movement_task = running.create_task(self._run_movement_async())
+        elif self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self._spawn_movement(), self.loop)
+        else:
+            raise RuntimeError(f"{self.car_id}: no event loop to run on; create the car with loop=")
+
+    def _cancel_movement(self):
+        """Stop the movement and wake its task out of the current tick wait"""
+        super()._cancel_movement()
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._wake_tick_waiter)
+
+    def _wake_tick_waiter(self):
+        waiter = self.tick_waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def _spawn_movement(self):
+        self.movement_task = asyncio.get_running_loop().create_task(self._run_movement_async())
+
+    async def _run_movement_async(self):
+        """Movement loop driven by the shared tick scheduler"""
+        self._begin_movement()
+        loop = asyncio.get_running_loop()
+        window = self.ticker.open_window()
+        start_tick = last_tick = window['start_tick']
+
+        while (not self.stop_simulation and
+               self.iteration < self.max_iterations):
+
+            try:
+                tick_start = time.perf_counter()
+                tick_mark = TRACER.mark()
+                if self.iteration == 0:
+                    FLOOR_REQUEST_TO_START_SECONDS.observe(tick_start - self.request_time)
+
+                tick = self.ticker.tick_index
+                elapsed_time = (tick - start_tick) * self.ticker.period
+                control = None
+                if self.controller.compute_startup_power(elapsed_time, self.startup_direction) is None:
+                    # Nothing else moves this car meanwhile: cancelling only sets stop_simulation
+                    control = await loop.run_in_executor(self.executor, self._fuzzy_control)
+                # Ticks the shared scheduler skipped since this car's last step still move the car
+                if not self._control_step(elapsed_time, max(1, tick - last_tick), control):
+                    break
+                last_tick = tick
+
+                CONTROL_TICK_SECONDS.observe(time.perf_counter() - tick_start)
+                if tick_mark:
+                    TRACER.span('control_tick', tick_mark, args={'car_id': self.car_id, 'iteration': self.iteration})
+                if self.stop_simulation:
+                    break
+                # Other tasks run on this thread meanwhile, so the wait may overlap their spans
+                sleep_mark = TRACER.mark()
+                self.tick_waiter = self.ticker.tick_future()
+                await self.tick_waiter
+                TRACER.async_span('sleep', sleep_mark, args={'car_id': self.car_id})
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error in movement simulation: {e}")
+                break
+
+        self.tick_waiter = None
+        self._finish_movement(self.ticker.close_window(window))
+
+    def connect(self):
+        """No transport to open; the car lives on the event loop"""
+        return True
+
+    def disconnect(self):
+        """Stop the current movement right away"""
+        self._cancel_movement()
+
+
+class AsyncCarFleet:
+    """
+    Collection of asyncio cars sharing one tick scheduler and one fuzzy controller
+    The computes are serialised on one thread, so a fleet holds about
+    period / compute time cars (capacity()); add_car warns past that
+    """
+
+    def __init__(self, period: Optional[float] = None, controller: Optional[ElevatorFuzzyController] = None):
+        # Every car's fuzzy compute runs on the one worker thread below, so a
+        # single rule base (whose simulation is not thread-safe) can serve them all
+        self.controller = controller or ElevatorFuzzyController()
+        self.ticker = AsyncTickScheduler(period or self.controller.sampling_time)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fuzzy')
+        self.cars: Dict[str, AsyncElevatorCar] = {}
+        self.capacity_warned = False
+
+    def add_car(self, car_id: str, loop: Optional[asyncio.AbstractEventLoop] = None) -> AsyncElevatorCar:
+        car = AsyncElevatorCar(self.ticker, loop, self.controller, car_id, self.executor)
+        self.cars[car_id] = car
+        self._check_capacity()
+        return car
+
+    def capacity(self) -> int:
+        """Cars whose fuzzy computes fit in one tick on the single worker thread"""
+        snapshot = COMPUTE_CONTROL_SECONDS.snapshot()
+        compute_time = snapshot['sum'] / snapshot['count'] if snapshot['count'] else FUZZY_COMPUTE_ESTIMATE_S
+        return max(1, int(self.ticker.period / compute_time))
+
+    def _check_capacity(self):
+        capacity = self.capacity()
+        if len(self.cars) > capacity and not self.capacity_warned:
+            # Past this point every tick overruns and the cars advance by skipped ticks
+            self.capacity_warned = True
+            logger.warning("%d cars exceed the fleet's fuzzy compute capacity of about %d per %.0fms tick; "
+                           "expect tick overruns, or split the cars across fleets or the process engine",
+                           len(self.cars), capacity, self.ticker.period * 1000)
+
+    def get(self, car_id: str) -> AsyncElevatorCar:
+        return self.cars[car_id]
+
+    async def shutdown(self):
+        for car in self.cars.values():
+            car.disconnect()
+        tasks = [car.movement_task for car in self.cars.values() if car.movement_task]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        await self.ticker.stop()
+        self.executor.shutdown(wait=False)
+
+
+async def run_fleet_demo(car_count: int = 20):
+    """Drive car_count cars at once and report tick lateness"""
+    fleet = AsyncCarFleet()
+    floors = [f'andar_{i}' for i in range(1, 9)]
+    for n in range(car_count):
+        car = fleet.add_car(f'car_{n + 1}')
+        car.move_to_floor(floors[n % len(floors)])
+
+    start = time.time()
+    while any(car.is_moving for car in fleet.cars.values()):
+        await asyncio.sleep(0.5)
+
+    stats = fleet.ticker.stats()
+    print(f"\n{car_count} cars finished in {time.time() - start:.1f}s")
+    print(f"Ticks: {stats['ticks']}, overruns: {stats['overruns']}, skipped: {stats['skipped_ticks']}, "
+          f"jitter mean/max: {stats['jitter_mean_s']*1000:.2f}/{stats['jitter_max_s']*1000:.2f}ms")
+    await fleet.shutdown()
+
+
+if __name__ == "__main__":
+    from structured_log import configure_logging
+    configure_logging()
+    asyncio.run(run_fleet_demo(int(sys.argv[1]) if len(sys.argv) > 1 else 20))
@@ -0,0 +1,216 @@
+"""
+MQTT transport driven by an asyncio event loop
+The paho client's socket is watched with loop.add_reader/add_writer instead
+of a network thread of its own, so on uvicorn's loop incoming floor_request /
+emergency_stop messages reach AsyncElevatorCar directly and telemetry is
+published from the loop without crossing threads.
+
+    transport = AsyncMqttTransport('localhost', 1883)
+    await transport.start()
+    attach_car(transport, car)      # car of an AsyncCarFleet
+
+main.py uses it with ELEVATOR_ENGINE=async and ELEVATOR_MQTT_ASYNC=1.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+import paho.mqtt.client as mqtt
+
+from elevator_mqtt_client import car_topics
+from mqtt_publisher import MqttPublisher
+from telemetry_codec import decode_payload
+
+
+class AsyncMqttTransport:
+    """
+    paho client on an asyncio loop
+
+    Handlers registered with subscribe() run on the loop as
+    handler(topic, payload, received_at); payload is decoded from JSON or
+    binary telemetry (telemetry_codec.py).
+    """
+
+    def __init__(self, broker_host: str = "localhost", broker_port: int = 1883, client_id: str = "",
+                 publisher_kwargs: Optional[dict] = None):
+        self.broker_host = broker_host
+        self.broker_port = broker_port
+        self.client = mqtt.Client(client_id=client_id)
+        self.publisher = MqttPublisher.from_env(self.client, **(publisher_kwargs or {}))
+        self.handlers: List[Tuple[str, Callable]] = []
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.connected = False
+        self._loop_thread = None
+        self._misc_task: Optional[asyncio.Task] = None
+        self._connected_event: Optional[asyncio.Event] = None
+
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_message = self._on_message
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    # Socket callbacks: the loop does paho's network thread's job
+
+    def _in_loop(self, func, *args):
+        # publish() from another thread (e.g. the spool replay) registers the
+        # socket for writing from that thread; the loop's selector is not thread safe
+        if threading.get_ident() == self._loop_thread:
+            func(*args)
+        elif not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(func, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._in_loop(self.loop.add_reader, sock, client.loop_read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._in_loop(self.loop.remove_reader, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._in_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._in_loop(self.loop.remove_writer, sock)
+
+    # Connection
+
+    async def start(self) -> bool:
+        """Connect on the running loop; paho's keepalive and reconnects run as a task"""
+        self.loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._connected_event = asyncio.Event()
+        try:
+            await self._connect()
+            connected = True
+        except Exception as e:
+            print(f"Failed to connect to MQTT broker: {e}")
+            connected = False
+        self._misc_task = self.loop.create_task(self._misc_loop())
+        return connected
+
+    async def _connect(self):
+        # DNS lookup and TCP connect block, up to the OS connect timeout against an
+        # unreachable broker: run them on a worker thread. The socket callbacks
+        # they trigger are handed to the loop by _in_loop
+        await self.loop.run_in_executor(None, self.client.connect, self.broker_host, self.broker_port, 60)
+
+    async def _misc_loop(self):
+        """Keepalive pings and retries; reconnects with a 1-30s backoff"""
+        delay = 1.0
+        while True:
+            if self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+                await asyncio.sleep(1)
+                continue
+            await asyncio.sleep(delay)
+            try:
+                await self._connect()
+                delay = 1.0
+            except Exception:
+                delay = min(delay * 2, 30.0)
+
+    async def wait_connected(self, timeout: float = 5.0) -> bool:
+        try:
+            await asyncio.wait_for(self._connected_event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def stop(self):
+        if self._misc_task is not None:
+            self._misc_task.cancel()
+            try:
+                await self._misc_task
+            except asyncio.CancelledError:
+                pass
+            self._misc_task = None
+        self.publisher.stop()
+        self.client.disconnect()
+        sock = self.client.socket()
+        if sock is not None:
+            self.loop.remove_reader(sock)
+            self.loop.remove_writer(sock)
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            self.connected = True
+            self._connected_event.set()
+            print(f"Connected to MQTT broker at {self.broker_host}:{self.broker_port} (asyncio transport)")
+            if self.handlers:
+                client.subscribe([(topic, 0) for topic, _ in self.handlers])
+            self.publisher.connection_restored()
+        else:
+            print(f"Failed to connect to MQTT broker. Return code: {rc}")
+
+    def _on_disconnect(self, client, userdata, rc):
+        self.connected = False
+        self._connected_event.clear()
+        print(f"Disconnected from MQTT broker. Return code: {rc}")
+        self.publisher.connection_lost()
+
+    # Messages
+
+    def subscribe(self, topic_filter: str, handler: Callable):
+        """Call handler(topic, payload, received_at) for messages matching topic_filter"""
+        self.handlers.append((topic_filter, handler))
+        if self.connected:
+            self.client.subscribe(topic_filter)
+
+    def _on_message(self, client, userdata, msg):
+        """Runs on the loop, inside loop_read"""
+        received_at = time.perf_counter()
+        try:
+            payload = decode_payload(msg.payload)
+        except ValueError:
+            print(f"Invalid payload received on topic {msg.topic}: {msg.payload}")
+            return
+        for topic_filter, handler in self.handlers:
+            if mqtt.topic_matches_sub(topic_filter, msg.topic):
+                try:
+                    handler(msg.topic, payload, received_at)
+                except Exception as e:
+                    print(f"Error processing message on topic {msg.topic}: {e}")
+
+
+def attach_car(transport: AsyncMqttTransport, car, building_id: Optional[str] = None) -> dict:
+    """Serve a car's MQTT topics on the transport; returns the topics
+
+    Call after the car's own position/status callbacks are set: they are kept
+    and telemetry is published before they run.
+    """
+    topics = car_topics(building_id or os.environ.get('ELEVATOR_BUILDING_ID'), car.car_id)
+    publisher = transport.publisher
+    position_callback = car.position_callback
+    status_callback = car.status_callback
+
+    def on_position(data):
+        publisher.publish_position(topics['position_update'], car.car_id, data)
+        if position_callback:
+            position_callback(data)
+
+    def on_status(data):
+        publisher.publish_status(topics['status_update'], data)
+        if status_callback:
+            status_callback(data)
+
+    def on_floor_request(topic, payload, received_at):
+        requested_floor = payload.get('floor')
+        if requested_floor and not car.is_moving:
+            print(f"Floor request received: {requested_floor}")
+            car.move_to_floor(requested_floor)
+        elif car.is_moving:
+            print(f"Elevator is moving. Request for {requested_floor} ignored.")
+
+    def on_emergency_stop(topic, payload, received_at):
+        print("Emergency stop activated!")
+        car.emergency_stop(received_at)
+
+    car.position_callback = on_position
+    car.status_callback = on_status
+    transport.subscribe(topics['floor_request'], on_floor_request)
+    transport.subscribe(topics['emergency_stop'], on_emergency_stop)
+    return topics
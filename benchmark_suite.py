@@ -0,0 +1,319 @@
+"""
+Micro- and macro-benchmarks for the elevator control stack
+Each benchmark is warmed up, then timed over several repeats; results are
+saved as JSON and compared with a stored baseline. The run fails (exit code 1)
+when a benchmark gets slower than the baseline by more than the regression
+threshold. The comparison uses the fastest repeat, which is the estimate
+least disturbed by other load on the machine.
+
+    python benchmark_suite.py                      # run, compare, save results
+    python benchmark_suite.py --filter compute     # only matching benchmarks
+    python benchmark_suite.py --update-baseline    # store this run as the baseline
+
+Baselines are machine specific: regenerate analysis/benchmarks/baseline.json
+on the machine that runs the comparison.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+BASELINE_PATH = os.path.join('analysis', 'benchmarks', 'baseline.json')
+
+# Official scenarios from teste_oficial.py
+SCENARIOS = [('terreo', 'andar_1'), ('andar_1', 'terreo'), ('terreo', 'andar_4'),
+             ('andar_4', 'terreo'), ('terreo', 'andar_8'), ('andar_8', 'terreo')]
+
+
+class Benchmark:
+    """A callable timed `number` times per repeat; results are reported per call"""
+
+    def __init__(self, name: str, func: Callable[[], None], number: int = 1,
+                 repeats: Optional[int] = None, group: str = 'micro'):
+        self.name = name
+        self.func = func
+        self.number = number
+        self.repeats = repeats
+        self.group = group
+
+    def run(self, warmup: int, repeats: int) -> dict:
+        for _ in range(warmup):
+            self.func()
+        samples = []
+        for _ in range(self.repeats or repeats):
+            start = time.perf_counter()
+            for _ in range(self.number):
+                self.func()
+            samples.append((time.perf_counter() - start) / self.number)
+        return {
+            'group': self.group,
+            'number': self.number,
+            'repeats': len(samples),
+            'unit': 's/call',
+            'min': min(samples),
+            'median': statistics.median(samples),
+            'mean': statistics.mean(samples),
+            'stdev': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+            'max': max(samples),
+            'samples': samples
+        }
+
+
+class _FakeWebSocket:
+    """Stands in for a Starlette WebSocket in the broadcast benchmark"""
+
+    async def send_text(self, message: str):
+        pass
+
+
+def build_benchmarks() -> List[Benchmark]:
+    """Create the suite; shared fixtures are built once here, outside the timings"""
+    import skfuzzy.control as ctrl
+    from elevator_fuzzy_controller import ElevatorFuzzyController
+    from simple_elevator_controller import SimpleElevatorController
+
+    controller = ElevatorFuzzyController()
+    car = SimpleElevatorController(controller=controller)
+
+    # skfuzzy memoizes results per exact input; live inputs practically never
+    # repeat, so measure cold inferences on a new simulation (~20 us to build)
+    def clear_fuzzy_cache():
+        controller.simulation = ctrl.ControlSystemSimulation(controller.control_system)
+
+    # Inputs spread over the error range the controller sees in a trip
+    control_inputs = [(4.0 + i * 0.5, 29.0, 25.0 - i * 0.5) for i in range(50)]
+
+    def compute_control():
+        clear_fuzzy_cache()
+        for position, target, previous_error in control_inputs:
+            controller.compute_control(position, target, previous_error)
+
+    def update_position():
+        position = 4.0
+        for step in range(100):
+            position = controller.update_position(position, 31.5, 1, step * 0.2)
+
+    def nearest_floor():
+        for step in range(100):
+            car.current_position = 4.0 + step * 0.25
+            car._get_nearest_floor()
+
+    position_frame = {
+        'timestamp': time.time(), 'car_id': 'car_1', 'current_position': 12.345678,
+        'target_position': 29.0, 'current_floor': 'andar_2', 'target_floor': 'andar_8',
+        'motor_power': 31.5, 'error': 16.654322, 'direction': 'up', 'is_moving': True,
+        'delta_error': -0.061234, 'control_phase': 'fuzzy'
+    }
+
+    def encode_frames():
+        for seq in range(100):
+            json.dumps({'type': 'position_update', 'data': position_frame, 'seq': seq})
+
+    # Binary telemetry (telemetry_codec.py) against the JSON it replaces on MQTT
+    from telemetry_codec import decode_payload, encode_frame
+    json_payload = json.dumps(position_frame).encode()
+    binary_payload = encode_frame(position_frame)
+
+    def encode_json():
+        for _ in range(100):
+            json.dumps(position_frame)
+
+    def encode_binary():
+        for _ in range(100):
+            encode_frame(position_frame)
+
+    def decode_json():
+        for _ in range(100):
+            decode_payload(json_payload)
+
+    def decode_binary():
+        for _ in range(100):
+            decode_payload(binary_payload)
+
+    benchmarks = [
+        Benchmark('fuzzy_controller_init', ElevatorFuzzyController, number=1, repeats=5, group='macro'),
+        Benchmark('compute_control_x50', compute_control, number=5),
+        Benchmark('update_position_x100', update_position, number=200),
+        Benchmark('nearest_floor_x100', nearest_floor, number=200),
+        Benchmark('position_frame_json_x100', encode_frames, number=100),
+        Benchmark('telemetry_encode_json_x100', encode_json, number=100),
+        Benchmark('telemetry_encode_binary_x100', encode_binary, number=100),
+        Benchmark('telemetry_decode_json_x100', decode_json, number=100),
+        Benchmark('telemetry_decode_binary_x100', decode_binary, number=100),
+    ]
+
+    # Broadcast of one position frame to 20 dashboards, with subscription filtering
+    import main
+    manager = main.ConnectionManager()
+    loop = asyncio.new_event_loop()
+    for _ in range(20):
+        websocket = _FakeWebSocket()
+        manager.active_connections.append(websocket)
+        manager.subscriptions[websocket] = main.Subscription()
+    frame_text = json.dumps({'type': 'position_update', 'data': position_frame, 'seq': 1})
+
+    def broadcast():
+        loop.run_until_complete(manager.broadcast(frame_text, 'position', 'car_1'))
+
+    benchmarks.append(Benchmark('broadcast_20_clients', broadcast, number=200))
+
+    # Per-frame logging: a disabled level, a site over its rate limit, a record
+    # handed to the queue (written by the listener thread) and the print it replaced
+    from structured_log import StructuredLogger, queue_handler
+    bench_log = StructuredLogger('benchmark')
+    handler, listener = queue_handler(open(os.devnull, 'w'))
+    bench_log.logger.addHandler(handler)
+    bench_log.logger.propagate = False
+    bench_log.logger.setLevel(logging.DEBUG)
+    listener.start()
+    quiet_log = StructuredLogger('benchmark.quiet')
+    quiet_log.logger.setLevel(logging.INFO)
+    fields = position_frame
+
+    def log_disabled():
+        for _ in range(1000):
+            quiet_log.debug('bench.disabled', "Position update queued for broadcast", rate=1.0,
+                            position=fields['current_position'], motor_power=fields['motor_power'])
+
+    def log_rate_limited():
+        for _ in range(1000):
+            bench_log.debug('bench.limited', "Position update queued for broadcast", rate=0.001,
+                            position=fields['current_position'], motor_power=fields['motor_power'])
+
+    def log_queued():
+        for _ in range(100):
+            bench_log.debug('bench.queued', "Position update queued for broadcast",
+                            position=fields['current_position'], motor_power=fields['motor_power'])
+
+    def replaced_print():
+        for _ in range(100):
+            print(f"DEBUG: Position update received - pos: {fields['current_position']:.2f}m, motor: {fields['motor_power']:.1f}%")
+
+    benchmarks += [
+        Benchmark('log_disabled_level_x1000', log_disabled, number=20),
+        Benchmark('log_rate_limited_x1000', log_rate_limited, number=20),
+        Benchmark('log_queued_record_x100', log_queued, number=20),
+        Benchmark('log_replaced_print_x100', replaced_print, number=20),
+    ]
+
+    def simulate(start, target):
+        clear_fuzzy_cache()
+        controller.simulate_movement(start, target)
+
+    for start, target in SCENARIOS:
+        benchmarks.append(Benchmark(f'simulate_movement_{start}_to_{target}',
+                                    lambda s=start, t=target: simulate(s, t),
+                                    number=1, repeats=3, group='macro'))
+    return benchmarks
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[dict]:
+    """Per-benchmark ratio of the fastest repeat against the baseline's"""
+    rows = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            rows.append({'name': name, 'ratio': None, 'regression': False})
+            continue
+        ratio = result['min'] / reference['min']
+        rows.append({'name': name, 'ratio': ratio, 'regression': ratio > 1 + threshold})
+    return rows
+
+
+def _format_time(seconds: float) -> str:
+    if seconds >= 1:
+        return f"{seconds:.3f}s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.3f}ms"
+    return f"{seconds * 1e6:.2f}us"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Elevator control benchmark suite')
+    parser.add_argument('--filter', help='only run benchmarks whose name contains this text')
+    parser.add_argument('--warmup', type=int, default=1, help='untimed runs before measuring')
+    parser.add_argument('--repeats', type=int, default=7, help='timed repeats (macro benchmarks use fewer)')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed slowdown before failing (0.25 = 25%%)')
+    parser.add_argument('--update-baseline', action='store_true', help='save this run as the baseline')
+    parser.add_argument('--output', help='results path (default analysis/benchmarks/benchmark_<timestamp>.json)')
+    args = parser.parse_args(argv)
+
+    print("Preparing benchmarks...")
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        benchmarks = build_benchmarks()
+    if args.filter:
+        benchmarks = [b for b in benchmarks if args.filter in b.name]
+
+    results = {}
+    for benchmark in benchmarks:
+        # Controllers print on the hot path; keep that cost but not the terminal output
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            result = benchmark.run(args.warmup, args.repeats)
+        results[benchmark.name] = result
+        print(f"{benchmark.name:<38} min {_format_time(result['min']):>10}  median {_format_time(result['median']):>10}"
+              f"  stdev {_format_time(result['stdev']):>10}  ({result['repeats']} x {result['number']})")
+
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {'warmup': args.warmup, 'repeats': args.repeats},
+        'benchmarks': results
+    }
+    output = args.output or os.path.join(
+        'analysis', 'benchmarks', f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {output}")
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f).get('benchmarks', {})
+        # A filtered run only replaces the benchmarks it measured
+        baseline.update(results)
+        report['benchmarks'] = baseline
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline updated: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --update-baseline to create one")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)['benchmarks']
+    rows = compare(results, baseline, args.threshold)
+    print(f"\nComparison with {args.baseline} (threshold +{args.threshold:.0%}):")
+    for row in rows:
+        if row['ratio'] is None:
+            print(f"  {row['name']:<40} (not in baseline)")
+        else:
+            flag = 'REGRESSION' if row['regression'] else 'ok'
+            print(f"  {row['name']:<40} {row['ratio']:>6.2f}x  {flag}")
+
+    regressions = [row['name'] for row in rows if row['regression']]
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) regressed: {', '.join(regressions)}")
+        return 1
+    print("\nNo regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,294 @@
+"""
+Performance regression check across teste_oficial runs
+Compares the scenarios of one or more candidate runs with those of one or more
+baseline runs: for every route (origin -> destination) the change in trip
+time, final error and peak power, and how likely the change is to be noise.
+
+Runs already in the trip history (trip_store.py) are read from its KPI rows,
+never the trajectories; other runs are read from their file. The comparison
+only reads: import runs with `python trip_store.py import`. A run may be given
+as its .jsonl, .json or .traj file.
+
+Significance is a two-sided test on the difference of the means. With enough
+runs it is a permutation test (exact for small groups). A permutation test
+cannot reach alpha with few runs (one candidate against k baselines has a
+smallest p of 1/(k+1)), so then, as for the default newest-run-against-the-rest
+check, the candidate mean is tested against the baseline's spread instead:
+Student's t prediction test, which needs two baseline runs or more. A metric is
+
+    regression              worse than the threshold and p <= alpha
+    unconfirmed_regression  worse than the threshold, not significant
+    improvement             better than the threshold and p <= alpha
+    ok                      anything else
+
+    python compare_results.py                                    # newest run against all earlier ones
+    python compare_results.py --baseline a.json b.json --candidate c.jsonl --strict
+    python compare_results.py --json > report.json               # report on stdout, for CI
+
+The exit status is 1 when a regression is found (with --strict also an
+unconfirmed one), so it can gate controller changes.
+"""
+
+import argparse
+import glob
+import itertools
+import json
+import math
+import os
+import random
+import statistics
+import sys
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from trip_store import TripStore, DEFAULT_PATH, read_result_trips
+
+# metric -> (default threshold, relative?); lower is better for all three
+METRICS = {
+    'trip_time_s': (0.10, True),        # 10% slower
+    'final_error_mm': (5.0, False),     # 5 mm further from the floor
+    'peak_power_pct': (0.10, True),     # 10% more motor power
+}
+ALPHA = 0.05
+_EXACT_LIMIT = 20000  # arrangements enumerated before the test switches to random permutations
+
+
+def permutation_p_value(baseline: List[float], candidate: List[float], rounds: int = 10000) -> Optional[float]:
+    """Two-sided p-value of the difference of means; None when a side is empty"""
+    if not baseline or not candidate:
+        return None
+    pooled = baseline + candidate
+    observed = abs(statistics.mean(candidate) - statistics.mean(baseline))
+    total = sum(pooled)
+    size = len(candidate)
+
+    def as_extreme(candidate_sum: float) -> bool:
+        difference = candidate_sum / size - (total - candidate_sum) / len(baseline)
+        return abs(difference) >= observed - 1e-12
+
+    arrangements = _combinations(len(pooled), size)
+    if arrangements <= _EXACT_LIMIT:
+        hits = sum(as_extreme(sum(chosen)) for chosen in itertools.combinations(pooled, size))
+        return hits / arrangements
+    generator = random.Random(0)  # same data, same p-value
+    hits = sum(as_extreme(sum(generator.sample(pooled, size))) for _ in range(rounds))
+    return (hits + 1) / (rounds + 1)
+
+
+def prediction_p_value(baseline: List[float], candidate: List[float]) -> Optional[float]:
+    """
+    Two-sided p-value of the candidate mean as a draw from the baseline's distribution
+    t = (mean(candidate) - mean(baseline)) / (s * sqrt(1/m + 1/n)) with n - 1 degrees
+    of freedom, s the baseline's standard deviation; None with fewer than two
+    baseline values. A baseline without spread makes any change significant.
+    """
+    if len(baseline) < 2 or not candidate:
+        return None
+    difference = abs(statistics.mean(candidate) - statistics.mean(baseline))
+    scale = statistics.stdev(baseline) * math.sqrt(1 / len(candidate) + 1 / len(baseline))
+    if scale == 0:
+        return 0.0 if difference > 1e-12 else 1.0
+    return _t_two_sided(difference / scale, len(baseline) - 1)
+
+
+def _t_two_sided(t: float, df: int) -> float:
+    """P(|T| >= t) for Student's t with integer df (Abramowitz & Stegun 26.7.3-4)"""
+    theta = math.atan(abs(t) / math.sqrt(df))
+    c2 = math.cos(theta) ** 2
+    total = term = 1.0
+    if df % 2:
+        for j in range(1, (df - 1) // 2):
+            term *= 2 * j / (2 * j + 1) * c2
+            total += term
+        inside = 2 / math.pi * (theta + (math.sin(theta) * math.cos(theta) * total if df > 1 else 0.0))
+    else:
+        for j in range(1, df // 2):
+            term *= (2 * j - 1) / (2 * j) * c2
+            total += term
+        inside = math.sin(theta) * total
+    return max(0.0, 1.0 - inside)
+
+
+def significance(baseline: List[float], candidate: List[float], alpha: float = ALPHA):
+    """(p-value, test name): the permutation test when it can reach alpha, else the prediction test"""
+    arrangements = _combinations(len(baseline) + len(candidate), len(candidate))
+    # The observed split is always counted, and so is its mirror image when the sides are the same size
+    smallest = (2 if len(baseline) == len(candidate) else 1) / arrangements
+    if arrangements > _EXACT_LIMIT or smallest <= alpha:
+        return permutation_p_value(baseline, candidate), 'permutation'
+    return prediction_p_value(baseline, candidate), 'prediction'
+
+
+def _combinations(n: int, k: int) -> int:
+    result = 1
+    for i in range(1, k + 1):
+        result = result * (n - k + i) // i
+    return result
+
+
+def find_runs(paths: List[str]) -> List[str]:
+    """Results files for the given paths and globs, one per run, oldest first"""
+    found = []
+    for pattern in paths:
+        found.extend(glob.glob(pattern) or [pattern])
+    runs = {}
+    for path in found:
+        stem, extension = os.path.splitext(path)
+        if extension not in ('.jsonl', '.json', '.traj'):
+            continue
+        # A .traj is the twin of its .jsonl/.json; the run is known by the latter
+        current = runs.get(stem)
+        if current is None or current.endswith('.traj'):
+            runs[stem] = path
+    return sorted(runs.values(), key=lambda path: os.path.basename(path))
+
+
+def load_runs(store: Optional[TripStore], runs: List[str]) -> Dict[str, List[dict]]:
+    """Trips of each run, from the trip history when imported and from the file otherwise; writes nothing"""
+    loaded = {}
+    for path in runs:
+        try:
+            if store is not None and store.has_run(path):
+                loaded[path] = store.run_trips(path)
+            else:
+                loaded[path] = read_result_trips(path)
+        except (ValueError, KeyError, OSError) as e:
+            print(f"{path}: skipped ({e})", file=sys.stderr)
+    return loaded
+
+
+def compare(baseline: Dict[str, List[dict]], candidate: Dict[str, List[dict]],
+            thresholds: Optional[dict] = None, alpha: float = ALPHA) -> dict:
+    """Per-route deltas and verdicts of candidate runs against baseline runs"""
+    thresholds = dict({name: threshold for name, (threshold, _) in METRICS.items()}, **(thresholds or {}))
+
+    def by_route(runs):
+        routes = {}
+        for trips in runs.values():
+            for trip in trips:
+                routes.setdefault((trip['origin_floor'], trip['target_floor']), []).append(trip)
+        return routes
+
+    baseline_routes, candidate_routes = by_route(baseline), by_route(candidate)
+    scenarios = []
+    for route in sorted(set(baseline_routes) & set(candidate_routes)):
+        scenario = {'origin': route[0], 'target': route[1], 'metrics': {}}
+        for name, (_, relative) in METRICS.items():
+            before = [trip[name] for trip in baseline_routes[route] if trip[name] is not None]
+            after = [trip[name] for trip in candidate_routes[route] if trip[name] is not None]
+            if not before or not after:
+                continue
+            mean_before, mean_after = statistics.mean(before), statistics.mean(after)
+            delta = mean_after - mean_before
+            change = delta / mean_before if relative and mean_before else delta
+            p_value, test = significance(before, after, alpha)
+            significant = p_value is not None and p_value <= alpha
+            if change > thresholds[name]:
+                status = 'regression' if significant else 'unconfirmed_regression'
+            elif change < -thresholds[name] and significant:
+                status = 'improvement'
+            else:
+                status = 'ok'
+            scenario['metrics'][name] = {
+                'baseline_mean': mean_before, 'candidate_mean': mean_after,
+                'baseline_n': len(before), 'candidate_n': len(after),
+                'delta': delta, 'relative_delta': delta / mean_before if mean_before else None,
+                'threshold': thresholds[name], 'threshold_relative': relative,
+                'p_value': p_value, 'test': test, 'status': status
+            }
+        scenarios.append(scenario)
+
+    statuses = [metric['status'] for scenario in scenarios for metric in scenario['metrics'].values()]
+    return {
+        'baseline_runs': list(baseline), 'candidate_runs': list(candidate),
+        'alpha': alpha, 'thresholds': thresholds,
+        'scenarios': scenarios,
+        'missing_in_candidate': [f"{o}->{t}" for o, t in sorted(set(baseline_routes) - set(candidate_routes))],
+        'missing_in_baseline': [f"{o}->{t}" for o, t in sorted(set(candidate_routes) - set(baseline_routes))],
+        'regressions': statuses.count('regression'),
+        'unconfirmed_regressions': statuses.count('unconfirmed_regression'),
+        'improvements': statuses.count('improvement')
+    }
+
+
+def print_report(report: dict, out=sys.stdout):
+    print(f"Baseline:  {', '.join(report['baseline_runs'])}", file=out)
+    print(f"Candidate: {', '.join(report['candidate_runs'])}", file=out)
+    print(f"\n{'route':<20}{'metric':<16}{'baseline':>10}{'candidate':>11}{'delta':>10}{'p':>7}  status", file=out)
+    for scenario in report['scenarios']:
+        route = f"{scenario['origin']}->{scenario['target']}"
+        for name, metric in scenario['metrics'].items():
+            p_value = f"{metric['p_value']:.3f}" if metric['p_value'] is not None else '-'
+            delta = (f"{metric['relative_delta']:+.1%}" if metric['threshold_relative'] and metric['relative_delta'] is not None
+                     else f"{metric['delta']:+.2f}")
+            print(f"{route:<20}{name:<16}{metric['baseline_mean']:>10.2f}{metric['candidate_mean']:>11.2f}"
+                  f"{delta:>10}{p_value:>7}  {metric['status']}", file=out)
+            route = ''
+    for key in ('missing_in_candidate', 'missing_in_baseline'):
+        if report[key]:
+            print(f"{key.replace('_', ' ')}: {', '.join(report[key])}", file=out)
+    print(f"\n{report['regressions']} regression(s), {report['unconfirmed_regressions']} unconfirmed, "
+          f"{report['improvements']} improvement(s)", file=out)
+
+
+def _threshold(text: str):
+    name, _, value = text.partition('=')
+    if name not in METRICS or not value:
+        raise argparse.ArgumentTypeError(f"expected METRIC=VALUE with METRIC in {', '.join(METRICS)}")
+    return name, float(value)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Regression check of teste_oficial runs against a baseline')
+    parser.add_argument('--baseline', nargs='+', help='baseline runs (default: all runs before the candidate)')
+    parser.add_argument('--candidate', nargs='+', help='candidate runs (default: the newest run)')
+    parser.add_argument('--threshold', action='append', type=_threshold, default=[],
+                        help='METRIC=VALUE, e.g. trip_time_s=0.05 (relative) or final_error_mm=2 (mm)')
+    parser.add_argument('--alpha', type=float, default=ALPHA, help='significance level')
+    parser.add_argument('--strict', action='store_true', help='also fail on unconfirmed regressions')
+    parser.add_argument('--db', default=os.environ.get('ELEVATOR_TRIP_DB') or DEFAULT_PATH,
+                        help='trip history to read imported runs from (opened read-only)')
+    parser.add_argument('--json', action='store_true', help='write the report to stdout instead of a file')
+    parser.add_argument('--output', help='report path (default analysis/regressions/comparison_<timestamp>.json)')
+    args = parser.parse_args(argv)
+
+    everything = find_runs([os.path.join('analysis', 'test_results', 'resultados_teste_oficial_*')])
+    candidate = find_runs(args.candidate) if args.candidate else everything[-1:]
+    baseline = find_runs(args.baseline) if args.baseline else [run for run in everything if run not in candidate]
+    if not candidate or not baseline:
+        print("Need at least one baseline and one candidate run", file=sys.stderr)
+        return 2
+
+    store = TripStore(args.db, readonly=True) if os.path.exists(args.db) else None
+    try:
+        baseline_trips = load_runs(store, baseline)
+        candidate_trips = load_runs(store, candidate)
+    finally:
+        if store is not None:
+            store.close()
+    if not candidate_trips or not baseline_trips:
+        print("No readable baseline or candidate run", file=sys.stderr)
+        return 2
+
+    report = compare(baseline_trips, candidate_trips, dict(args.threshold), args.alpha)
+    report['timestamp'] = datetime.now().isoformat()
+    failed = report['regressions'] or (args.strict and report['unconfirmed_regressions'])
+    report['passed'] = not failed
+
+    if args.json:
+        print_report(report, out=sys.stderr)
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(report)
+        output = args.output or os.path.join(
+            'analysis', 'regressions', f"comparison_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport saved to {output}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
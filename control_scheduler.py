@@ -0,0 +1,113 @@
+"""
+Drift-compensated fixed-rate scheduler for the control loop
+Ticks are aligned to absolute deadlines (start + n * period) instead of
+sleeping a fixed time after the work, so compute, callback and publish time
+no longer stretch the sampling period
+"""
+
+import math
+import threading
+import time
+from typing import Callable, Optional
+
+from metrics import REGISTRY, CONTROL_TICK_JITTER_SECONDS
+
+CONTROL_TICK_OVERRUNS = REGISTRY.counter(
+    'elevator_control_tick_overruns_total', 'Control ticks that started after their deadline had passed')
+CONTROL_TICKS_SKIPPED = REGISTRY.counter(
+    'elevator_control_ticks_skipped_total', 'Control ticks dropped to get back on schedule after an overrun')
+
+
+class FixedRateScheduler:
+    """
+    Absolute-deadline tick scheduler
+
+    After an overrun the scheduler either skips the missed ticks and resumes
+    on the next future deadline (default), or, with ``catch_up=True``, runs
+    the missed ticks back to back until it is on schedule again. Skipped ticks
+    still count in ``elapsed``; ``last_skipped`` tells the caller how many
+    periods to advance the plant by on the tick that follows them. When a
+    ``wake_event`` is given the wait between ticks ends as soon as it is set.
+    """
+
+    def __init__(self, period: float, catch_up: bool = False,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep,
+                 wake_event: Optional[threading.Event] = None):
+        self.period = period
+        self.catch_up = catch_up
+        self.clock = clock
+        self.sleep = sleep
+        self.wake_event = wake_event
+        self.start()
+
+    def start(self):
+        """Reset the schedule so the current instant is tick 0"""
+        self.start_time = self.clock()
+        self.tick_index = 0
+        self.next_deadline = self.start_time + self.period
+        self.overruns = 0
+        self.skipped_ticks = 0
+        self.last_skipped = 0  # periods skipped right before the current tick
+        self._jitter_count = 0
+        self._jitter_sum = 0.0
+        self._jitter_sum_sq = 0.0
+        self._jitter_max = 0.0
+
+    @property
+    def elapsed(self) -> float:
+        """Scheduled time of the current tick since start, free of execution drift"""
+        return self.tick_index * self.period
+
+    def wait_next(self) -> bool:
+        """Block until the next tick's deadline and advance the schedule
+
+        Returns False without advancing if the wake event interrupted the wait.
+        """
+        if self.wake_event is not None and self.wake_event.is_set():
+            return False
+        now = self.clock()
+        self.last_skipped = 0
+        if now > self.next_deadline:
+            self.overruns += 1
+            CONTROL_TICK_OVERRUNS.inc()
+            missed = math.floor((now - self.next_deadline) / self.period)
+            if missed > 0 and not self.catch_up:
+                self.next_deadline += missed * self.period
+                self.tick_index += missed
+                self.skipped_ticks += missed
+                self.last_skipped = missed
+                CONTROL_TICKS_SKIPPED.inc(missed)
+        elif self.wake_event is not None:
+            if self.wake_event.wait(self.next_deadline - now):
+                return False
+        else:
+            self.sleep(self.next_deadline - now)
+
+        lateness = max(0.0, self.clock() - self.next_deadline)
+        self._record_jitter(lateness)
+        self.tick_index += 1
+        self.next_deadline += self.period
+        return True
+
+    def _record_jitter(self, lateness: float):
+        self._jitter_count += 1
+        self._jitter_sum += lateness
+        self._jitter_sum_sq += lateness * lateness
+        self._jitter_max = max(self._jitter_max, lateness)
+        CONTROL_TICK_JITTER_SECONDS.observe(lateness)
+
+    def stats(self) -> dict:
+        """Tick counts and jitter (lateness versus deadline) statistics in seconds"""
+        count = self._jitter_count
+        mean = self._jitter_sum / count if count else 0.0
+        variance = max(0.0, self._jitter_sum_sq / count - mean * mean) if count else 0.0
+        return {
+            'period_s': self.period,
+            'ticks': self.tick_index,
+            'overruns': self.overruns,
+            'skipped_ticks': self.skipped_ticks,
+            'jitter_mean_s': mean,
+            'jitter_std_s': math.sqrt(variance),
+            'jitter_max_s': self._jitter_max
+        }
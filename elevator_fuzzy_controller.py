@@ -178,6 +178,21 @@ class ElevatorFuzzyController:
         
         return motor_power, current_error
     
+    def warm_up(self) -> float:
+        """Run one inference in each error region with each delta sign, as a trip would
+
+        Done at startup so the first trip does not pay the first-call costs of the
+        rule evaluation. Returns the time it took in seconds.
+        """
+        start = time.perf_counter()
+        target = self.floor_positions['tecnico']
+        for error in (0.3, 3.0, 9.0, 15.0, 22.0, 28.0):
+            for delta in (-1.0, 0.0, 1.0):
+                self.compute_control(target - error, target, error - delta)
+        self.update_position(target, self.startup_max_power, 1, 0.0)
+        self.update_position(target, self.startup_max_power, -1)
+        return time.perf_counter() - start
+    
     def update_position(self, current_position: float, motor_power_percent: float, direction: int, elapsed_time: float = None) -> float:
         # k1 controla a direção: k1_up=+1.0 para subida, k1_down=-1.0 para descida
         k1 = self.k1_up if direction > 0 else self.k1_down
@@ -1,20 +1,68 @@
 import paho.mqtt.client as mqtt
-import json
+import os
 import time
 import threading
 from typing import Optional, Callable
 from elevator_fuzzy_controller import ElevatorFuzzyController
+from control_scheduler import FixedRateScheduler
+from trip_handle import TripHandle
+from tracer import TRACER
+from mqtt_publisher import MqttPublisher
+from telemetry_codec import decode_payload
+from metrics import (COMPUTE_CONTROL_SECONDS, CONTROL_TICK_SECONDS, EMERGENCY_STOP_LATENCY_SECONDS,
+                     FLOOR_REQUEST_TO_START_SECONDS)
+
+# Single-car topics, used when the car is not part of a building
+LEGACY_TOPICS = {
+    'floor_request': 'elevator/floor_request',
+    'position_update': 'elevator/position_update',
+    'status_update': 'elevator/status_update',
+    'emergency_stop': 'elevator/emergency_stop'
+}
+
+
+def car_number(car_id: str) -> str:
+    """Topic segment of a car: 'car_2' -> '2'"""
+    return car_id[4:] if car_id.startswith('car_') else car_id
+
+
+def car_topics(building_id: Optional[str], car_id: str) -> dict:
+    """Topics of one car: building/{id}/car/{n}/<name>, or the legacy elevator/<name>"""
+    if not building_id:
+        return dict(LEGACY_TOPICS)
+    prefix = f"building/{building_id}/car/{car_number(car_id)}"
+    return {name: f"{prefix}/{name}" for name in LEGACY_TOPICS}
+
 
 class ElevatorMQTTClient:
     """
     MQTT client for real-time elevator control communication
+
+    With a building id (argument or ELEVATOR_BUILDING_ID) the car uses the
+    building/{id}/car/{n}/... topics. Cars of a building can share one
+    connection: pass connection=BuildingConnection(...) (mqtt_building.py),
+    which routes their commands and publishes their telemetry on one client.
     """
     
-    def __init__(self, broker_host: str = "localhost", broker_port: int = 1883):
+    def __init__(self, broker_host: str = "localhost", broker_port: int = 1883, car_id: str = "car_1",
+                 publisher: Optional[MqttPublisher] = None, building_id: Optional[str] = None,
+                 connection=None):
+        self.car_id = car_id
         self.broker_host = broker_host
         self.broker_port = broker_port
-        self.client = mqtt.Client()
+        self.connection = connection
+        if connection is not None:
+            # Shared socket and network thread; the connection dispatches our messages
+            self.client = connection.client
+            building_id = connection.building_id
+        else:
+            self.client = mqtt.Client()
+        self.building_id = building_id or os.environ.get('ELEVATOR_BUILDING_ID')
         self.controller = ElevatorFuzzyController()
+        # Telemetry goes through the publish policy; a bank of cars may share one (batching) publisher
+        if publisher is None:
+            publisher = connection.publisher if connection is not None else MqttPublisher.from_env(self.client)
+        self.publisher = publisher
         
         # Current elevator state
         self.current_floor = "terreo"
@@ -28,23 +76,26 @@ class ElevatorMQTTClient:
         # Movement simulation state
         self.simulation_thread = None
         self.stop_simulation = False
+        self.stop_event = threading.Event()  # wakes the control loop as soon as a stop is requested
+        self.stop_requested_at = None  # perf_counter() when the pending emergency stop was received
+        self.last_stop_latency = None  # seconds from emergency_stop receipt to the zero-power tick
+        self.request_time = None  # perf_counter() at the last accepted move_to_floor
+        self.catch_up_ticks = False  # after an overrun: False skips missed ticks, True runs them back to back
+        self.last_tick_stats = None  # FixedRateScheduler.stats() of the last movement
+        self.current_trip: Optional[TripHandle] = None
         
         # Callbacks
         self.position_callback: Optional[Callable] = None
         self.status_callback: Optional[Callable] = None
         
         # MQTT topics
-        self.topics = {
-            'floor_request': 'elevator/floor_request',
-            'position_update': 'elevator/position_update',
-            'status_update': 'elevator/status_update',
-            'emergency_stop': 'elevator/emergency_stop'
-        }
+        self.topics = car_topics(self.building_id, car_id)
         
-        # Setup MQTT callbacks
-        self.client.on_connect = self._on_connect
-        self.client.on_message = self._on_message
-        self.client.on_disconnect = self._on_disconnect
+        # Setup MQTT callbacks (a shared connection keeps its own)
+        if connection is None:
+            self.client.on_connect = self._on_connect
+            self.client.on_message = self._on_message
+            self.client.on_disconnect = self._on_disconnect
     
     def _on_connect(self, client, userdata, flags, rc):
         """Callback for when the client receives a CONNACK response from the server"""
@@ -54,28 +105,34 @@ class ElevatorMQTTClient:
             for topic in [self.topics['floor_request'], self.topics['emergency_stop']]:
                 client.subscribe(topic)
                 print(f"Subscribed to topic: {topic}")
+            # Telemetry spooled while the broker was away is replayed in order
+            if self.publisher.client is client:
+                self.publisher.connection_restored()
         else:
             print(f"Failed to connect to MQTT broker. Return code: {rc}")
     
     def _on_message(self, client, userdata, msg):
         """Callback for when a PUBLISH message is received from the server"""
+        received_at = time.perf_counter()
         try:
             topic = msg.topic
-            payload = json.loads(msg.payload.decode())
+            payload = decode_payload(msg.payload)
             
             if topic == self.topics['floor_request']:
                 self._handle_floor_request(payload)
             elif topic == self.topics['emergency_stop']:
-                self._handle_emergency_stop(payload)
+                self._handle_emergency_stop(payload, received_at)
                 
-        except json.JSONDecodeError:
-            print(f"Invalid JSON received on topic {msg.topic}: {msg.payload}")
+        except ValueError:
+            print(f"Invalid payload received on topic {msg.topic}: {msg.payload}")
         except Exception as e:
             print(f"Error processing message on topic {msg.topic}: {e}")
     
     def _on_disconnect(self, client, userdata, rc):
         """Callback for when the client disconnects from the broker"""
         print(f"Disconnected from MQTT broker. Return code: {rc}")
+        if self.publisher.client is client:
+            self.publisher.connection_lost()
     
     def _handle_floor_request(self, payload):
         """Handle floor request message"""
@@ -89,34 +146,48 @@ class ElevatorMQTTClient:
         except Exception as e:
             print(f"Error handling floor request: {e}")
     
-    def _handle_emergency_stop(self, payload):
+    def _handle_emergency_stop(self, payload, received_at: Optional[float] = None):
         """Handle emergency stop message"""
         print("Emergency stop activated!")
-        self.emergency_stop()
+        self.emergency_stop(received_at)
     
     def connect(self):
         """Connect to the MQTT broker"""
+        if self.connection is not None:
+            return self.connection.connect()
+        # paho reconnects by itself after a drop, backing off up to 30s
+        self.client.reconnect_delay_set(min_delay=1, max_delay=30)
         try:
             self.client.connect(self.broker_host, self.broker_port, 60)
             self.client.loop_start()
             return True
         except Exception as e:
             print(f"Failed to connect to MQTT broker: {e}")
+            # Keep trying in the background; telemetry is spooled until it succeeds
+            self.client.connect_async(self.broker_host, self.broker_port, 60)
+            self.client.loop_start()
             return False
     
     def disconnect(self):
         """Disconnect from the MQTT broker"""
-        self.stop_simulation = True
+        self._cancel_movement()
         if self.simulation_thread and self.simulation_thread.is_alive():
             self.simulation_thread.join()
+        if self.connection is not None:
+            # The connection is the building's; its owner disconnects it
+            return
         self.client.loop_stop()
         self.client.disconnect()
     
-    def move_to_floor(self, target_floor: str):
-        """Initiate movement to target floor"""
+    def move_to_floor(self, target_floor: str) -> TripHandle:
+        """Initiate movement to target floor
+
+        Returns a TripHandle that is truthy if the movement started; use
+        result(timeout), await or cancel() on it to follow the trip.
+        """
         if self.is_moving:
             print("Elevator is already moving")
-            return False
+            return TripHandle.rejected(self.car_id, target_floor, "Elevator is already moving")
         
         try:
             # Validate floor
@@ -124,27 +195,46 @@ class ElevatorMQTTClient:
             
             if abs(target_position - self.current_position) < 0.1:
                 print(f"Already at floor {target_floor}")
-                return False
+                return TripHandle.rejected(self.car_id, target_floor, f"Already at floor {target_floor}")
+            
+            self.current_trip = TripHandle(self.car_id, self.current_floor, target_floor,
+                                           self.current_position, target_position)
+            self.current_trip.set_cancel_callback(self._cancel_movement)
             
             self.target_floor = target_floor
             self.target_position = target_position
             self.direction = 1 if target_position > self.current_position else -1
             self.is_moving = True
             self.previous_error = target_position - self.current_position
+            self.request_time = time.perf_counter()
             
             # Start simulation in a separate thread
             self.stop_simulation = False
+            self.stop_event.clear()
+            self.stop_requested_at = None
             self.simulation_thread = threading.Thread(target=self._run_movement_simulation)
             self.simulation_thread.start()
             
             # Publish status update
             self._publish_status_update()
             
-            return True
+            return self.current_trip
             
         except ValueError as e:
             print(f"Invalid floor request: {e}")
-            return False
+            return TripHandle.rejected(self.car_id, target_floor, f"Invalid floor request: {e}")
+    
+    async def move_to_floor_async(self, target_floor: str) -> TripHandle:
+        """Start a movement and wait for it to finish without blocking the event loop"""
+        trip = self.move_to_floor(target_floor)
+        if trip:
+            await trip
+        return trip
+    
+    def _cancel_movement(self):
+        """Stop the running movement where it is (TripHandle.cancel, emergency_stop)"""
+        self.stop_simulation = True
+        self.stop_event.set()
     
     def _run_movement_simulation(self):
         """Run the real-time movement simulation"""
@@ -153,32 +243,47 @@ class ElevatorMQTTClient:
         iteration = 0
         
         print(f"Starting movement from {self.current_floor} to {self.target_floor}")
+        scheduler = FixedRateScheduler(self.controller.sampling_time, catch_up=self.catch_up_ticks,
+                                       wake_event=self.stop_event)
         
         while (not self.stop_simulation and 
                iteration < max_iterations and 
                abs(self.target_position - self.current_position) > tolerance):
             
             try:
+                tick_start = time.perf_counter()
+                tick_mark = mark = TRACER.mark()
+                if iteration == 0:
+                    FLOOR_REQUEST_TO_START_SECONDS.observe(tick_start - self.request_time)
+                
                 # Compute fuzzy control
                 motor_power, current_error = self.controller.compute_control(
                     self.current_position, 
                     self.target_position, 
                     self.previous_error
                 )
+                COMPUTE_CONTROL_SECONDS.observe(time.perf_counter() - tick_start)
+                mark = TRACER.span('fuzzy_compute', mark)
                 
-                # Update position
-                self.current_position = self.controller.update_position(
-                    self.current_position, 
-                    motor_power, 
-                    self.direction
-                )
+                # Update position, holding the power over periods the scheduler skipped
+                for _ in range(1 + scheduler.last_skipped):
+                    self.current_position = self.controller.update_position(
+                        self.current_position, 
+                        motor_power, 
+                        self.direction
+                    )
+                TRACER.span('position_update', mark)
+                
+                self.current_trip.record_tick(self.current_position, motor_power)
                 
                 # Update previous error
+                delta_error = abs(current_error) - abs(self.previous_error)
                 self.previous_error = current_error
                 
                 # Create position update message
                 position_data = {
                     'timestamp': time.time(),
+                    'car_id': self.car_id,
                     'current_position': self.current_position,
                     'target_position': self.target_position,
                     'current_floor': self._get_nearest_floor(),
@@ -186,30 +291,49 @@ class ElevatorMQTTClient:
                     'motor_power': motor_power,
                     'error': current_error,
                     'direction': 'up' if self.direction > 0 else 'down',
-                    'is_moving': True
+                    'is_moving': True,
+                    'delta_error': delta_error,
+                    'control_phase': 'fuzzy'
                 }
                 
                 # Publish position update
+                mark = TRACER.mark()
                 self._publish_position_update(position_data)
+                mark = TRACER.span('mqtt_publish', mark)
                 
                 # Call position callback if set
                 if self.position_callback:
                     self.position_callback(position_data)
+                TRACER.span('callback_dispatch', mark)
                 
                 iteration += 1
-                time.sleep(self.controller.sampling_time)
+                CONTROL_TICK_SECONDS.observe(time.perf_counter() - tick_start)
+                if tick_mark:
+                    TRACER.span('control_tick', tick_mark, args={'car_id': self.car_id, 'iteration': iteration - 1})
+                sleep_mark = TRACER.mark()
+                scheduler.wait_next()
+                TRACER.span('sleep', sleep_mark)
                 
             except Exception as e:
                 print(f"Error in movement simulation: {e}")
                 break
         
         # Movement completed or stopped
+        emergency = self.stop_requested_at is not None
+        if emergency:
+            # This frame is the first zero-power command after the stop
+            self.last_stop_latency = time.perf_counter() - self.stop_requested_at
+            EMERGENCY_STOP_LATENCY_SECONDS.observe(self.last_stop_latency)
+            self.stop_requested_at = None
+        
+        self.last_tick_stats = scheduler.stats()
         self.is_moving = False
         self.direction = 0
         self.current_floor = self._get_nearest_floor()
         
         final_data = {
             'timestamp': time.time(),
+            'car_id': self.car_id,
             'current_position': self.current_position,
             'target_position': self.target_position,
             'current_floor': self.current_floor,
@@ -220,16 +344,29 @@ class ElevatorMQTTClient:
             'is_moving': False,
             'movement_completed': True
         }
+        if emergency:
+            final_data['emergency_stopped'] = True
+            final_data['stop_latency_ms'] = self.last_stop_latency * 1000
+            # Emergency stop abandons the target
+            self.target_floor = None
+            self.target_position = None
         
         self._publish_position_update(final_data)
-        self._publish_status_update()
-        
         if self.position_callback:
             self.position_callback(final_data)
         
+        self._publish_status_update()
+        
         print(f"Movement completed. Current floor: {self.current_floor}")
         print(f"Final position: {self.current_position:.2f}m")
-        print(f"Final error: {abs(self.target_position - self.current_position)*1000:.1f}mm")
+        print(f"Final error: {abs(final_data['error'])*1000:.1f}mm")
+        if emergency:
+            print(f"Emergency stop latency: {self.last_stop_latency*1000:.2f}ms")
+        stats = self.last_tick_stats
+        print(f"Control ticks: {stats['ticks']}, overruns: {stats['overruns']}, skipped: {stats['skipped_ticks']}, "
+              f"jitter mean/max: {stats['jitter_mean_s']*1000:.2f}/{stats['jitter_max_s']*1000:.2f}ms")
+        
+        self.current_trip.complete(self.current_position, stats)
     
     def _get_nearest_floor(self) -> str:
         """Get the nearest floor name based on current position"""
@@ -245,9 +382,9 @@ class ElevatorMQTTClient:
         return nearest_floor
     
     def _publish_position_update(self, data: dict):
-        """Publish position update to MQTT"""
+        """Publish position update to MQTT, as far as the publish policy admits it"""
         try:
-            self.client.publish(self.topics['position_update'], json.dumps(data))
+            self.publisher.publish_position(self.topics['position_update'], self.car_id, data)
         except Exception as e:
             print(f"Error publishing position update: {e}")
     
@@ -256,6 +393,7 @@ class ElevatorMQTTClient:
         try:
             status_data = {
                 'timestamp': time.time(),
+                'car_id': self.car_id,
                 'current_floor': self.current_floor,
                 'target_floor': self.target_floor,
                 'is_moving': self.is_moving,
@@ -263,7 +401,7 @@ class ElevatorMQTTClient:
                 'current_position': self.current_position
             }
             
-            self.client.publish(self.topics['status_update'], json.dumps(status_data))
+            self.publisher.publish_status(self.topics['status_update'], status_data)
             
             if self.status_callback:
                 self.status_callback(status_data)
@@ -271,8 +409,20 @@ class ElevatorMQTTClient:
         except Exception as e:
             print(f"Error publishing status update: {e}")
     
-    def emergency_stop(self):
-        """Emergency stop the elevator"""
+    def emergency_stop(self, received_at: Optional[float] = None):
+        """Emergency stop the elevator
+
+        received_at is the perf_counter() timestamp at which the stop command
+        arrived; the latency to the first zero-power tick is measured from it.
+        """
+        if self.is_moving:
+            # The control loop wakes at once and publishes the zero-power frame itself
+            self.stop_requested_at = received_at if received_at is not None else time.perf_counter()
+            if self.current_trip is None or not self.current_trip.cancel():
+                self._cancel_movement()
+            print("Emergency stop executed!")
+            return
+        
         self.stop_simulation = True
         self.is_moving = False
         self.direction = 0
@@ -281,6 +431,7 @@ class ElevatorMQTTClient:
         
         emergency_data = {
             'timestamp': time.time(),
+            'car_id': self.car_id,
             'current_position': self.current_position,
             'current_floor': self._get_nearest_floor(),
             'emergency_stopped': True,
@@ -333,19 +484,17 @@ def test_mqtt_client():
             # Test movement
             time.sleep(2)
             print("\n--- Testing movement to Andar 3 ---")
-            mqtt_client.move_to_floor('andar_3')
+            trip = mqtt_client.move_to_floor('andar_3')
             
             # Wait for movement to complete
-            while mqtt_client.is_moving:
-                time.sleep(1)
+            print(f"Trip KPIs: {trip.result(timeout=70)}")
             
             time.sleep(2)
             print("\n--- Testing movement back to Terreo ---")
-            mqtt_client.move_to_floor('terreo')
+            trip = mqtt_client.move_to_floor('terreo')
             
             # Wait for movement to complete
-            while mqtt_client.is_moving:
-                time.sleep(1)
+            print(f"Trip KPIs: {trip.result(timeout=70)}")
             
             print("\nTest completed successfully!")
             
@@ -0,0 +1,399 @@
+"""
+Load test for the FastAPI/WebSocket service
+Opens N dashboard WebSocket clients and M floor-request streams against the
+app (spawned locally, run in-process, or an already running URL) and writes a
+JSON report with frame latency percentiles, dropped frames (gaps in the
+broadcast sequence numbers) and server CPU/memory. Runs fully offline: a
+started server talks to an in-process MQTT broker unless --external-broker.
+
+    python load_test.py --clients 50 --request-streams 2 --duration 30
+    python load_test.py --url http://127.0.0.1:8000 --server-pid 1234
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from datetime import datetime
+from typing import List, Optional
+
+import websockets
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+FLOORS = ['terreo'] + [f'andar_{i}' for i in range(1, 9)]
+
+
+def percentiles(values: List[float]) -> dict:
+    """p50/p99/p999, mean and max of a list of samples"""
+    if not values:
+        return {'count': 0, 'p50': None, 'p99': None, 'p999': None, 'mean': None, 'max': None}
+    ordered = sorted(values)
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    return {'count': len(ordered), 'p50': pick(50), 'p99': pick(99), 'p999': pick(99.9),
+            'mean': sum(ordered) / len(ordered), 'max': ordered[-1]}
+
+
+class ProcessSampler:
+    """Samples CPU and resident memory of the server process tree in the background"""
+
+    def __init__(self, pid: Optional[int], interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.cpu_percent: List[float] = []
+        self.rss_mb: List[float] = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _pids(self) -> List[int]:
+        """Server pid plus its children (e.g. the ELEVATOR_ENGINE=process worker)"""
+        pids = [self.pid]
+        try:
+            with open(f'/proc/{self.pid}/task/{self.pid}/children') as f:
+                pids += [int(pid) for pid in f.read().split()]
+        except OSError:
+            pass
+        return pids
+
+    def _read_pid(self, pid: int):
+        """(cpu seconds, rss bytes) of one process, or None"""
+        if PSUTIL_AVAILABLE:
+            try:
+                process = psutil.Process(pid)
+                times = process.cpu_times()
+                return times.user + times.system, process.memory_info().rss
+            except psutil.Error:
+                return None
+        try:
+            # Linux fallback without psutil
+            with open(f'/proc/{pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+            return cpu, int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def _read(self):
+        """(cpu seconds, rss bytes) summed over the server's process tree, or None"""
+        if PSUTIL_AVAILABLE:
+            try:
+                pids = [self.pid] + [child.pid for child in psutil.Process(self.pid).children(recursive=True)]
+            except psutil.Error:
+                return None
+        else:
+            pids = self._pids()
+        samples = [sample for sample in map(self._read_pid, pids) if sample is not None]
+        if not samples:
+            return None
+        return sum(cpu for cpu, _ in samples), sum(rss for _, rss in samples)
+
+    def start(self):
+        if self.pid is None or self._read() is None:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        last_cpu, _ = self._read()
+        last_time = time.monotonic()
+        while not self._stop.wait(self.interval):
+            sample = self._read()
+            if sample is None:
+                break
+            now = time.monotonic()
+            # A child that exited takes its CPU time with it; never report negative load
+            self.cpu_percent.append(max(0.0, sample[0] - last_cpu) / (now - last_time) * 100)
+            self.rss_mb.append(sample[1] / 1024 / 1024)
+            last_cpu, last_time = sample[0], now
+
+    def stop(self) -> dict:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if not self.cpu_percent:
+            return {'pid': self.pid, 'samples': 0}
+        return {
+            'pid': self.pid,
+            'samples': len(self.cpu_percent),
+            'cpu_percent_mean': sum(self.cpu_percent) / len(self.cpu_percent),
+            'cpu_percent_max': max(self.cpu_percent),
+            'rss_mb_mean': sum(self.rss_mb) / len(self.rss_mb),
+            'rss_mb_max': max(self.rss_mb)
+        }
+
+
+class WebSocketClient:
+    """One dashboard connection: counts frames, gaps and frame latency"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.connected = False
+        self.frames = 0
+        self.dropped = 0
+        self.latencies_ms: List[float] = []
+        self.error = None
+        self.last_seq = None
+
+    async def run(self, stop_at: float):
+        try:
+            async with websockets.connect(self.url, max_size=None) as ws:
+                self.connected = True
+                while time.monotonic() < stop_at:
+                    try:
+                        text = await asyncio.wait_for(ws.recv(), max(0.05, stop_at - time.monotonic()))
+                    except asyncio.TimeoutError:
+                        break
+                    self._on_frame(json.loads(text))
+        except Exception as e:
+            self.error = str(e)
+
+    def _on_frame(self, message: dict):
+        seq = message.get('seq')
+        if message.get('type') in ('initial_status', 'movement_data', 'resumed'):
+            # Snapshot: the stream continues after this sequence number
+            if seq is not None:
+                self.last_seq = seq
+            return
+        if seq is None:
+            return  # personal replies are not part of the broadcast stream
+        self.frames += 1
+        if message.get('coalesced'):
+            pass  # a rate-limited frame sent late, behind newer frames of other topics
+        else:
+            if self.last_seq is not None and seq > self.last_seq + 1:
+                self.dropped += seq - self.last_seq - 1
+            self.last_seq = seq
+        data = message.get('data')
+        if isinstance(data, dict) and 'timestamp' in data:
+            self.latencies_ms.append((time.time() - data['timestamp']) * 1000)
+
+
+class RequestStream:
+    """Sends floor requests at a fixed rate over REST or a WebSocket"""
+
+    def __init__(self, base_url: str, ws_url: str, rate: float, mode: str):
+        self.base_url = base_url
+        self.ws_url = ws_url
+        self.rate = rate
+        self.mode = mode
+        self.sent = 0
+        self.accepted = 0
+        self.errors = 0
+        self.latencies_ms: List[float] = []
+
+    def _post(self, floor: str) -> bool:
+        request = urllib.request.Request(f'{self.base_url}/api/move-to-floor', method='POST',
+                                         data=json.dumps({'floor': floor}).encode(),
+                                         headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return json.loads(response.read()).get('success', False)
+
+    async def run(self, stop_at: float):
+        ws = None
+        try:
+            if self.mode == 'ws':
+                ws = await websockets.connect(self.ws_url, max_size=None)
+            while time.monotonic() < stop_at:
+                floor = random.choice(FLOORS)
+                start = time.perf_counter()
+                try:
+                    if ws is not None:
+                        await ws.send(json.dumps({'type': 'floor_request', 'floor': floor}))
+                        while True:
+                            reply = json.loads(await ws.recv())
+                            if reply.get('type') == 'floor_request_response':
+                                break
+                        success = reply.get('success', False)
+                    else:
+                        success = await asyncio.to_thread(self._post, floor)
+                except Exception:
+                    self.errors += 1
+                    success = False
+                self.latencies_ms.append((time.perf_counter() - start) * 1000)
+                self.sent += 1
+                self.accepted += bool(success)
+                await asyncio.sleep(1.0 / self.rate)
+        finally:
+            if ws is not None:
+                await ws.close()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(base_url: str, timeout: float = 60.0):
+    """Poll /readyz until the car is initialized and warmed up (503 raises HTTPError, an OSError)"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f'{base_url}/readyz', timeout=2):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(f"Server at {base_url} not ready after {timeout}s")
+
+
+def start_server(args):
+    """Start the app (subprocess or in-process thread); returns (base_url, pid, stop)"""
+    port = _free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    env = dict(os.environ, ELEVATOR_ENGINE=args.engine)
+    broker = None
+    if not args.external_broker:
+        # /readyz waits for the car's broker connection, so give it one
+        from mqtt_broker import MqttBroker
+        broker = MqttBroker(port=0).start()
+        env.update(ELEVATOR_MQTT_HOST=broker.host, ELEVATOR_MQTT_PORT=str(broker.port))
+
+    if args.in_process:
+        import uvicorn
+        os.environ.update(env)
+        server = uvicorn.Server(uvicorn.Config('main:app', host='127.0.0.1', port=port, log_level='warning'))
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+
+        def stop_server():
+            server.should_exit = True
+            thread.join(10)
+        pid = os.getpid()
+    else:
+        process = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1',
+                                    '--port', str(port), '--log-level', 'warning'],
+                                   env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)))
+
+        def stop_server():
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        pid = process.pid
+
+    def stop():
+        stop_server()
+        if broker is not None:
+            broker.stop()
+
+    try:
+        _wait_ready(base_url)
+    except TimeoutError:
+        stop()
+        raise
+    time.sleep(args.startup_wait)
+    return base_url, pid, stop
+
+
+async def run_load(args, base_url: str) -> dict:
+    ws_url = base_url.replace('http', 'ws', 1) + '/ws'
+    stop_at = time.monotonic() + args.duration
+    clients = [WebSocketClient(ws_url) for _ in range(args.clients)]
+    streams = [RequestStream(base_url, ws_url, args.request_rate, args.request_mode)
+               for _ in range(args.request_streams)]
+    await asyncio.gather(*(c.run(stop_at) for c in clients), *(s.run(stop_at) for s in streams))
+
+    latencies = [v for c in clients for v in c.latencies_ms]
+    frames = sum(c.frames for c in clients)
+    return {
+        'websocket': {
+            'clients': len(clients),
+            'connected': sum(c.connected for c in clients),
+            'errors': [c.error for c in clients if c.error],
+            'frames': frames,
+            'frames_per_s': frames / args.duration,
+            'dropped_frames': sum(c.dropped for c in clients),
+            'clients_with_drops': sum(1 for c in clients if c.dropped),
+            'latency_ms': percentiles(latencies)
+        },
+        'requests': {
+            'streams': len(streams),
+            'mode': args.request_mode,
+            'sent': sum(s.sent for s in streams),
+            'accepted': sum(s.accepted for s in streams),
+            'errors': sum(s.errors for s in streams),
+            'latency_ms': percentiles([v for s in streams for v in s.latencies_ms])
+        }
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clients', type=int, default=20, help='WebSocket dashboard clients')
+    parser.add_argument('--request-streams', type=int, default=1, help='concurrent floor-request streams')
+    parser.add_argument('--request-rate', type=float, default=0.5, help='requests per second per stream')
+    parser.add_argument('--request-mode', choices=('rest', 'ws'), default='rest')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds of load')
+    parser.add_argument('--engine', choices=('thread', 'async', 'process'), default='thread',
+                        help='ELEVATOR_ENGINE for a spawned or in-process server')
+    parser.add_argument('--url', help='test an already running server instead of starting one')
+    parser.add_argument('--server-pid', type=int, help='pid to sample CPU/memory of with --url')
+    parser.add_argument('--in-process', action='store_true',
+                        help='run the app in this process (CPU figures then include the load generator)')
+    parser.add_argument('--external-broker', action='store_true',
+                        help='use the broker at ELEVATOR_MQTT_HOST/PORT instead of an in-process one')
+    parser.add_argument('--startup-wait', type=float, default=0.0,
+                        help='extra seconds to wait after the server reports ready')
+    parser.add_argument('--output', help='report path (default analysis/load_tests/load_test_<timestamp>.json)')
+    args = parser.parse_args(argv)
+
+    stop = None
+    if args.url:
+        base_url, pid = args.url.rstrip('/'), args.server_pid
+    else:
+        base_url, pid, stop = start_server(args)
+
+    print(f"Load test: {args.clients} WebSocket clients, {args.request_streams} request streams "
+          f"at {args.request_rate}/s for {args.duration:.0f}s against {base_url}")
+    sampler = ProcessSampler(pid)
+    sampler.start()
+    try:
+        results = asyncio.run(run_load(args, base_url))
+    finally:
+        server = sampler.stop()
+        if stop is not None:
+            stop()
+    server['includes_load_generator'] = bool(args.in_process)
+
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        **results,
+        'server': server
+    }
+    output = args.output or os.path.join(
+        'analysis', 'load_tests', f"load_test_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    ws, latency = results['websocket'], results['websocket']['latency_ms']
+    print(f"Frames: {ws['frames']} ({ws['frames_per_s']:.0f}/s), dropped: {ws['dropped_frames']}, "
+          f"connected: {ws['connected']}/{ws['clients']}")
+    if latency['count']:
+        print(f"Frame latency p50/p99/p999: {latency['p50']:.1f}/{latency['p99']:.1f}/{latency['p999']:.1f}ms")
+    if server.get('samples'):
+        print(f"Server CPU mean/max: {server['cpu_percent_mean']:.0f}/{server['cpu_percent_max']:.0f}%, "
+              f"RSS max: {server['rss_mb_max']:.0f}MB")
+    print(f"Report saved to {output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,53 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request, Query
+from fastapi.responses import HTMLResponse, PlainTextResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 import json
 import asyncio
 import time
-from typing import List, Dict
+from typing import List, Dict, Optional
 import uvicorn
-from elevator_fuzzy_controller import ElevatorFuzzyController
+from telemetry_stream import TelemetryStream, Subscription, MESSAGE_TOPICS
+from metrics import REGISTRY
+from tracer import TRACER
+from structured_log import StructuredLogger, configure_logging
 import threading
 import logging
+import os
 
-# Try to import MQTT client, fall back to simple controller if not available
-try:
-    from elevator_mqtt_client import ElevatorMQTTClient
-    MQTT_AVAILABLE = True
-except ImportError:
-    from simple_elevator_controller import SimpleElevatorController as ElevatorMQTTClient
-    MQTT_AVAILABLE = False
-    print("Warning: MQTT client not available, using simple controller for demonstration")
-
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# The car modules pull in skfuzzy (and through it matplotlib), which takes longer
+# to import than the rest of the server; load_car_class() imports them after startup
+MQTT_AVAILABLE = None
+
+def load_car_class():
+    """Import the MQTT client, falling back to the simple controller if it is not available"""
+    global MQTT_AVAILABLE
+    try:
+        from elevator_mqtt_client import ElevatorMQTTClient
+        MQTT_AVAILABLE = True
+    except ImportError:
+        from simple_elevator_controller import SimpleElevatorController as ElevatorMQTTClient
+        MQTT_AVAILABLE = False
+        print("Warning: MQTT client not available, using simple controller for demonstration")
+    return ElevatorMQTTClient
+
+# Car engine: "thread" (one OS thread per movement), "async" (tasks on the server loop)
+# or "process" (cars in a dedicated worker process, isolated from the web server's GIL)
+ELEVATOR_ENGINE = os.environ.get("ELEVATOR_ENGINE", "thread")
+# With the async engine, ELEVATOR_MQTT_ASYNC=1 also serves the car's MQTT topics from the server loop
+MQTT_ASYNC = os.environ.get("ELEVATOR_MQTT_ASYNC", "0") == "1"
+MQTT_BROKER_HOST = os.environ.get("ELEVATOR_MQTT_HOST", "localhost")
+MQTT_BROKER_PORT = int(os.environ.get("ELEVATOR_MQTT_PORT", "1883"))
+
+# ELEVATOR_SHARED_STATE=1 lets uvicorn run several workers: one owns the cars,
+# the others serve clients from shared memory (segment names start with the prefix)
+SHARED_STATE = os.environ.get("ELEVATOR_SHARED_STATE", "0") == "1"
+SHM_PREFIX = os.environ.get("ELEVATOR_SHM_PREFIX", "elevator")
+
+# Configure logging (ELEVATOR_LOG_LEVEL, ELEVATOR_LOG_FORMAT); records are written by a background thread
+configure_logging()
 logger = logging.getLogger(__name__)
+log = StructuredLogger(__name__)  # rate-limited records for the per-frame paths
 
 app = FastAPI(title="Elevator Fuzzy Control System", description="Real-time elevator control with fuzzy logic")
 
@@ -32,7 +57,14 @@ templates = Jinja2Templates(directory="templates")
 
 # Global variables
 mqtt_client = None
-controller = ElevatorFuzzyController()
+car_fleet = None  # AsyncCarFleet when ELEVATOR_ENGINE=async
+mqtt_transport = None  # AsyncMqttTransport when ELEVATOR_MQTT_ASYNC=1
+car_engine = None  # ProcessCarEngine when ELEVATOR_ENGINE=process
+shared_state = None  # SharedElevatorState when ELEVATOR_SHARED_STATE=1
+trip_store = None  # TripStore of finished trips (ELEVATOR_TRIP_DB), not opened by replica workers
+engine_init_task = None  # initialize_async_engine() task when ELEVATOR_ENGINE=async
+controller = None  # ElevatorFuzzyController, built on first use by get_controller()
+controller_lock = threading.Lock()
 movement_data = []
 current_status = {
     'current_floor': 'terreo',
@@ -42,23 +74,94 @@ current_status = {
     'direction': 'stopped'
 }
 
+# Startup progress reported by /readyz
+server_started_at = time.perf_counter()
+readiness = {
+    'engine': ELEVATOR_ENGINE,
+    'car_ready': False,
+    'warm': False,
+    'mqtt_connected': None,
+    'car_init_seconds': None,
+    'warm_up_seconds': None,
+    'error': None
+}
+
+def get_controller():
+    """Fuzzy controller for the dashboard and the async engine, built on first use"""
+    global controller
+    with controller_lock:
+        if controller is None:
+            # The thread engine's car already has one; floor_positions are read only
+            controller = getattr(mqtt_client, 'controller', None)
+        if controller is None:
+            from elevator_fuzzy_controller import ElevatorFuzzyController
+            controller = ElevatorFuzzyController()
+    return controller
+
+def warm_up_car(client):
+    """Run the control and broadcast paths once so the first trip does not pay their cold costs"""
+    start = time.perf_counter()
+    car_controller = getattr(client, 'controller', None)
+    if car_controller is not None:
+        # Process-engine and replica cars are warmed up where their controller lives
+        car_controller.warm_up()
+    status = client.get_current_status()
+    json.dumps({'type': 'status_update', 'data': status, 'seq': 0})
+    readiness['warm_up_seconds'] = round(time.perf_counter() - start, 4)
+    readiness['warm'] = True
+    log.info('startup.ready', "Control path ready", engine=ELEVATOR_ENGINE,
+             warm_up_s=readiness['warm_up_seconds'], since_start_s=time.perf_counter() - server_started_at)
+
 # Message queue for thread-safe communication
 message_queue = asyncio.Queue()
+server_loop = None  # event loop running message_broadcaster, set on startup
+
+def enqueue_message(message: dict):
+    """Queue a frame for broadcast from the event loop or from any other thread"""
+    if TRACER.enabled:
+        # Popped by message_broadcaster to trace the time spent in the queue
+        message['_trace_mark'] = TRACER.mark()
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        # asyncio.Queue is not thread-safe: a put from another thread would not
+        # wake the broadcaster, so hand it to the loop instead
+        if server_loop is not None:
+            server_loop.call_soon_threadsafe(message_queue.put_nowait, message)
+            return
+    message_queue.put_nowait(message)
+
+# Sequence-numbered broadcast stream used to resume WebSocket sessions
+telemetry_stream = TelemetryStream(retain=1000)
 
 class ConnectionManager:
     """Manage WebSocket connections"""
     
     def __init__(self):
         self.active_connections: List[WebSocket] = []
+        self.subscriptions: Dict[WebSocket, Subscription] = {}
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, subscription: Subscription = None):
         await websocket.accept()
+        self.subscriptions[websocket] = subscription or Subscription()
+
+    def subscribe(self, websocket: WebSocket, subscription: Subscription):
+        """Replace the topics and rates delivered to a connection"""
+        self.subscriptions[websocket] = subscription
+
+    def has_subscribers(self, topic: str) -> bool:
+        """Whether any connection currently wants frames for topic"""
+        return any(topic in s.intervals for s in list(self.subscriptions.values()))
+
+    def activate(self, websocket: WebSocket):
+        """Start delivering broadcasts to a connection once it has caught up"""
         self.active_connections.append(websocket)
         logger.info(f"WebSocket connected. Total connections: {len(self.active_connections)}")
 
     def disconnect(self, websocket: WebSocket):
         if websocket in self.active_connections:
             self.active_connections.remove(websocket)
+        self.subscriptions.pop(websocket, None)
         logger.info(f"WebSocket disconnected. Total connections: {len(self.active_connections)}")
 
     async def send_personal_message(self, message: str, websocket: WebSocket):
@@ -67,28 +170,68 @@ class ConnectionManager:
         except Exception as e:
             logger.error(f"Error sending personal message: {e}")
 
-    async def broadcast(self, message: str):
-        print(f"DEBUG: Broadcasting to {len(self.active_connections)} connections")
+    async def broadcast(self, message: str, topic: str = None, car_id: str = None):
+        """Send a frame to every connection whose subscription admits it now"""
+        now = time.monotonic()
+        sent = 0
         disconnected = []
-        for connection in self.active_connections:
+        for connection in list(self.active_connections):
+            subscription = self.subscriptions.get(connection)
+            if topic is not None and subscription is not None:
+                if subscription.offer(topic, car_id, message, now) is None:
+                    continue
             try:
                 await connection.send_text(message)
-                print(f"DEBUG: Message sent to WebSocket connection")
+                sent += 1
             except Exception as e:
-                logger.error(f"Error broadcasting to connection: {e}")
+                log.error('broadcast.send_error', "Error broadcasting to connection", rate=1.0, error=str(e))
                 disconnected.append(connection)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('broadcast.sent', "Message sent to WebSocket connections", rate=1.0,
+                      topic=topic, connections=len(self.active_connections), sent=sent)
         
         # Remove disconnected connections
         for conn in disconnected:
             self.disconnect(conn)
 
+    async def flush_pending(self):
+        """Deliver coalesced frames whose rate-limit interval has elapsed"""
+        now = time.monotonic()
+        for connection in list(self.active_connections):
+            subscription = self.subscriptions.get(connection)
+            if subscription is None or not subscription.pending:
+                continue
+            for message in subscription.due_pending(now):
+                try:
+                    await connection.send_text(message)
+                except Exception as e:
+                    logger.error(f"Error flushing to connection: {e}")
+                    self.disconnect(connection)
+                    break
+
+    def next_flush_delay(self):
+        """Seconds until the next coalesced frame is due, or None"""
+        now = time.monotonic()
+        delays = [d for d in (s.next_flush_delay(now) for s in list(self.subscriptions.values())) if d is not None]
+        return min(delays) if delays else None
+
 manager = ConnectionManager()
 
+# Web service metrics, exposed on /metrics together with the control loop ones
+BROADCAST_SECONDS = REGISTRY.histogram(
+    'elevator_broadcast_seconds', 'Time to fan one message out to all WebSocket connections')
+REGISTRY.gauge('elevator_message_queue_depth', 'Messages waiting in the broadcast queue',
+               lambda: message_queue.qsize())
+REGISTRY.gauge('elevator_websocket_connections', 'Active WebSocket connections',
+               lambda: len(manager.active_connections))
+
+# Fields of a position frame forwarded on the 'fuzzy' topic
+FUZZY_FIELDS = ('timestamp', 'car_id', 'error', 'delta_error', 'motor_power', 'control_phase')
+
 def position_update_handler(data):
     """Handle position updates from MQTT client - thread-safe"""
     global movement_data, current_status
-    
-    print(f"DEBUG: Position update received - pos: {data.get('current_position'):.2f}m, motor: {data.get('motor_power'):.1f}%")
+    mark = TRACER.mark()
     
     # Update current status
     current_status.update({
@@ -99,6 +242,9 @@ def position_update_handler(data):
         'direction': data.get('direction', current_status['direction'])
     })
     
+    if shared_state is not None and shared_state.owner:
+        shared_state.publish('position', data.get('car_id', 'car_1'), data, current_status)
+    
     # Add to movement data with timestamp
     movement_data.append({
         'timestamp': data.get('timestamp', time.time()),
@@ -113,94 +259,257 @@ def position_update_handler(data):
     
     # Put message in queue for async processing
     try:
-        message_queue.put_nowait({
+        enqueue_message({
             'type': 'position_update',
             'data': data
         })
-        print(f"DEBUG: Position update queued for broadcast")
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('position.queued', "Position update queued for broadcast", rate=1.0,
+                      car_id=data.get('car_id'), position=data.get('current_position'),
+                      motor_power=data.get('motor_power'), queue_depth=message_queue.qsize())
+        # Fuzzy internals are only framed when some client asked for them
+        if 'control_phase' in data and manager.has_subscribers('fuzzy'):
+            enqueue_message({
+                'type': 'fuzzy_update',
+                'data': {key: data[key] for key in FUZZY_FIELDS if key in data}
+            })
     except asyncio.QueueFull:
-        print(f"DEBUG: Message queue full, dropping position update")
+        log.warning('position.dropped', "Message queue full, dropping position update", rate=1.0)
+    TRACER.span('position_update_handler', mark, 'web')
 
 def status_update_handler(data):
     """Handle status updates from MQTT client - thread-safe"""
     global current_status
-    
-    print(f"DEBUG: Status update received - is_moving: {data.get('is_moving')}, floor: {data.get('current_floor')}")
+    mark = TRACER.mark()
     
     current_status.update(data)
+    if shared_state is not None and shared_state.owner:
+        shared_state.publish('status', data.get('car_id', 'car_1'), data, current_status)
     
     # Put message in queue for async processing
     try:
-        message_queue.put_nowait({
+        enqueue_message({
             'type': 'status_update',
             'data': data
         })
-        print(f"DEBUG: Status update queued for broadcast")
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('status.queued', "Status update queued for broadcast", rate=5.0,
+                      car_id=data.get('car_id'), is_moving=data.get('is_moving'), floor=data.get('current_floor'))
     except asyncio.QueueFull:
-        print(f"DEBUG: Message queue full, dropping status update")
+        log.warning('status.dropped', "Message queue full, dropping status update", rate=1.0)
+    TRACER.span('status_update_handler', mark, 'web')
 
 async def message_broadcaster():
     """Background task to process message queue and broadcast to WebSockets"""
     while True:
         try:
-            # Wait for messages in the queue
-            message = await message_queue.get()
+            # Wait for messages in the queue, waking early to flush coalesced frames
+            flush_delay = manager.next_flush_delay()
+            try:
+                message = await asyncio.wait_for(message_queue.get(), flush_delay)
+            except asyncio.TimeoutError:
+                await manager.flush_pending()
+                continue
             
-            # Broadcast the message
-            await manager.broadcast(json.dumps(message))
-            print(f"DEBUG: Message broadcasted: {message['type']}")
+            # Number and retain the frame, then broadcast it
+            broadcast_start = time.perf_counter()
+            mark = TRACER.async_span('queue_wait', message.pop('_trace_mark', 0), 'web', {'type': message['type']})
+            _, text = telemetry_stream.publish(message)
+            mark = TRACER.span('stream_publish', mark, 'web')
+            data = message.get('data')
+            await manager.broadcast(text, MESSAGE_TOPICS.get(message['type']),
+                                    data.get('car_id') if isinstance(data, dict) else None)
+            BROADCAST_SECONDS.observe(time.perf_counter() - broadcast_start)
+            if mark:
+                mark = TRACER.span('broadcast', mark, 'web', {'type': message['type'],
+                                                             'connections': len(manager.active_connections)})
+            await manager.flush_pending()
+            TRACER.span('flush_pending', mark, 'web')
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug('broadcaster.sent', "Message broadcasted", rate=1.0,
+                          type=message['type'], seq=message.get('seq'))
             
             # Mark task as done
             message_queue.task_done()
             
         except Exception as e:
-            print(f"DEBUG: Error in message broadcaster: {e}")
+            log.error('broadcaster.error', "Error in message broadcaster", rate=1.0, error=str(e))
             await asyncio.sleep(0.1)
 
 def initialize_mqtt():
     """Initialize MQTT client with handlers"""
     global mqtt_client
     
+    init_start = time.perf_counter()
+    car_class = load_car_class()
     if MQTT_AVAILABLE:
-        mqtt_client = ElevatorMQTTClient()
-    else:
-        mqtt_client = ElevatorMQTTClient()
+        readiness['mqtt_connected'] = False  # until connect() below succeeds
+    client = car_class(MQTT_BROKER_HOST, MQTT_BROKER_PORT) if MQTT_AVAILABLE else car_class()
+    readiness['car_init_seconds'] = round(time.perf_counter() - init_start, 4)
     
     # Set handlers
-    mqtt_client.position_callback = position_update_handler
-    mqtt_client.status_callback = status_update_handler
+    client.position_callback = position_update_handler
+    client.status_callback = status_update_handler
+    warm_up_car(client)
+    mqtt_client = client
+    readiness['car_ready'] = True
+    share_car(mqtt_client)
     
     # Connect
-    if mqtt_client.connect():
+    connected = mqtt_client.connect()
+    readiness['mqtt_connected'] = connected
+    if connected:
         print("MQTT client connected successfully")
         return True
     else:
         print("Failed to connect MQTT client")
         return False
 
+async def initialize_async_engine():
+    """Run the car as a task on this event loop; callbacks then arrive on the loop directly"""
+    global mqtt_client, car_fleet, mqtt_transport
+    
+    # Import, build and warm up the controller off the loop so requests are served meanwhile
+    def prepare():
+        init_start = time.perf_counter()
+        from async_elevator import AsyncCarFleet
+        fleet = AsyncCarFleet(controller=get_controller())
+        readiness['car_init_seconds'] = round(time.perf_counter() - init_start, 4)
+        return fleet
+    
+    loop = asyncio.get_running_loop()
+    if MQTT_ASYNC:
+        # Not ready until the transport has connected
+        readiness['mqtt_connected'] = False
+    try:
+        fleet = await loop.run_in_executor(None, prepare)
+        client = fleet.add_car("car_1", loop)
+        client.position_callback = position_update_handler
+        client.status_callback = status_update_handler
+        await loop.run_in_executor(None, warm_up_car, client)
+    except Exception as e:
+        readiness['error'] = str(e)
+        raise
+    car_fleet = fleet
+    mqtt_client = client
+    readiness['car_ready'] = True
+    share_car(mqtt_client)
+    print("Async car engine started")
+    
+    if MQTT_ASYNC:
+        from async_mqtt import AsyncMqttTransport, attach_car
+        mqtt_transport = AsyncMqttTransport(MQTT_BROKER_HOST, MQTT_BROKER_PORT)
+        attach_car(mqtt_transport, client)
+        await mqtt_transport.start()
+        readiness['mqtt_connected'] = await mqtt_transport.wait_connected()
+
+def initialize_process_engine():
+    """Start the engine process; its telemetry reader thread calls the handlers"""
+    global mqtt_client, car_engine
+    from process_engine import ProcessCarEngine
+    
+    init_start = time.perf_counter()
+    car_engine = ProcessCarEngine(["car_1"]).start()
+    readiness['car_init_seconds'] = round(time.perf_counter() - init_start, 4)
+    client = car_engine.car("car_1")
+    client.position_callback = position_update_handler
+    client.status_callback = status_update_handler
+    warm_up_car(client)
+    mqtt_client = client
+    readiness['car_ready'] = True
+    share_car(client)
+
+def share_car(client):
+    """As shared-state owner, let replica workers command this car"""
+    if shared_state is not None and shared_state.owner:
+        shared_state.serve_commands({"car_1": client})
+
+def initialize_replica():
+    """Serve clients from the owner worker's shared state instead of running cars"""
+    global mqtt_client
+    current_status.update(shared_state.read_status() or {})
+    client = shared_state.car("car_1")
+    client.position_callback = position_update_handler
+    client.status_callback = status_update_handler
+    warm_up_car(client)
+    mqtt_client = client
+    readiness['car_ready'] = True
+    # Replays the retained telemetry first, which rebuilds movement_data
+    shared_state.follow()
+    print("Replica worker following shared state")
+
+def engine_init_done(task: asyncio.Task):
+    """Report an async engine that failed to start; /readyz then stays 503"""
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error is not None:
+        readiness['error'] = readiness['error'] or str(error)
+        log.error('startup.failed', "Async car engine failed to start", error=repr(error))
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize services on startup"""
+    global server_loop, shared_state, trip_store, engine_init_task
+    server_loop = asyncio.get_running_loop()
+    
     # Start message broadcaster
     asyncio.create_task(message_broadcaster())
     
-    # Initialize MQTT in a separate thread
-    def init_mqtt():
-        initialize_mqtt()
+    if SHARED_STATE:
+        from shared_state import SharedElevatorState
+        shared_state = SharedElevatorState.open(SHM_PREFIX)
+        if not shared_state.owner:
+            initialize_replica()
+            return
+    
+    # Every trip the cars of this worker finish goes to the trip history
+    from trip_store import TripStore
+    from trip_handle import add_trip_listener
+    trip_store = TripStore.from_env()
+    if trip_store is not None:
+        add_trip_listener(trip_store.record_trip)
     
-    mqtt_thread = threading.Thread(target=init_mqtt, daemon=True)
+    if ELEVATOR_ENGINE == "async":
+        engine_init_task = asyncio.create_task(initialize_async_engine())
+        engine_init_task.add_done_callback(engine_init_done)
+        return
+    
+    # Initialize MQTT in a separate thread; /readyz reports when it is done
+    def init_car():
+        try:
+            if ELEVATOR_ENGINE == "process":
+                initialize_process_engine()
+            else:
+                initialize_mqtt()
+        except Exception as e:
+            readiness['error'] = str(e)
+            print(f"Car initialization failed: {e}")
+    
+    mqtt_thread = threading.Thread(target=init_car, name='car-init', daemon=True)
     mqtt_thread.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
-    if mqtt_client:
+    if mqtt_transport:
+        await mqtt_transport.stop()
+    if car_fleet:
+        await car_fleet.shutdown()
+    elif car_engine:
+        car_engine.shutdown()
+    elif mqtt_client:
         mqtt_client.disconnect()
+    if shared_state:
+        shared_state.close()
+    if trip_store:
+        trip_store.close()
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     """Serve the main dashboard page"""
-    floor_positions = controller.floor_positions
+    # Before the car is up this may build the controller; keep that off the loop
+    floor_positions = (await asyncio.get_running_loop().run_in_executor(None, get_controller)).floor_positions
     available_floors = ['terreo'] + [f'andar_{i}' for i in range(1, 9)]
     
     return templates.TemplateResponse("index.html", {
@@ -211,28 +520,61 @@ async def read_root(request: Request):
     })
 
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket endpoint for real-time communication"""
-    await manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, resume_from: int = None, stream_id: str = None,
+                             topics: str = None, cars: str = None):
+    """WebSocket endpoint for real-time communication
+
+    Clients reconnecting with ``resume_from`` (and the ``stream_id`` they were
+    given) receive only the frames they missed; if the gap is no longer in the
+    retained buffer they get a fresh snapshot instead. ``topics`` (for example
+    ``status:1,position:5``) and ``cars`` select the initial subscription, which
+    can later be changed with a ``subscribe`` message.
+    """
+    subscription = None
+    if topics:
+        try:
+            subscription = Subscription.from_request(topics, cars.split(',') if cars else None)
+        except ValueError as e:
+            # Never fall back to every topic at full rate for a request the client got wrong
+            await websocket.accept()
+            await websocket.send_text(json.dumps({'type': 'error', 'message': f"Invalid subscription: {e}"}))
+            await websocket.close(code=1008)
+            return
+    await manager.connect(websocket, subscription)
     
     try:
-        # Send initial status
-        await manager.send_personal_message(json.dumps({
-            'type': 'initial_status',
-            'data': current_status
-        }), websocket)
+        missed = None
+        if resume_from is not None:
+            missed = telemetry_stream.frames_since(resume_from, stream_id)
         
-        # Send recent movement data
-        await manager.send_personal_message(json.dumps({
-            'type': 'movement_data',
-            'data': movement_data[-100:] if movement_data else []
-        }), websocket)
+        if missed is None:
+            last_seq = await send_snapshot(websocket)
+        else:
+            await manager.send_personal_message(json.dumps({
+                'type': 'resumed',
+                'stream_id': telemetry_stream.stream_id,
+                'resume_from': resume_from,
+                'missed': len(missed)
+            }), websocket)
+            last_seq = resume_from
+        
+        # Replay until caught up; the final check and activation happen without
+        # awaiting, so no frame can slip in between
+        while True:
+            missed = telemetry_stream.frames_since(last_seq)
+            if not missed:
+                break
+            for seq, text in manager.subscriptions[websocket].filter_replay(missed):
+                await manager.send_personal_message(text, websocket)
+            last_seq = missed[-1][0]
+        manager.activate(websocket)
         
         while True:
             data = await websocket.receive_text()
+            received_at = time.perf_counter()
             try:
                 message = json.loads(data)
-                await handle_websocket_message(message, websocket)
+                await handle_websocket_message(message, websocket, received_at)
             except json.JSONDecodeError:
                 await manager.send_personal_message(json.dumps({
                     'type': 'error',
@@ -242,14 +584,41 @@ async def websocket_endpoint(websocket: WebSocket):
     except WebSocketDisconnect:
         manager.disconnect(websocket)
 
-async def handle_websocket_message(message: dict, websocket: WebSocket):
-    """Handle incoming WebSocket messages"""
+async def send_snapshot(websocket: WebSocket) -> int:
+    """Send the full current state to a client and return the stream position it reflects"""
+    seq = telemetry_stream.seq
+    
+    # Send initial status
+    await manager.send_personal_message(json.dumps({
+        'type': 'initial_status',
+        'stream_id': telemetry_stream.stream_id,
+        'seq': seq,
+        'data': current_status
+    }), websocket)
+    
+    # Send recent movement data
+    await manager.send_personal_message(json.dumps({
+        'type': 'movement_data',
+        'seq': seq,
+        'data': movement_data[-100:] if movement_data else []
+    }), websocket)
+    
+    return seq
+
+async def car_call(method, *args):
+    """Call a car command; a proxy's commands are IPC round trips, so they run off the event loop"""
+    if getattr(mqtt_client, 'remote', False):
+        return await asyncio.get_running_loop().run_in_executor(None, method, *args)
+    return method(*args)
+
+async def handle_websocket_message(message: dict, websocket: WebSocket, received_at: Optional[float] = None):
+    """Handle incoming WebSocket messages (received_at: perf_counter() at receipt)"""
     message_type = message.get('type')
     
     if message_type == 'floor_request':
         floor = message.get('floor')
         if floor and mqtt_client:
-            success = mqtt_client.move_to_floor(floor)
+            success = bool(await car_call(mqtt_client.move_to_floor, floor))
             await manager.send_personal_message(json.dumps({
                 'type': 'floor_request_response',
                 'success': success,
@@ -265,21 +634,81 @@ async def handle_websocket_message(message: dict, websocket: WebSocket):
     
     elif message_type == 'emergency_stop':
         if mqtt_client and hasattr(mqtt_client, 'emergency_stop'):
-            mqtt_client.emergency_stop()
+            await car_call(mqtt_client.emergency_stop, received_at)
         await manager.send_personal_message(json.dumps({
             'type': 'emergency_stop_response',
             'message': 'Emergency stop activated'
         }), websocket)
     
+    elif message_type == 'subscribe':
+        try:
+            subscription = Subscription.from_request(message.get('topics'), message.get('cars'))
+        except (ValueError, TypeError, AttributeError) as e:
+            await manager.send_personal_message(json.dumps({
+                'type': 'subscribe_response',
+                'success': False,
+                'message': f'Invalid subscription: {e}'
+            }), websocket)
+            return
+        manager.subscribe(websocket, subscription)
+        await manager.send_personal_message(json.dumps({
+            'type': 'subscribe_response',
+            'success': True,
+            'subscription': subscription.describe()
+        }), websocket)
+    
     elif message_type == 'get_status':
         await manager.send_personal_message(json.dumps({
             'type': 'status_update',
             'data': current_status
         }), websocket)
 
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the server process and its event loop are responding"""
+    return {"status": "ok", "uptime_seconds": round(time.perf_counter() - server_started_at, 3)}
+
+def mqtt_connected_now() -> Optional[bool]:
+    """Current broker connection of the car's MQTT client; None when the car does not use MQTT"""
+    if mqtt_transport is not None:
+        return mqtt_transport.connected
+    paho_client = getattr(mqtt_client, 'client', None) if MQTT_AVAILABLE else None
+    if readiness['mqtt_connected'] is not None and hasattr(paho_client, 'is_connected'):
+        # paho reconnects by itself, so the result of connect() goes stale
+        return paho_client.is_connected()
+    return readiness['mqtt_connected']
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: the car is initialized, its control path has been warmed up and,
+    when it talks MQTT, it is connected to the broker"""
+    readiness['mqtt_connected'] = mqtt_connected_now()
+    if car_engine is not None and car_engine.error is not None:
+        readiness['error'] = readiness['error'] or car_engine.error
+    ready = (readiness['car_ready'] and readiness['warm'] and readiness['error'] is None
+             and readiness['mqtt_connected'] is not False)
+    if shared_state is not None and not shared_state.owner and not shared_state.owner_alive:
+        ready = False
+    body = dict(readiness, ready=ready)
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus-style metrics for the control loop and web service"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/trace")
+async def get_trace():
+    """Chrome trace-event JSON of the spans recorded so far (ELEVATOR_TRACE=1)"""
+    if not TRACER.enabled:
+        return {"success": False, "message": "Tracing is disabled; start the server with ELEVATOR_TRACE=1"}
+    return TRACER.to_chrome_trace()
+
 @app.get("/api/status")
 async def get_status():
     """Get current elevator status"""
+    if shared_state is not None and not shared_state.owner:
+        return shared_state.read_status() or current_status
     return current_status
 
 @app.get("/api/movement-data")
@@ -287,21 +716,50 @@ async def get_movement_data(limit: int = 100):
     """Get recent movement data"""
     return movement_data[-limit:] if movement_data else []
 
+@app.get("/api/trips/stats")
+async def get_trip_stats(origin: str = None, target: str = None, days: float = None,
+                         q: float = Query(0.95, gt=0, le=1)):
+    """Trip time percentile of one route, or of every route, from the trip history (0 < q <= 1)"""
+    if trip_store is None:
+        return {"success": False, "message": "Trip history is not available in this worker"}
+    since = time.time() - days * 86400 if days else 0.0
+    if origin and target:
+        from trip_store import percentile
+        times = trip_store.trip_times(origin, target, since)
+        return {"success": True, "origin": origin, "target": target, "trips": len(times),
+                "q": q, "trip_time_s": percentile(times, q) if times else None}
+    return {"success": True, "routes": trip_store.route_summary(since, q=q)}
+
 @app.post("/api/move-to-floor")
-async def move_to_floor(request: Request):
-    """Move elevator to specified floor"""
+async def move_to_floor(request: Request, wait: bool = False, timeout: float = 90.0):
+    """Move elevator to specified floor
+
+    With ``wait=true`` the request long-polls until the trip finishes (or
+    ``timeout`` seconds pass) and returns the trip KPIs.
+    """
     data = await request.json()
     floor = data.get('floor')
     
     if not floor or not mqtt_client:
         return {"success": False, "message": "Invalid request or MQTT client not available"}
     
-    success = mqtt_client.move_to_floor(floor)
-    return {
+    trip = await car_call(mqtt_client.move_to_floor, floor)
+    success = bool(trip)
+    response = {
         "success": success,
         "message": f"Movement {'started' if success else 'failed'} to floor {floor}",
         "current_status": current_status
     }
+    if not success:
+        response["reason"] = trip.reason
+    elif wait:
+        try:
+            response["trip"] = await asyncio.wait_for(trip, timeout)
+            response["message"] = f"Movement to floor {floor} {'cancelled' if trip.cancelled() else 'completed'}"
+            response["current_status"] = current_status
+        except asyncio.TimeoutError:
+            response["message"] = f"Movement to floor {floor} still running after {timeout}s"
+    return response
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
@@ -0,0 +1,217 @@
+"""
+Lightweight in-process metrics with Prometheus text exposition
+Counters and histograms keep one shard per writer thread, so the hot path
+never takes a lock: each shard has a single writer and shards are only summed
+when /metrics is scraped. When a thread ends (the thread engine starts one per
+movement) its shard is folded into a base total and dropped.
+"""
+
+import threading
+import weakref
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence
+
+# Default latency buckets in seconds (100us .. 1s)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _ShardOwner:
+    """Lives in a thread's threading.local; its finalizer retires the thread's shard"""
+
+    __slots__ = ('shard', '__weakref__')
+
+    def __init__(self, shard: List[float]):
+        self.shard = shard
+
+
+class _Sharded:
+    """Per-thread storage shared by counters and histograms"""
+
+    def __init__(self, size: int):
+        self._size = size
+        self._base = [0.0] * size  # shards of threads that have ended
+        self._shards: Dict[int, List[float]] = {}  # id(shard) -> shard of a live thread
+        self._local = threading.local()
+        self._lock = threading.RLock()
+
+    def _shard(self) -> List[float]:
+        owner = getattr(self._local, 'owner', None)
+        if owner is None:
+            # Only the first time a thread writes to this metric
+            shard = [0.0] * self._size
+            owner = self._local.owner = _ShardOwner(shard)
+            with self._lock:
+                self._shards[id(shard)] = shard
+            weakref.finalize(owner, self._retire, shard)
+        return owner.shard
+
+    def _retire(self, shard: List[float]):
+        """Fold the shard of a finished thread into the base totals"""
+        with self._lock:
+            for i, value in enumerate(shard):
+                self._base[i] += value
+            self._shards.pop(id(shard), None)
+
+    def _totals(self) -> List[float]:
+        with self._lock:
+            totals = list(self._base)
+            for shard in self._shards.values():
+                for i, value in enumerate(shard):
+                    totals[i] += value
+        return totals
+
+
+class Counter(_Sharded):
+    """Monotonically increasing counter"""
+
+    type_name = 'counter'
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(1)
+        self.name = name
+        self.documentation = documentation
+
+    def inc(self, amount: float = 1.0):
+        self._shard()[0] += amount
+
+    @property
+    def value(self) -> float:
+        return self._totals()[0]
+
+    def samples(self):
+        yield self.name, {}, self.value
+
+
+class Gauge:
+    """Point-in-time value, either set explicitly or read from a callback at scrape time"""
+
+    type_name = 'gauge'
+
+    def __init__(self, name: str, documentation: str, function: Optional[Callable[[], float]] = None):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self._value = 0.0
+
+    def set(self, value: float):
+        self._value = value
+
+    @property
+    def value(self) -> float:
+        if self.function is not None:
+            try:
+                return float(self.function())
+            except Exception:
+                return float('nan')
+        return self._value
+
+    def samples(self):
+        yield self.name, {}, self.value
+
+
+class Histogram(_Sharded):
+    """Cumulative histogram with fixed bucket boundaries"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        # Layout per shard: one slot per bucket, +Inf slot, sum, count
+        super().__init__(len(self.buckets) + 3)
+        self.name = name
+        self.documentation = documentation
+
+    def observe(self, value: float):
+        shard = self._shard()
+        shard[bisect_left(self.buckets, value)] += 1
+        shard[-2] += value
+        shard[-1] += 1
+
+    @property
+    def count(self) -> int:
+        return int(self._totals()[-1])
+
+    def snapshot(self) -> dict:
+        """Bucket counts (cumulative), sum and count"""
+        totals = self._totals()
+        cumulative = []
+        running = 0.0
+        for bound, value in zip(self.buckets + (float('inf'),), totals[:-2]):
+            running += value
+            cumulative.append((bound, running))
+        return {'buckets': cumulative, 'sum': totals[-2], 'count': totals[-1]}
+
+    def samples(self):
+        snapshot = self.snapshot()
+        for bound, value in snapshot['buckets']:
+            yield f'{self.name}_bucket', {'le': _format_value(bound)}, value
+        yield f'{self.name}_sum', {}, snapshot['sum']
+        yield f'{self.name}_count', {}, snapshot['count']
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together on /metrics"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._register(Counter(name, documentation))
+
+    def gauge(self, name: str, documentation: str, function: Optional[Callable[[], float]] = None) -> Gauge:
+        gauge = self._register(Gauge(name, documentation, function))
+        if function is not None:
+            gauge.function = function
+        return gauge
+
+    def histogram(self, name: str, documentation: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, buckets))
+
+    def get(self, name: str):
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            for sample_name, labels, value in metric.samples():
+                label_text = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                if label_text:
+                    sample_name = f'{sample_name}{{{label_text}}}'
+                lines.append(f'{sample_name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+# Control loop metrics shared by SimpleElevatorController and ElevatorMQTTClient
+COMPUTE_CONTROL_SECONDS = REGISTRY.histogram(
+    'elevator_compute_control_seconds', 'Latency of ElevatorFuzzyController.compute_control')
+CONTROL_TICK_SECONDS = REGISTRY.histogram(
+    'elevator_control_tick_seconds', 'Work time of one control loop tick, excluding the sleep')
+CONTROL_TICK_JITTER_SECONDS = REGISTRY.histogram(
+    'elevator_control_tick_jitter_seconds', 'Lateness of each control tick relative to its absolute deadline')
+FLOOR_REQUEST_TO_START_SECONDS = REGISTRY.histogram(
+    'elevator_floor_request_to_start_seconds', 'Time from move_to_floor to the first control tick')
+EMERGENCY_STOP_LATENCY_SECONDS = REGISTRY.histogram(
+    'elevator_emergency_stop_latency_seconds', 'Time from emergency_stop receipt to the first zero-power tick')
+MQTT_PUBLISH_SECONDS = REGISTRY.histogram(
+    'elevator_mqtt_publish_seconds', 'Latency of MQTT client.publish calls')
@@ -0,0 +1,306 @@
+"""
+In-process MQTT 3.1.1 broker stand-in
+Enough of the protocol for the elevator clients and paho: CONNECT with will
+messages, PUBLISH at QoS 0/1/2 with retained messages, SUBSCRIBE with + and #
+wildcards, UNSUBSCRIBE, PINGREQ and DISCONNECT. No authentication, no
+persistence, no sessions across connections; QoS 2 messages are delivered to
+subscribers at QoS 1 at most. Each PUBLISH is recorded with its size, fan-out
+and the time spent routing it, so MQTT benchmarks can run hermetically.
+
+    broker = MqttBroker(port=0).start()     # background thread, free port
+    ... ElevatorMQTTClient('127.0.0.1', broker.port) ...
+    print(broker.stats())
+    broker.stop()
+
+    python mqtt_broker.py --port 1883       # standalone, instead of Mosquitto
+"""
+
+import argparse
+import asyncio
+import itertools
+import statistics
+import struct
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from paho.mqtt.client import topic_matches_sub
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+
+def _encode_length(length: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        encoded.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(encoded)
+
+
+def _packet(first_byte: int, body: bytes) -> bytes:
+    return bytes([first_byte]) + _encode_length(len(body)) + body
+
+
+def _string(data: bytes, offset: int):
+    (length,) = struct.unpack_from('!H', data, offset)
+    start = offset + 2
+    return data[start:start + length], start + length
+
+
+def _publish_packet(topic: str, payload: bytes, qos: int, retain: bool, mid: Optional[int]) -> bytes:
+    encoded_topic = topic.encode()
+    body = struct.pack('!H', len(encoded_topic)) + encoded_topic
+    if qos:
+        body += struct.pack('!H', mid)
+    return _packet((PUBLISH << 4) | (qos << 1) | int(retain), body + payload)
+
+
+class _Session:
+    """One client connection"""
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.client_id = ''
+        self.subscriptions: Dict[str, int] = {}  # topic filter -> granted QoS
+        self.will = None  # (topic, payload, qos, retain)
+        self.mids = itertools.count(1)
+
+    def next_mid(self) -> int:
+        return next(self.mids) % 65535 + 1
+
+
+class MqttBroker:
+    """
+    Asyncio MQTT broker on its own thread (start/stop) or on a running loop (serve)
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 1883, record_limit: int = 100000):
+        self.host = host
+        self.port = port
+        self.sessions = set()
+        self.retained: Dict[str, tuple] = {}  # topic -> (payload, qos)
+        # (perf_counter at receipt, topic, payload bytes, subscribers reached, routing seconds)
+        self.records = deque(maxlen=record_limit)
+        self.connections = 0
+        self._server = None
+        self._loop = None
+        self._thread = None
+        self._started = threading.Event()
+
+    # Lifecycle
+
+    async def serve(self):
+        """Start listening on the running loop; with port 0 the chosen port is stored in self.port"""
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    def start(self) -> 'MqttBroker':
+        """Run the broker on a background thread with its own event loop"""
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.serve())
+            self._started.set()
+            loop.run_forever()
+            loop.close()
+        self._thread = threading.Thread(target=run, name='mqtt-broker', daemon=True)
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def stop(self):
+        if self._loop is None:
+            return
+        async def close():
+            self._server.close()
+            for session in list(self.sessions):
+                session.writer.close()
+            await self._server.wait_closed()
+        if self._thread is not None:
+            asyncio.run_coroutine_threadsafe(close(), self._loop).result(timeout=5)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._thread = None
+        else:
+            self._server.close()
+
+    # Connections
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        session = _Session(writer)
+        self.connections += 1
+        clean_exit = False
+        try:
+            while True:
+                first_byte = (await reader.readexactly(1))[0]
+                length, multiplier = 0, 1
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = await reader.readexactly(length) if length else b''
+                kind = first_byte >> 4
+                if kind == DISCONNECT:
+                    clean_exit = True
+                    break
+                self._handle_packet(session, kind, first_byte & 0x0F, body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.sessions.discard(session)
+            if session.will is not None and not clean_exit:
+                topic, payload, qos, retain = session.will
+                self.route(topic, payload, qos, retain)
+            writer.close()
+
+    def _handle_packet(self, session: _Session, kind: int, flags: int, body: bytes):
+        if kind == CONNECT:
+            self._connect(session, body)
+        elif kind == PUBLISH:
+            received_at = time.perf_counter()
+            qos, retain = (flags >> 1) & 0x03, bool(flags & 0x01)
+            topic, offset = _string(body, 0)
+            mid = None
+            if qos:
+                (mid,) = struct.unpack_from('!H', body, offset)
+                offset += 2
+            self.route(topic.decode(), body[offset:], qos, retain, received_at)
+            if qos == 1:
+                session.writer.write(_packet(PUBACK << 4, struct.pack('!H', mid)))
+            elif qos == 2:
+                # Routed at once; PUBREL is then only acknowledged
+                session.writer.write(_packet(PUBREC << 4, struct.pack('!H', mid)))
+        elif kind == PUBREL:
+            session.writer.write(_packet(PUBCOMP << 4, body[:2]))
+        elif kind == SUBSCRIBE:
+            self._subscribe(session, body)
+        elif kind == UNSUBSCRIBE:
+            offset = 2
+            while offset < len(body):
+                topic_filter, offset = _string(body, offset)
+                session.subscriptions.pop(topic_filter.decode(), None)
+            session.writer.write(_packet(UNSUBACK << 4, body[:2]))
+        elif kind == PINGREQ:
+            session.writer.write(_packet(PINGRESP << 4, b''))
+        # PUBACK / PUBREC / PUBCOMP from subscribers: nothing is retried, nothing to do
+
+    def _connect(self, session: _Session, body: bytes):
+        _, offset = _string(body, 0)  # protocol name
+        level, connect_flags = body[offset], body[offset + 1]
+        offset += 4  # level, flags, keepalive
+        client_id, offset = _string(body, offset)
+        session.client_id = client_id.decode()
+        if connect_flags & 0x04:
+            will_topic, offset = _string(body, offset)
+            will_payload, offset = _string(body, offset)
+            session.will = (will_topic.decode(), will_payload, (connect_flags >> 3) & 0x03,
+                            bool(connect_flags & 0x20))
+        if level not in (3, 4):
+            session.writer.write(_packet(CONNACK << 4, b'\x00\x01'))  # unacceptable protocol version
+            return
+        self.sessions.add(session)
+        session.writer.write(_packet(CONNACK << 4, b'\x00\x00'))
+
+    def _subscribe(self, session: _Session, body: bytes):
+        offset, granted = 2, bytearray()
+        new_filters = []
+        while offset < len(body):
+            topic_filter, offset = _string(body, offset)
+            qos = min(body[offset], 1)
+            offset += 1
+            session.subscriptions[topic_filter.decode()] = qos
+            new_filters.append((topic_filter.decode(), qos))
+            granted.append(qos)
+        session.writer.write(_packet(SUBACK << 4, body[:2] + bytes(granted)))
+        # Retained messages go out right after the SUBACK
+        for topic, (payload, retained_qos) in list(self.retained.items()):
+            for topic_filter, qos in new_filters:
+                if topic_matches_sub(topic_filter, topic):
+                    delivery_qos = min(qos, retained_qos)
+                    session.writer.write(_publish_packet(
+                        topic, payload, delivery_qos, True, session.next_mid() if delivery_qos else None))
+                    break
+
+    # Routing
+
+    def route(self, topic: str, payload: bytes, qos: int = 0, retain: bool = False,
+              received_at: Optional[float] = None):
+        """Deliver a message to every matching subscription (once per client)"""
+        received_at = received_at or time.perf_counter()
+        if retain:
+            if payload:
+                self.retained[topic] = (payload, qos)
+            else:
+                self.retained.pop(topic, None)
+        reached = 0
+        for session in list(self.sessions):
+            granted = [sub_qos for topic_filter, sub_qos in session.subscriptions.items()
+                       if topic_matches_sub(topic_filter, topic)]
+            if not granted:
+                continue
+            delivery_qos = min(qos, max(granted))
+            session.writer.write(_publish_packet(
+                topic, payload, delivery_qos, False, session.next_mid() if delivery_qos else None))
+            reached += 1
+        self.records.append((received_at, topic, len(payload), reached, time.perf_counter() - received_at))
+
+    # Timing
+
+    def stats(self, topic_filter: str = '#') -> dict:
+        """Message counts, rates and routing time of the recorded PUBLISHes matching topic_filter"""
+        records = [r for r in list(self.records) if topic_matches_sub(topic_filter, r[1])]
+        if not records:
+            return {'messages': 0}
+        routing = sorted(r[4] for r in records)
+        span = records[-1][0] - records[0][0]
+        return {
+            'messages': len(records),
+            'bytes': sum(r[2] for r in records),
+            'deliveries': sum(r[3] for r in records),
+            'messages_per_s': len(records) / span if span > 0 else None,
+            'routing_median_us': statistics.median(routing) * 1e6,
+            'routing_max_us': routing[-1] * 1e6,
+            'topics': len({r[1] for r in records})
+        }
+
+    def interarrival(self, topic: str) -> list:
+        """Seconds between consecutive messages on one topic, e.g. a car's position_update"""
+        times = [r[0] for r in list(self.records) if r[1] == topic]
+        return [later - earlier for earlier, later in zip(times, times[1:])]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Minimal MQTT 3.1.1 broker for local tests and benchmarks')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1883)
+    args = parser.parse_args(argv)
+
+    async def run():
+        broker = await MqttBroker(args.host, args.port).serve()
+        print(f"MQTT broker stand-in listening on {broker.host}:{broker.port}")
+        try:
+            while True:
+                await asyncio.sleep(10)
+                stats = broker.stats()
+                if stats['messages']:
+                    print(f"{len(broker.sessions)} clients, {stats['messages']} messages, "
+                          f"routing median {stats['routing_median_us']:.1f}us")
+        finally:
+            broker.stop()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+One MQTT connection for all the cars of a building
+Cars publish and receive on building/{id}/car/{n}/<topic>. The connection
+subscribes once with wildcards (building/{id}/car/+/floor_request, ...) and
+routes each message by topic to its car, so any number of cars share one
+socket and one paho network thread. building/{id}/emergency_stop stops every
+car of the building.
+
+    building = BuildingConnection('hq', publisher_kwargs={'batch_interval': 0.2})
+    car_1 = building.add_car('car_1')
+    car_2 = building.add_car('car_2')
+    building.connect()
+"""
+
+import json
+import time
+import threading
+from typing import Dict, Optional
+
+import paho.mqtt.client as mqtt
+
+from elevator_mqtt_client import ElevatorMQTTClient, car_number
+from metrics import REGISTRY
+from mqtt_publisher import MqttPublisher
+
+MQTT_MESSAGES_ROUTED = REGISTRY.counter(
+    'elevator_mqtt_messages_routed_total', 'Command messages routed to a car by a building connection')
+MQTT_MESSAGES_UNROUTED = REGISTRY.counter(
+    'elevator_mqtt_messages_unrouted_total', 'Command messages for a car the building connection does not serve')
+
+# Commands the connection subscribes to for every car
+CAR_COMMANDS = ('floor_request', 'emergency_stop')
+
+
+class BuildingConnection:
+    """Shared paho client, publisher and command router of a building's cars"""
+
+    def __init__(self, building_id: str, broker_host: str = "localhost", broker_port: int = 1883,
+                 publisher_kwargs: Optional[dict] = None):
+        self.building_id = building_id
+        self.broker_host = broker_host
+        self.broker_port = broker_port
+        self.client = mqtt.Client()
+        self.publisher = MqttPublisher.from_env(self.client, **(publisher_kwargs or {}))
+        self.cars: Dict[str, ElevatorMQTTClient] = {}  # car number (topic segment) -> car
+        self.prefix = f"building/{building_id}"
+        self.connected = False
+        self._started = False
+        self._lock = threading.Lock()
+
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+        self.client.on_disconnect = self._on_disconnect
+
+    def add_car(self, car_id: str, **kwargs) -> ElevatorMQTTClient:
+        """Create a car served by this connection"""
+        car = ElevatorMQTTClient(self.broker_host, self.broker_port, car_id=car_id, connection=self, **kwargs)
+        self.cars[car_number(car_id)] = car
+        return car
+
+    def subscriptions(self):
+        """Wildcard subscriptions covering every car, present and future"""
+        topics = [f"{self.prefix}/car/+/{command}" for command in CAR_COMMANDS]
+        topics.append(f"{self.prefix}/emergency_stop")
+        return topics
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            self.connected = True
+            print(f"Building {self.building_id} connected to MQTT broker at {self.broker_host}:{self.broker_port}")
+            # Re-subscribed on every (re)connect; one SUBSCRIBE for all cars
+            client.subscribe([(topic, 0) for topic in self.subscriptions()])
+            self.publisher.connection_restored()
+        else:
+            print(f"Building {self.building_id} failed to connect to MQTT broker. Return code: {rc}")
+
+    def _on_disconnect(self, client, userdata, rc):
+        self.connected = False
+        print(f"Building {self.building_id} disconnected from MQTT broker. Return code: {rc}")
+        self.publisher.connection_lost()
+
+    def _on_message(self, client, userdata, msg):
+        """Route a command to its car: building/{id}/car/{n}/<command>"""
+        parts = msg.topic.split('/')
+        if len(parts) == 3 and parts[2] == 'emergency_stop':
+            received_at = time.perf_counter()
+            print(f"Building emergency stop: stopping {len(self.cars)} cars")
+            for car in list(self.cars.values()):
+                car.emergency_stop(received_at)
+            return
+        car = self.cars.get(parts[3]) if len(parts) == 5 and parts[2] == 'car' else None
+        if car is None:
+            MQTT_MESSAGES_UNROUTED.inc()
+            print(f"No car for topic {msg.topic}")
+            return
+        MQTT_MESSAGES_ROUTED.inc()
+        car._on_message(client, userdata, msg)
+
+    def publish_command(self, car_id: str, command: str, payload: dict):
+        """Send a command to one car of the building (e.g. from a dispatcher)"""
+        topic = f"{self.prefix}/car/{car_number(car_id)}/{command}"
+        return self.client.publish(topic, json.dumps(payload))
+
+    def connect(self) -> bool:
+        """Connect once for all cars; further calls return whether the broker is connected"""
+        with self._lock:
+            if self._started:
+                return self.connected
+            self.client.reconnect_delay_set(min_delay=1, max_delay=30)
+            self.publisher.start()
+            self._started = True
+            try:
+                self.client.connect(self.broker_host, self.broker_port, 60)
+                self.client.loop_start()
+                return True
+            except Exception as e:
+                print(f"Building {self.building_id} failed to connect to MQTT broker: {e}")
+                # paho keeps retrying in the background; telemetry is spooled meanwhile
+                self.client.connect_async(self.broker_host, self.broker_port, 60)
+                self.client.loop_start()
+                return False
+
+    def disconnect(self):
+        """Stop every car, flush pending telemetry and close the connection"""
+        for car in list(self.cars.values()):
+            car.disconnect()
+        self.publisher.stop()
+        with self._lock:
+            if self._started:
+                self.client.loop_stop()
+                self.client.disconnect()
+                self._started = False
+
+
+# Test function
+def test_building_connection(cars: int = 3):
+    """Move several cars of one building over a single connection"""
+    building = BuildingConnection('test')
+    fleet = [building.add_car(f"car_{n}") for n in range(1, cars + 1)]
+    building.connect()
+    try:
+        trips = [car.move_to_floor(floor) for car, floor in zip(fleet, ['andar_1', 'andar_2', 'andar_3'] * cars)]
+        for trip in trips:
+            print(f"{trip.car_id}: {trip.result(timeout=70)}")
+    finally:
+        building.disconnect()
+
+
+if __name__ == "__main__":
+    test_building_connection()
@@ -0,0 +1,246 @@
+"""
+End-to-end MQTT latency and throughput of the car transports
+An operator client sends floor_request and emergency_stop commands through
+the broker and times the car's answer:
+
+    request -> status   floor_request published until the is_moving status arrives
+    stop -> frame       emergency_stop published until the zero-power frame arrives
+
+Paths compared:
+    thread   ElevatorMQTTClient: paho network thread, one thread per movement
+    asyncio  AsyncElevatorCar + AsyncMqttTransport on one event loop (as under uvicorn)
+
+A burst of position frames through MqttPublisher then measures publish
+throughput and payload bytes as seen by the broker, once per encoding (JSON
+and the binary frames of telemetry_codec.py).
+
+    python mqtt_latency_benchmark.py                     # in-process broker (mqtt_broker.py)
+    python mqtt_latency_benchmark.py --external --host localhost --port 1883
+
+Both paths share the broker and the operator client, so their difference is
+the car side. With the in-process broker the report also has the broker's
+routing time per message.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import queue
+import statistics
+import sys
+import threading
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+
+import paho.mqtt.client as mqtt
+
+from telemetry_codec import decode_payload
+
+
+class OperatorProbe:
+    """Operator-side client: publishes a command and waits for the matching answer"""
+
+    def __init__(self, host: str, port: int):
+        self.received = queue.Queue()
+        self.client = mqtt.Client()
+        self.client.on_message = lambda client, userdata, msg: self.received.put(
+            (time.perf_counter(), msg.topic, msg.payload))
+        self.client.connect(host, port, 60)
+        self.client.loop_start()
+
+    def watch(self, topic_filter: str):
+        self.client.subscribe(topic_filter)
+        time.sleep(0.2)  # let the SUBACK (and retained messages) arrive
+
+    def command(self, topic: str, payload: dict, answered, timeout: float = 5.0) -> float:
+        """Seconds from publishing the command to the first message answered(topic, data) accepts"""
+        while not self.received.empty():
+            self.received.get_nowait()
+        sent_at = time.perf_counter()
+        self.client.publish(topic, json.dumps(payload))
+        deadline = sent_at + timeout
+        while True:
+            arrived_at, topic, raw = self.received.get(timeout=max(0.0, deadline - time.perf_counter()))
+            if answered(topic, decode_payload(raw)):
+                return arrived_at - sent_at
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+def run_rounds(probe: OperatorProbe, topics: dict, rounds: int) -> dict:
+    requests, stops = [], []
+    for _ in range(rounds):
+        requests.append(probe.command(
+            topics['floor_request'], {'floor': 'andar_8'},
+            lambda topic, data: topic == topics['status_update'] and data.get('is_moving')))
+        time.sleep(0.3)  # a few control ticks into the movement
+        stops.append(probe.command(
+            topics['emergency_stop'], {},
+            lambda topic, data: topic == topics['position_update'] and data.get('emergency_stopped')))
+        time.sleep(0.2)
+    return {'request_to_status': summarize(requests), 'stop_to_frame': summarize(stops)}
+
+
+def summarize(samples) -> dict:
+    ordered = sorted(samples)
+    return {
+        'count': len(samples),
+        'median_ms': statistics.median(samples) * 1000,
+        'p95_ms': ordered[max(0, int(round(0.95 * len(ordered))) - 1)] * 1000,
+        'max_ms': ordered[-1] * 1000,
+        'mean_ms': statistics.mean(samples) * 1000
+    }
+
+
+def bench_thread(host: str, port: int, rounds: int) -> dict:
+    from elevator_mqtt_client import ElevatorMQTTClient
+    car = ElevatorMQTTClient(host, port, car_id='car_1', building_id='bench-thread')
+    car.connect()
+    probe = OperatorProbe(host, port)
+    try:
+        _wait(lambda: car.client.is_connected())
+        probe.watch('building/bench-thread/#')
+        return run_rounds(probe, car.topics, rounds)
+    finally:
+        probe.close()
+        car.disconnect()
+
+
+def bench_asyncio(host: str, port: int, rounds: int) -> dict:
+    from async_elevator import AsyncCarFleet
+    from async_mqtt import AsyncMqttTransport, attach_car
+
+    # Stands in for uvicorn's event loop
+    loop = asyncio.new_event_loop()
+    loop_thread = threading.Thread(target=loop.run_forever, name='server-loop', daemon=True)
+    loop_thread.start()
+
+    async def setup():
+        fleet = AsyncCarFleet()
+        car = fleet.add_car('car_1', loop)
+        transport = AsyncMqttTransport(host, port)
+        topics = attach_car(transport, car, 'bench-async')
+        await transport.start()
+        await transport.wait_connected()
+        return fleet, transport, topics
+
+    fleet, transport, topics = asyncio.run_coroutine_threadsafe(setup(), loop).result()
+    probe = OperatorProbe(host, port)
+    try:
+        probe.watch('building/bench-async/#')
+        return run_rounds(probe, topics, rounds)
+    finally:
+        probe.close()
+        asyncio.run_coroutine_threadsafe(transport.stop(), loop).result()
+        asyncio.run_coroutine_threadsafe(fleet.shutdown(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        loop_thread.join()
+
+
+def bench_throughput(host: str, port: int, broker=None, frames: int = 5000, encoding: str = 'json') -> dict:
+    """Publish a burst of position frames on a threaded paho client"""
+    from mqtt_publisher import MqttPublisher
+    client = mqtt.Client()
+    publisher = MqttPublisher(client, encoding=encoding)
+    client.on_connect = lambda client, userdata, flags, rc: publisher.connection_restored()
+    client.connect(host, port, 60)
+    client.loop_start()
+    try:
+        _wait(lambda: publisher.online)
+        frame = {'timestamp': time.time(), 'car_id': 'car_1', 'current_position': 12.345678,
+                 'target_position': 29.0, 'current_floor': 'andar_2', 'target_floor': 'andar_8',
+                 'motor_power': 31.5, 'error': 16.654322, 'direction': 'up', 'is_moving': True,
+                 'delta_error': -0.061234, 'control_phase': 'fuzzy'}
+        topic = f'building/bench-{encoding}/car/1/position_update'
+        recorded = len(broker.records) if broker is not None else 0
+        start = time.perf_counter()
+        for seq in range(frames):
+            frame['current_position'] = 4.0 + seq * 1e-4
+            publisher.publish_position(topic, 'car_1', frame)
+        publish_seconds = time.perf_counter() - start
+        result = {'frames': frames, 'publish_calls_per_s': frames / publish_seconds}
+        if broker is not None:
+            _wait(lambda: len(broker.records) - recorded >= frames, timeout=30)
+            # The broker timestamps each receipt; same clock, same process
+            last_received = max(r[0] for r in list(broker.records) if r[1] == topic)
+            result['received_per_s'] = frames / (last_received - start)
+            stats = broker.stats(topic)
+            result['broker_routing_median_us'] = stats['routing_median_us']
+            result['bytes_per_frame'] = stats['bytes'] / stats['messages']
+        return result
+    finally:
+        client.loop_stop()
+        client.disconnect()
+
+
+def _wait(condition, timeout: float = 5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise TimeoutError("MQTT broker did not accept the connection")
+        time.sleep(0.01)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='MQTT command latency: thread vs asyncio transport')
+    parser.add_argument('--external', action='store_true', help='use the broker at --host/--port')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--frames', type=int, default=5000, help='position frames in the throughput burst')
+    parser.add_argument('--output', help='results path (default analysis/benchmarks/mqtt_latency_<timestamp>.json)')
+    args = parser.parse_args(argv)
+
+    broker = None
+    if not args.external:
+        from mqtt_broker import MqttBroker
+        broker = MqttBroker(port=0).start()
+        args.host, args.port = broker.host, broker.port
+        print(f"In-process broker on {args.host}:{args.port}")
+
+    results = {}
+    try:
+        for name, bench in (('thread', bench_thread), ('asyncio', bench_asyncio)):
+            print(f"Running {name} transport ({args.rounds} rounds)...")
+            # The cars print every movement; keep that cost but not the terminal output
+            with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                results[name] = bench(args.host, args.port, args.rounds)
+        throughput = {}
+        for encoding in ('json', 'binary'):
+            print(f"Publishing {args.frames} {encoding} position frames...")
+            throughput[encoding] = bench_throughput(args.host, args.port, broker, args.frames, encoding)
+        broker_stats = broker.stats() if broker is not None else None
+    finally:
+        if broker is not None:
+            broker.stop()
+
+    print(f"\n{'path':<10}{'measure':<20}{'median':>10}{'p95':>10}{'max':>10}")
+    for name, measures in results.items():
+        for measure, stats in measures.items():
+            print(f"{name:<10}{measure:<20}{stats['median_ms']:>8.2f}ms{stats['p95_ms']:>8.2f}ms{stats['max_ms']:>8.2f}ms")
+    print()
+    for encoding, burst in throughput.items():
+        print(f"Throughput ({encoding}): {burst['publish_calls_per_s']:.0f} publish calls/s", end='')
+        if 'received_per_s' in burst:
+            print(f", {burst['received_per_s']:.0f} frames/s received by the broker, "
+                  f"{burst['bytes_per_frame']:.0f} bytes/frame")
+        else:
+            print()
+
+    output = args.output or os.path.join(
+        'analysis', 'benchmarks', f"mqtt_latency_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'timestamp': datetime.now().isoformat(), 'broker': 'external' if args.external else 'in-process',
+                   'rounds': args.rounds, 'results': results, 'throughput': throughput,
+                   'broker_stats': broker_stats}, f, indent=2)
+    print(f"\nResults saved to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
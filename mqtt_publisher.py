@@ -0,0 +1,307 @@
+"""
+Policy-driven MQTT publishing of car telemetry
+A PublishPolicy decides which position frames reach the broker (every tick,
+only after a change beyond a deadband, or at most max_rate per second per
+car); frames that end a movement are always published. An MqttPublisher can
+be shared by a bank of cars and then batches their frames into one message
+per interval. Status messages and final frames are retained, so a late
+subscriber gets the last known state as soon as it subscribes. While the
+broker is unreachable messages go to an OutboundSpool (mqtt_spool.py) and
+are replayed in order after reconnecting.
+
+    ELEVATOR_MQTT_POLICY=every_tick | deadband[:metres] | max_rate[:hz]
+    ELEVATOR_MQTT_QOS=0|1|2
+    ELEVATOR_MQTT_RETAIN=1|0
+    ELEVATOR_MQTT_ENCODING=json|binary   position/status payloads (telemetry_codec.py)
+"""
+
+import json
+import os
+import threading
+import time
+import weakref
+from typing import Dict, Optional
+
+from metrics import REGISTRY, MQTT_PUBLISH_SECONDS
+from mqtt_spool import MQTT_MESSAGES_REPLAYED, OutboundSpool
+from telemetry_codec import encode_payload
+
+MQTT_PUBLISH_ACK_SECONDS = REGISTRY.histogram(
+    'elevator_mqtt_publish_ack_seconds', 'Time from client.publish to paho on_publish (PUBACK for QoS > 0)')
+MQTT_MESSAGES_PUBLISHED = REGISTRY.counter(
+    'elevator_mqtt_messages_published_total', 'MQTT messages handed to the client')
+MQTT_BYTES_PUBLISHED = REGISTRY.counter(
+    'elevator_mqtt_bytes_published_total', 'Payload bytes handed to the MQTT client')
+MQTT_FRAMES_SUPPRESSED = REGISTRY.counter(
+    'elevator_mqtt_frames_suppressed_total', 'Position frames not published because of the publish policy')
+MQTT_FRAMES_BATCHED = REGISTRY.counter(
+    'elevator_mqtt_frames_batched_total', 'Position frames published inside a batch message')
+MQTT_FRAMES_COALESCED = REGISTRY.counter(
+    'elevator_mqtt_frames_coalesced_total', 'Batched position frames replaced by a newer frame of the same car')
+
+_publishers = weakref.WeakSet()
+REGISTRY.gauge('elevator_mqtt_in_flight', 'Published MQTT messages not yet confirmed by on_publish',
+               lambda: sum(len(p.in_flight) for p in list(_publishers)))
+REGISTRY.gauge('elevator_mqtt_spool_depth', 'MQTT messages waiting in the outbound spool',
+               lambda: sum(len(p.spool) for p in list(_publishers)))
+
+POLICY_MODES = ('every_tick', 'deadband', 'max_rate')
+
+
+def is_final_frame(data: dict) -> bool:
+    """Frames that end a movement; subscribers must always see them"""
+    return bool(data.get('movement_completed') or data.get('emergency_stopped')) or data.get('is_moving') is False
+
+
+class PublishPolicy:
+    """
+    Which position frames of each car are published
+
+    every_tick: all of them (the historical behaviour)
+    deadband:   only when position moved by at least `deadband` metres or motor
+                power changed by at least `power_deadband` percent since the
+                last published frame
+    max_rate:   at most `max_rate` frames per second per car
+    """
+
+    def __init__(self, mode: str = 'every_tick', deadband: float = 0.01, power_deadband: float = 1.0,
+                 max_rate: float = 1.0):
+        if mode not in POLICY_MODES:
+            raise ValueError(f"Unknown publish policy: {mode}")
+        self.mode = mode
+        self.deadband = deadband
+        self.power_deadband = power_deadband
+        self.max_rate = max_rate
+        self.last_published: Dict[str, tuple] = {}  # car_id -> (time, position, motor_power)
+
+    @classmethod
+    def from_spec(cls, spec: Optional[str]) -> 'PublishPolicy':
+        """Parse 'every_tick', 'deadband[:metres]' or 'max_rate[:hz]'"""
+        mode, _, value = (spec or 'every_tick').strip().partition(':')
+        if not value:
+            return cls(mode)
+        if mode == 'deadband':
+            return cls(mode, deadband=float(value))
+        if mode == 'max_rate':
+            return cls(mode, max_rate=float(value))
+        raise ValueError(f"Publish policy {mode} takes no parameter")
+
+    def admit(self, car_id: str, data: dict, now: float) -> bool:
+        """Whether this frame should be published; records it as published if so"""
+        position = data.get('current_position', 0.0)
+        power = data.get('motor_power', 0.0)
+        last = self.last_published.get(car_id)
+        if self.mode != 'every_tick' and last is not None and not is_final_frame(data):
+            last_time, last_position, last_power = last
+            if self.mode == 'deadband':
+                if abs(position - last_position) < self.deadband and abs(power - last_power) < self.power_deadband:
+                    return False
+            elif now - last_time < 1.0 / self.max_rate:
+                return False
+        self.last_published[car_id] = (now, position, power)
+        return True
+
+
+class MqttPublisher:
+    """
+    Publishes car frames on one paho client
+
+    Every ElevatorMQTTClient gets its own publisher on its own client by
+    default. A bank of cars may share one publisher (and its connection, which
+    the owner connects); with batch_interval set, their position frames are
+    then sent as one message per interval on batch_topic.
+    """
+
+    def __init__(self, client, policy: Optional[PublishPolicy] = None, qos: int = 0, retain: bool = True,
+                 batch_interval: Optional[float] = None, batch_topic: str = 'elevator/position_batch',
+                 spool: Optional[OutboundSpool] = None, encoding: str = 'json'):
+        self.client = client
+        self.encoding = encoding  # batches stay JSON
+        self.policy = policy or PublishPolicy()
+        self.qos = qos
+        self.retain = retain
+        self.batch_interval = batch_interval
+        self.batch_topic = batch_topic
+        self.in_flight: Dict[int, tuple] = {}  # mid -> (perf_counter() at publish, qos)
+        self.published = 0
+        self.suppressed = 0
+        self.spool = spool if spool is not None else OutboundSpool()
+        # Set by the owner of the connection from on_connect / on_disconnect
+        self.online = client.is_connected() if hasattr(client, 'is_connected') else False
+        self._replay_thread = None
+        # on_publish may run inside client.publish(), on the publishing thread, before
+        # the mid is known: such early confirmations are parked in _acked
+        self._lock = threading.RLock()
+        self._acked: Dict[int, float] = {}
+        self._batch: Dict[str, dict] = {}
+        self._flush_now = threading.Event()
+        self._running = False
+        self._thread = None
+        client.on_publish = self._on_publish
+        _publishers.add(self)
+
+    @classmethod
+    def from_env(cls, client, **kwargs) -> 'MqttPublisher':
+        kwargs.setdefault('policy', PublishPolicy.from_spec(os.environ.get('ELEVATOR_MQTT_POLICY')))
+        kwargs.setdefault('qos', int(os.environ.get('ELEVATOR_MQTT_QOS', '0')))
+        kwargs.setdefault('retain', os.environ.get('ELEVATOR_MQTT_RETAIN', '1') == '1')
+        kwargs.setdefault('spool', OutboundSpool.from_env())
+        kwargs.setdefault('encoding', os.environ.get('ELEVATOR_MQTT_ENCODING', 'json'))
+        return cls(client, **kwargs)
+
+    def publish(self, topic: str, payload, qos: Optional[int] = None, retain: bool = False,
+                final: bool = False):
+        """Hand one message to the client, or to the spool while offline or replaying
+
+        Returns the paho MQTTMessageInfo, or None if the message was spooled.
+        """
+        qos = self.qos if qos is None else qos
+        with self._lock:
+            # Behind a backlog, even with the broker back, to keep the order
+            if not self.online or self.spool:
+                self.spool.append(topic, payload, qos, retain, final)
+                return None
+            info = self._send(topic, payload, qos, retain)
+            if info.rc != 0:
+                # Lost the connection before on_disconnect told us; paho itself keeps QoS > 0 messages
+                self.online = False
+                if qos == 0:
+                    self.spool.append(topic, payload, qos, retain, final)
+        return info
+
+    def _send(self, topic: str, payload, qos: int, retain: bool):
+        """client.publish, tracking the message until on_publish confirms it (lock held)"""
+        publish_start = time.perf_counter()
+        info = self.client.publish(topic, payload, qos=qos, retain=retain)
+        MQTT_PUBLISH_SECONDS.observe(time.perf_counter() - publish_start)
+        # QoS 0 messages are dropped while disconnected; QoS > 0 ones are queued for later
+        if info.rc == 0 or qos > 0:
+            # Handed to paho; spooled and dropped messages are counted by the spool
+            self.published += 1
+            MQTT_MESSAGES_PUBLISHED.inc()
+            MQTT_BYTES_PUBLISHED.inc(len(payload))
+        acked_at = self._acked.pop(info.mid, None)
+        if acked_at is not None:
+            MQTT_PUBLISH_ACK_SECONDS.observe(acked_at - publish_start)
+        elif info.rc == 0 or qos > 0:
+            self.in_flight[info.mid] = (publish_start, qos)
+        return info
+
+    def _on_publish(self, client, userdata, mid, *args):
+        # *args: paho 2.x VERSION2 callbacks also pass reason code and properties
+        now = time.perf_counter()
+        with self._lock:
+            entry = self.in_flight.pop(mid, None)
+            if entry is None:
+                self._acked[mid] = now
+        if entry is not None:
+            MQTT_PUBLISH_ACK_SECONDS.observe(now - entry[0])
+
+    def connection_lost(self):
+        """Spool from now on; forget QoS 0 messages in flight, paho drops them on disconnect"""
+        with self._lock:
+            self.online = False
+            for mid in [mid for mid, (_, qos) in self.in_flight.items() if qos == 0]:
+                del self.in_flight[mid]
+        self.spool.flush()
+
+    def connection_restored(self):
+        """Called from on_connect: replay the spool on a thread of its own
+
+        Not on paho's network thread, which must keep delivering commands, and
+        not on the control loop, which only ever appends to the spool.
+        """
+        with self._lock:
+            self.online = True
+            if not self.spool or (self._replay_thread is not None and self._replay_thread.is_alive()):
+                return
+            self._replay_thread = threading.Thread(target=self._replay, name='mqtt-replay', daemon=True)
+            self._replay_thread.start()
+
+    def _replay(self):
+        replayed = 0
+        while True:
+            # One message per lock hold, so live publishers only ever wait for one send
+            with self._lock:
+                if not self.online:
+                    break
+                entry = self.spool.popleft()
+                if entry is None:
+                    self.spool.replayed()
+                    break
+                try:
+                    info = self._send(*entry)
+                except Exception as e:
+                    # A message the client rejects must not stall the backlog behind it
+                    print(f"Dropping spooled message for {entry[0]}: {e}")
+                    continue
+                if info.rc != 0:
+                    self.online = False
+                    self.spool.push_front(entry)
+                    break
+            replayed += 1
+            MQTT_MESSAGES_REPLAYED.inc()
+            if replayed % 100 == 0:
+                with self._lock:
+                    self.spool.replayed()  # a restart from here on does not resend this batch
+                time.sleep(0)  # let paho's network thread write what is queued
+        with self._lock:
+            self.spool.replayed()
+        print(f"Replayed {replayed} spooled MQTT messages ({len(self.spool)} left, {self.spool.dropped} dropped)")
+
+    def publish_position(self, topic: str, car_id: str, data: dict) -> bool:
+        """Publish a position frame if the policy admits it; returns whether it was sent or batched"""
+        if not self.policy.admit(car_id, data, time.monotonic()):
+            self.suppressed += 1
+            MQTT_FRAMES_SUPPRESSED.inc()
+            return False
+        final = is_final_frame(data)
+        if self._running:
+            with self._lock:
+                if car_id in self._batch:
+                    MQTT_FRAMES_COALESCED.inc()
+                self._batch[car_id] = data
+            if final:
+                self._flush_now.set()
+            return True
+        self.publish(topic, encode_payload(data, 'position', self.encoding),
+                     retain=self.retain and final, final=final)
+        return True
+
+    def publish_status(self, topic: str, data: dict):
+        """Status messages are few and describe the last state: always published, retained"""
+        self.publish(topic, encode_payload(data, 'status', self.encoding), retain=self.retain, final=True)
+
+    # Batching
+
+    def start(self):
+        """Start batching position frames (requires batch_interval)"""
+        if not self.batch_interval or self._running:
+            return self
+        self._running = True
+        self._thread = threading.Thread(target=self._batch_loop, name='mqtt-batch', daemon=True)
+        self._thread.start()
+        return self
+
+    def _batch_loop(self):
+        while self._running:
+            self._flush_now.wait(self.batch_interval)
+            self._flush_now.clear()
+            self.flush()
+
+    def flush(self):
+        """Publish the pending frames of all cars as one message"""
+        with self._lock:
+            frames, self._batch = list(self._batch.values()), {}
+        if not frames:
+            return
+        MQTT_FRAMES_BATCHED.inc(len(frames))
+        self.publish(self.batch_topic, json.dumps({'timestamp': time.time(), 'frames': frames}))
+
+    def stop(self):
+        self._running = False
+        self._flush_now.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
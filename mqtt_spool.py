@@ -0,0 +1,205 @@
+"""
+Bounded outbound spool for MQTT messages published while the broker is away
+MqttPublisher spools every message while disconnected (and while an earlier
+backlog is still being replayed, so the order is kept) and replays the spool
+after reconnecting. The spool is bounded: when it is full the drop policy
+decides which message goes, and past the high watermark intermediate position
+frames are thinned, so a long outage degrades resolution before it drops
+whole stretches of telemetry. Frames that end a movement are never thinned.
+
+With a spool file, spooled messages are also appended to disk (flushed at
+least every second) and recovered by the next process, e.g. after a restart
+during the outage. A companion <file>.offset records how many messages at the
+head of the file are gone from the spool (replayed or dropped); it is updated
+after every replayed batch, so a restart mid-replay resends at most one batch.
+
+    ELEVATOR_MQTT_SPOOL_SIZE=10000           messages kept
+    ELEVATOR_MQTT_SPOOL_POLICY=drop_oldest   or drop_newest
+    ELEVATOR_MQTT_SPOOL_FILE=spool.jsonl     persist the spool (default: memory only)
+"""
+
+import base64
+import json
+import os
+import time
+from collections import deque
+from typing import Optional
+
+from metrics import REGISTRY
+
+MQTT_MESSAGES_SPOOLED = REGISTRY.counter(
+    'elevator_mqtt_messages_spooled_total', 'MQTT messages spooled while the broker was unreachable')
+MQTT_SPOOL_DROPPED = REGISTRY.counter(
+    'elevator_mqtt_spool_dropped_total', 'Spooled MQTT messages dropped by the spool bound or thinning')
+MQTT_MESSAGES_REPLAYED = REGISTRY.counter(
+    'elevator_mqtt_messages_replayed_total', 'Spooled MQTT messages published after reconnecting')
+
+SPOOL_POLICIES = ('drop_oldest', 'drop_newest')
+
+
+class OutboundSpool:
+    """
+    FIFO of (topic, payload, qos, retain) waiting for the broker
+
+    Not thread safe on its own: MqttPublisher calls it under its lock.
+    """
+
+    def __init__(self, capacity: int = 10000, policy: str = 'drop_oldest', path: Optional[str] = None,
+                 high_watermark: float = 0.5, thin: int = 5, flush_interval: float = 1.0):
+        if policy not in SPOOL_POLICIES:
+            raise ValueError(f"Unknown spool policy: {policy}")
+        self.capacity = capacity
+        self.policy = policy
+        self.path = path
+        self.high_watermark = int(capacity * high_watermark)
+        self.thin = thin  # past the high watermark, keep 1 in `thin` intermediate frames
+        self.entries = deque()
+        self.dropped = 0
+        self._offered = 0
+        self.flush_interval = flush_interval
+        self._file = None
+        self._file_lines = 0
+        self._file_head = 0  # lines at the head of the file no longer in entries
+        self._flushed_at = time.monotonic()
+        if path and os.path.exists(path):
+            self._recover()
+
+    @classmethod
+    def from_env(cls) -> 'OutboundSpool':
+        return cls(capacity=int(os.environ.get('ELEVATOR_MQTT_SPOOL_SIZE', '10000')),
+                   policy=os.environ.get('ELEVATOR_MQTT_SPOOL_POLICY', 'drop_oldest'),
+                   path=os.environ.get('ELEVATOR_MQTT_SPOOL_FILE') or None)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def append(self, topic: str, payload: str, qos: int, retain: bool, final: bool = False) -> bool:
+        """Spool a message; False if the bound or the thinning dropped it"""
+        if not final and len(self.entries) >= self.high_watermark:
+            # Backpressure: the control loop never blocks, the spool loses resolution instead
+            self._offered += 1
+            if self._offered % self.thin:
+                return self._drop()
+        if len(self.entries) >= self.capacity:
+            if self.policy == 'drop_newest' and not final:
+                return self._drop()
+            self.entries.popleft()
+            self._file_head += 1
+            self._drop()
+        entry = (topic, payload, qos, retain)
+        self.entries.append(entry)
+        MQTT_MESSAGES_SPOOLED.inc()
+        if self.path:
+            self._write(entry)
+        return True
+
+    def _drop(self) -> bool:
+        self.dropped += 1
+        MQTT_SPOOL_DROPPED.inc()
+        return False
+
+    def popleft(self):
+        """Oldest message, or None when empty"""
+        if not self.entries:
+            return None
+        self._file_head += 1
+        return self.entries.popleft()
+
+    def push_front(self, entry):
+        """Put back a message whose replay failed"""
+        self.entries.appendleft(entry)
+        self._file_head -= 1
+
+    def replayed(self):
+        """Messages taken with popleft() were published: the spool file must not recover them"""
+        if not self.path:
+            return
+        if self.entries:
+            self._write_offset()
+            return
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        for path in (self.path, self._offset_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self._file_lines = self._file_head = 0
+
+    # Persistence
+
+    @property
+    def _offset_path(self) -> str:
+        return self.path + '.offset'
+
+    def _write_offset(self):
+        self.flush()
+        temporary = self._offset_path + '.tmp'
+        with open(temporary, 'w') as f:
+            f.write(str(self._file_head))
+        os.replace(temporary, self._offset_path)
+
+    def _write(self, entry):
+        if self._file is None:
+            self._file = open(self.path, 'a')
+        elif self._file_lines >= 2 * self.capacity:
+            # Messages dropped or replayed are still in the file; rewrite it from memory
+            self._file.close()
+            self._file = open(self.path, 'w')
+            for pending in self.entries:
+                self._file.write(self._encode(pending))
+            self._file_lines = len(self.entries)
+            self._file_head = 0
+            self._write_offset()
+            return
+        self._file.write(self._encode(entry))
+        self._file_lines += 1
+        now = time.monotonic()
+        if now - self._flushed_at >= self.flush_interval:
+            self._file.flush()
+            self._flushed_at = now
+
+    @staticmethod
+    def _encode(entry) -> str:
+        topic, payload, qos, retain = entry
+        if isinstance(payload, (bytes, bytearray)):
+            # Binary telemetry (telemetry_codec.py)
+            return json.dumps({'t': topic, 'b': base64.b64encode(payload).decode(), 'q': qos, 'r': retain}) + '\n'
+        return json.dumps({'t': topic, 'p': payload, 'q': qos, 'r': retain}) + '\n'
+
+    def _recover(self):
+        """Load what a previous process left in the spool file, past its offset"""
+        try:
+            with open(self._offset_path) as f:
+                head = int(f.read() or 0)
+        except (FileNotFoundError, ValueError):
+            head = 0
+        recovered = deque(maxlen=self.capacity)
+        lines = 0
+        end = 0  # byte offset just past the last complete line
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # torn last line of a crashed writer
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    break
+                end += len(line)
+                lines += 1
+                if lines <= head:
+                    continue
+                payload = base64.b64decode(item['b']) if 'b' in item else item['p']
+                recovered.append((item['t'], payload, item['q'], item['r']))
+        if os.path.getsize(self.path) > end:
+            # Appends would otherwise continue the torn line and be lost with it
+            os.truncate(self.path, end)
+        self.entries.extend(recovered)
+        self._file_lines = lines
+        self._file_head = lines - len(recovered)
+        if recovered:
+            print(f"Recovered {len(recovered)} spooled MQTT messages from {self.path}")
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+            self._flushed_at = time.monotonic()
@@ -0,0 +1,364 @@
+"""
+Car engines hosted in a dedicated worker process
+The control loops run under their own interpreter (and GIL), so JSON encoding
+and WebSocket fan-out in the web server cannot delay control ticks. Commands
+go to the worker over a multiprocessing Pipe; telemetry comes back through a
+shared-memory ring buffer that a reader thread polls
+"""
+
+import asyncio
+import itertools
+import json
+import multiprocessing
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional
+
+from metrics import REGISTRY, EMERGENCY_STOP_LATENCY_SECONDS
+from shm_ring import TelemetryRing
+from trip_handle import TripHandle
+
+ENGINE_FRAMES_DROPPED = REGISTRY.counter(
+    'elevator_engine_frames_dropped_total', 'Telemetry frames from the engine process lost in the ring buffer')
+
+# Tags each accepted move so its 'trip' frame resolves only the handle it belongs to
+_trip_ids = itertools.count(1)
+
+
+def execute_command(car, command: str, args, emit: Callable[[str, str, dict], None]):
+    """Run one engine command against a local car and return the reply
+
+    emit(kind, car_id, data) publishes the trip KPIs when an accepted move ends,
+    tagged with the trip_id of the 'ok' reply.
+    """
+    if command == 'move':
+        trip = car.move_to_floor(args)
+        if not trip:
+            return ('rejected', trip.reason)
+        trip_id = next(_trip_ids)
+        trip.add_done_callback(lambda handle: emit('trip', handle.car_id, dict(handle.kpis, trip_id=trip_id)))
+        return ('ok', {'trip_id': trip_id, 'origin_floor': trip.origin_floor,
+                       'start_position': trip.start_position, 'target_position': trip.target_position})
+    if command == 'cancel':
+        if car.current_trip is not None:
+            car.current_trip.cancel()
+        return None
+    if command == 'emergency_stop':
+        car.emergency_stop(args)
+        return None
+    if command == 'status':
+        return car.get_current_status()
+    raise ValueError(f"Unknown engine command: {command}")
+
+
+def _engine_main(conn, ring_name: str, car_ids: list):
+    """Worker process entry point: run the cars and serve commands until shutdown"""
+    from simple_elevator_controller import SimpleElevatorController
+    from structured_log import configure_logging
+
+    configure_logging()
+    ring = TelemetryRing.attach(ring_name)
+    # Every car thread writes to the ring, which expects a single producer
+    ring_lock = threading.Lock()
+
+    def emit(kind: str, car_id: str, data: dict):
+        payload = json.dumps({'kind': kind, 'car_id': car_id, 'data': data}).encode()
+        with ring_lock:
+            if not ring.write(payload):
+                print(f"Engine frame too large for ring slot ({len(payload)} bytes), dropped")
+
+    cars = {}
+    for car_id in car_ids:
+        # Thread-driven cars each get their own fuzzy controller
+        car = SimpleElevatorController(car_id=car_id)
+        car.set_position_callback(lambda data, car_id=car_id: emit('position', car_id, data))
+        car.set_status_callback(lambda data, car_id=car_id: emit('status', car_id, data))
+        car.controller.warm_up()
+        cars[car_id] = car
+
+    conn.send(('ready', {car_id: car.get_current_status() for car_id, car in cars.items()}))
+    while True:
+        try:
+            command, car_id, args = conn.recv()
+        except (EOFError, OSError):
+            break
+        if command == 'shutdown':
+            break
+        try:
+            conn.send(execute_command(cars[car_id], command, args, emit))
+        except Exception as e:
+            conn.send(('error', str(e)))
+
+    for car in cars.values():
+        car.disconnect()
+    ring.close()
+    try:
+        conn.send(('stopped', None))
+    except (EOFError, OSError):
+        pass
+
+
+class ProcessCar:
+    """
+    Web-process proxy for one car running in another process
+    Same interface as SimpleElevatorController; state is mirrored from telemetry.
+    engine is anything with command(command, car_id, args): the ProcessCarEngine
+    or a shared-state command mailbox.
+    """
+
+    remote = True  # commands block on the other process' reply: keep them off the event loop
+
+    def __init__(self, engine, car_id: str, status: Optional[dict] = None):
+        self.engine = engine
+        self.car_id = car_id
+        self.current_floor = 'terreo'
+        self.current_position = 4.0
+        self.target_floor = None
+        self.target_position = None
+        self.is_moving = False
+        self.direction = 'stopped'
+        self.current_trip: Optional[TripHandle] = None
+        self.pending_trips: Dict[int, TripHandle] = {}  # by trip_id, until their 'trip' frame
+        self.last_tick_stats = None
+        self.last_stop_latency = None
+
+        self.position_callback: Optional[Callable] = None
+        self.status_callback: Optional[Callable] = None
+        if status:
+            self._mirror(status)
+
+    def _mirror(self, data: dict):
+        for key in ('current_floor', 'current_position', 'target_floor', 'target_position',
+                    'is_moving', 'direction'):
+            if key in data:
+                setattr(self, key, data[key])
+
+    def _on_frame(self, kind: str, data: dict):
+        """Dispatch one telemetry frame from the engine (reader thread)"""
+        if kind == 'position':
+            self._mirror(data)
+            if 'stop_latency_ms' in data:
+                self.last_stop_latency = data['stop_latency_ms'] / 1000
+                EMERGENCY_STOP_LATENCY_SECONDS.observe(self.last_stop_latency)
+            if self.position_callback:
+                self.position_callback(data)
+        elif kind == 'status':
+            self._mirror(data)
+            if self.status_callback:
+                self.status_callback(data)
+        elif kind == 'trip':
+            # Frames of trips this proxy did not start (another replica's) carry ids it never saw
+            trip = self.pending_trips.pop(data.pop('trip_id', None), None)
+            if trip is not None:
+                self.last_tick_stats = data.get('tick_stats')
+                trip.resolve(data)
+
+    def connect(self):
+        """The engine process is started by ProcessCarEngine"""
+        return True
+
+    def disconnect(self):
+        """Stop the current movement; the process itself is stopped by ProcessCarEngine.shutdown"""
+        if self.current_trip is not None:
+            self.current_trip.cancel()
+
+    def move_to_floor(self, target_floor: str) -> TripHandle:
+        """Ask the engine to start a movement; returns a TripHandle like the local controllers"""
+        status, info = self.engine.command('move', self.car_id, target_floor)
+        if status != 'ok':
+            return TripHandle.rejected(self.car_id, target_floor, info)
+
+        trip = TripHandle(self.car_id, info['origin_floor'], target_floor,
+                          info['start_position'], info['target_position'])
+        trip.set_cancel_callback(lambda: self.engine.command('cancel', self.car_id))
+        self.pending_trips[info['trip_id']] = trip
+        self.current_trip = trip
+        self.is_moving = True
+        return trip
+
+    async def move_to_floor_async(self, target_floor: str) -> TripHandle:
+        """Start a movement and wait for it to finish without blocking the event loop"""
+        trip = await asyncio.get_running_loop().run_in_executor(None, self.move_to_floor, target_floor)
+        if trip:
+            await trip
+        return trip
+
+    def emergency_stop(self, received_at: Optional[float] = None):
+        """Emergency stop; received_at is a perf_counter() timestamp
+
+        perf_counter() reads CLOCK_MONOTONIC on Linux, so the engine process can
+        measure the stop latency against a timestamp taken here.
+        """
+        self.engine.command('emergency_stop', self.car_id,
+                            received_at if received_at is not None else time.perf_counter())
+
+    def get_current_status(self) -> dict:
+        """Current state as last reported by the engine"""
+        return {
+            'current_floor': self.current_floor,
+            'current_position': self.current_position,
+            'target_floor': self.target_floor,
+            'target_position': self.target_position,
+            'is_moving': self.is_moving,
+            'direction': self.direction
+        }
+
+    def set_position_callback(self, callback: Callable):
+        self.position_callback = callback
+
+    def set_status_callback(self, callback: Callable):
+        self.status_callback = callback
+
+
+class ProcessCarEngine:
+    """
+    Starts the engine process and routes commands and telemetry for its cars
+    """
+
+    def __init__(self, car_ids: Iterable[str] = ('car_1',), slots: int = 1024, slot_size: int = 2048,
+                 poll_interval: float = 0.005):
+        self.car_ids = list(car_ids)
+        self.slots = slots
+        self.slot_size = slot_size
+        self.poll_interval = poll_interval
+        self.cars: Dict[str, ProcessCar] = {}
+        self.ring: Optional[TelemetryRing] = None
+        self.process = None
+        self.conn = None
+        self.frames_dropped = 0
+        self.error: Optional[str] = None  # set once the command pipe to the engine breaks
+        self._command_lock = threading.Lock()
+        self._reader_thread = None
+        self._running = False
+
+    def start(self, timeout: float = 60.0):
+        """Spawn the engine process and wait until its cars are ready"""
+        self.ring = TelemetryRing.create(self.slots, self.slot_size)
+        # spawn: never fork the web server's threads and event loop into the engine
+        context = multiprocessing.get_context('spawn')
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_engine_main, name='elevator-engine',
+                                       args=(child_conn, self.ring.name, self.car_ids), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+        if not self.conn.poll(timeout):
+            self.process.terminate()
+            raise TimeoutError(f"Engine process not ready after {timeout}s")
+        _, statuses = self.conn.recv()
+        self.cars = {car_id: ProcessCar(self, car_id, statuses.get(car_id)) for car_id in self.car_ids}
+
+        self._running = True
+        self._reader_thread = threading.Thread(target=self._read_loop, name='engine-telemetry', daemon=True)
+        self._reader_thread.start()
+        print(f"Engine process started (pid {self.process.pid}) with cars: {', '.join(self.car_ids)}")
+        return self
+
+    def car(self, car_id: str = 'car_1') -> ProcessCar:
+        return self.cars[car_id]
+
+    def command(self, command: str, car_id: str, args=None):
+        """Send one command to the engine and return its reply
+
+        Once the pipe breaks (the engine process died) every command gets an
+        ('error', reason) reply and error is set, which keeps /readyz at 503.
+        """
+        with self._command_lock:
+            if self.error is not None:
+                return ('error', self.error)
+            try:
+                self.conn.send((command, car_id, args))
+                return self.conn.recv()
+            except (EOFError, OSError) as e:
+                self.error = f"Engine process unreachable: {e!r}"
+                print(self.error)
+                return ('error', self.error)
+
+    def _read_loop(self):
+        cursor = 0
+        while self._running:
+            payloads, cursor, dropped = self.ring.read(cursor)
+            if dropped:
+                self.frames_dropped += dropped
+                ENGINE_FRAMES_DROPPED.inc(dropped)
+            for payload in payloads:
+                try:
+                    frame = json.loads(payload)
+                    car = self.cars.get(frame['car_id'])
+                    if car is not None:
+                        car._on_frame(frame['kind'], frame['data'])
+                except Exception as e:
+                    print(f"Error dispatching engine frame: {e}")
+            if not payloads:
+                time.sleep(self.poll_interval)
+
+    def shutdown(self, timeout: float = 10.0):
+        """Stop the cars, the engine process and the telemetry reader"""
+        if self.process is None:
+            return
+        with self._command_lock:
+            try:
+                self.conn.send(('shutdown', None, None))
+                if self.conn.poll(timeout):
+                    self.conn.recv()
+            except (EOFError, OSError):
+                pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        self._running = False
+        if self._reader_thread is not None:
+            self._reader_thread.join()
+        self.conn.close()
+        self.ring.close()
+        self.process = None
+
+
+def _gil_load(stop: threading.Event):
+    """Stand-in for dashboard traffic: JSON-encode a movement_data sized payload in a loop"""
+    frame = [{'timestamp': time.time(), 'position': 4.0 + i * 0.01, 'target_position': 16.5,
+              'motor_power': 31.5, 'error': 0.5} for i in range(1000)]
+    while not stop.is_set():
+        json.dumps(frame)
+
+
+def _trip_jitter(car, floor: str, load_threads: int) -> dict:
+    stop = threading.Event()
+    threads = [threading.Thread(target=_gil_load, args=(stop,), daemon=True) for _ in range(load_threads)]
+    for thread in threads:
+        thread.start()
+    try:
+        trip = car.move_to_floor(floor)
+        stats = trip.result(timeout=90)['tick_stats']
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    return stats
+
+
+def run_jitter_check(load_threads: int = 4):
+    """Compare control tick jitter of thread and process engines, idle and under web-like load"""
+    from simple_elevator_controller import SimpleElevatorController
+
+    engine = ProcessCarEngine().start()
+    cars = [('thread', SimpleElevatorController()), ('process', engine.car('car_1'))]
+    results = []
+    try:
+        for name, car in cars:
+            for load in (0, load_threads):
+                floor = 'andar_3' if car.current_floor == 'terreo' else 'terreo'
+                results.append((name, load, _trip_jitter(car, floor, load)))
+    finally:
+        engine.shutdown()
+
+    print(f"\n{'engine':<8} {'load':>4} {'ticks':>6} {'overruns':>8} {'jitter mean':>12} {'jitter max':>11}")
+    for name, load, stats in results:
+        print(f"{name:<8} {load:>4} {stats['ticks']:>6} {stats['overruns']:>8} "
+              f"{stats['jitter_mean_s']*1000:>10.2f}ms {stats['jitter_max_s']*1000:>9.2f}ms")
+    return results
+
+
+if __name__ == "__main__":
+    run_jitter_check(int(sys.argv[1]) if len(sys.argv) > 1 else 4)
@@ -0,0 +1,120 @@
+"""
+Line-delimited teste_oficial results
+TesteOficial writes a run as it happens instead of dumping it at the end: one
+JSON object per line, so memory stays constant however long the run is and an
+interrupted or crashed run keeps everything up to the last flush.
+
+    {"tipo": "inicio", "timestamp": ..., "data_teste": ..., "total_testes": 6, "cenarios": [...]}
+    {"tipo": "amostra", "teste": 1, "tempo": 0.2, "posicao": 4.01, "potencia": 12.5, "erro": 2.99, "direcao": "up"}
+    ...
+    {"tipo": "resultado", "teste": 1, "cenario": ..., "tempo_total_s": ..., "amostras": 51, ...}
+    {"tipo": "fim", "timestamp": ..., "sucessos": 6, "taxa_sucesso_pct": 100.0, "interrompido": false}
+
+read_result_stream() rebuilds the dict of the old resultados_teste_oficial_*.json
+files. A run without its "fim" line is marked interrompido and the samples of
+the scenario it stopped in, which has no result, are left out.
+iter_result_stream() yields the records one at a time.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Iterator, Optional
+
+
+class ResultStreamWriter:
+    """
+    Append-only JSONL writer for one run
+
+    Samples are buffered and flushed at least every flush_interval seconds;
+    each scenario's result and the end of the run are flushed and fsynced.
+    Safe to call from the car's control thread and the runner's thread.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1.0):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.flush_interval = flush_interval
+        self.samples_written = 0
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+        self._finished = False
+
+    def _write(self, record: dict, sync: bool = False):
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(line)
+            now = time.monotonic()
+            if sync or now - self._flushed_at >= self.flush_interval:
+                self._file.flush()
+                if sync:
+                    os.fsync(self._file.fileno())
+                self._flushed_at = now
+
+    def start(self, **run):
+        self._write(dict(tipo='inicio', **run), sync=True)
+
+    def sample(self, teste: int, sample: dict):
+        self.samples_written += 1
+        self._write(dict(sample, tipo='amostra', teste=teste))
+
+    def result(self, resultado: dict):
+        self._write(dict(resultado, tipo='resultado'), sync=True)
+
+    def finish(self, **summary):
+        """End of the run; a stream without it reads back as interrupted"""
+        self._finished = True
+        self._write(dict(summary, tipo='fim'), sync=True)
+
+    def close(self, interrupted: bool = False):
+        if not self._finished:
+            self.finish(timestamp=time.time(), interrompido=interrupted)
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+def iter_result_stream(path: str) -> Iterator[dict]:
+    """Records of a results stream in order; stops at a torn last line"""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                return  # the run was killed in the middle of a write
+
+
+def read_result_stream(path: str) -> dict:
+    """A results stream as the resultados_teste_oficial_*.json dict"""
+    run: Optional[dict] = None
+    resultados, samples = [], {}
+    end = None
+    for record in iter_result_stream(path):
+        kind = record.pop('tipo', None)
+        if kind == 'inicio':
+            run = record
+        elif kind == 'amostra':
+            samples.setdefault(record.pop('teste'), []).append(record)
+        elif kind == 'resultado':
+            record.pop('amostras', None)
+            record['dados_movimento'] = samples.pop(record['teste'], [])
+            resultados.append(record)
+        elif kind == 'fim':
+            end = record
+    if run is None:
+        raise ValueError(f"Not a results stream: {path}")
+    run.pop('cenarios', None)
+    if end is None:
+        end = {'interrompido': True}
+        if resultados:
+            end['timestamp'] = resultados[-1].get('fim_ts', run['timestamp'])
+    successes = sum(1 for resultado in resultados if resultado['sucesso'])
+    run.update(sucessos=successes, taxa_sucesso_pct=successes / max(1, run.get('total_testes', 0)) * 100)
+    run.update(end)
+    run['resultados'] = resultados
+    return run
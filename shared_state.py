@@ -0,0 +1,385 @@
+"""
+Car state shared between uvicorn worker processes
+The worker that creates the shared segment first becomes the owner: it runs
+the cars, publishes the status snapshot through a seqlock and every telemetry
+frame through a TelemetryRing. The other workers (replicas) serve status,
+movement data and WebSocket clients from shared memory and forward commands
+to the owner through their own command mailbox
+
+There is no failover: a replica never promotes itself. While the owner is
+down its cars are gone, replicas serve the last snapshot (owner_alive turns
+False) and commands answer 'Owner worker did not answer'. The next worker to
+call open() after OWNER_TIMEOUT, normally the one started in the dead owner's
+place, takes the segments over with fresh cars.
+"""
+
+import json
+import os
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Optional, Tuple
+
+from process_engine import ProcessCar, execute_command
+from shm_ring import TelemetryRing, untrack
+
+MAGIC = 0x454C5631  # written last by the owner once the segments are ready
+_STATE_HEADER = struct.Struct('<IId')  # magic, owner pid, heartbeat (time.time())
+_STATUS_SEQ_OFFSET = 16
+_STATUS_LENGTH_OFFSET = 24
+_STATUS_OFFSET = 32
+STATUS_CAPACITY = 8192
+
+MAX_MAILBOXES = 16
+# pid of the replica holding each mailbox, 0 while free or being claimed
+_MAILBOX_PID = struct.Struct('<I')
+_MAILBOX_PIDS_OFFSET = _STATUS_OFFSET + STATUS_CAPACITY
+_STATE_SIZE = _MAILBOX_PIDS_OFFSET + MAX_MAILBOXES * _MAILBOX_PID.size
+OWNER_TIMEOUT = 10.0  # seconds without a heartbeat before the owner is considered gone
+HEARTBEAT_INTERVAL = 1.0
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name != 'posix':
+        return True  # os.kill(pid, 0) would terminate it on Windows
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _unlink_stale(name: str):
+    """Remove a segment left behind by a dead process; unlink also drops the tracker entry attaching adds"""
+    try:
+        stale = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    stale.close()
+    try:
+        stale.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _mailbox_pid(buf, index: int) -> int:
+    return _MAILBOX_PID.unpack_from(buf, _MAILBOX_PIDS_OFFSET + index * _MAILBOX_PID.size)[0]
+
+
+def _set_mailbox_pid(buf, index: int, pid: int):
+    _MAILBOX_PID.pack_into(buf, _MAILBOX_PIDS_OFFSET + index * _MAILBOX_PID.size, pid)
+
+
+class Mailbox:
+    """
+    Command channel from one replica to the owner: a request ring written by
+    the replica and a reply ring written by the owner
+    """
+
+    def __init__(self, index: int, requests: TelemetryRing, replies: TelemetryRing, timeout: float = 5.0,
+                 state_buf=None):
+        self.index = index
+        self.requests = requests
+        self.replies = replies
+        self.timeout = timeout
+        self.state_buf = state_buf
+        self._reply_cursor = replies.write_count
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def claim(cls, prefix: str, state_buf) -> 'Mailbox':
+        """
+        Take the first free mailbox slot, reclaiming one whose replica died
+        Creating the request ring is the claim; the slot's pid is written into
+        the state segment last, which is when the owner starts serving it.
+        """
+        for index in range(MAX_MAILBOXES):
+            # Claims of one slot are serialized by a lock segment (a dead holder's tracker removes it)
+            try:
+                lock = shared_memory.SharedMemory(name=f'{prefix}_mbox{index}_lock', create=True, size=1)
+            except FileExistsError:
+                continue
+            try:
+                mailbox = cls._claim_slot(prefix, index, state_buf)
+            finally:
+                lock.close()
+                lock.unlink()
+            if mailbox is not None:
+                return mailbox
+        raise RuntimeError(f"All {MAX_MAILBOXES} command mailboxes are in use")
+
+    @classmethod
+    def _claim_slot(cls, prefix: str, index: int, state_buf) -> Optional['Mailbox']:
+        names = f'{prefix}_mbox{index}_cmd', f'{prefix}_mbox{index}_rep'
+        try:
+            requests = TelemetryRing.create(64, 1024, names[0])
+        except FileExistsError:
+            pid = _mailbox_pid(state_buf, index)
+            if pid == 0 or _pid_alive(pid):
+                return None
+            print(f"Reclaiming command mailbox {index} of dead replica pid {pid}")
+            for name in names:
+                _unlink_stale(name)
+            requests = TelemetryRing.create(64, 1024, names[0])
+        try:
+            replies = TelemetryRing.create(64, 4096, names[1])
+        except FileExistsError:
+            # Left behind by a replica that crashed after claiming this slot
+            _unlink_stale(names[1])
+            replies = TelemetryRing.create(64, 4096, names[1])
+        _set_mailbox_pid(state_buf, index, os.getpid())
+        return cls(index, requests, replies, state_buf=state_buf)
+
+    def command(self, command: str, car_id: str, args=None):
+        """Send a command to the owner and wait for its reply"""
+        with self._lock:
+            self._next_id += 1
+            request_id = self._next_id
+            self.requests.write(json.dumps({'id': request_id, 'command': command,
+                                            'car_id': car_id, 'args': args}).encode())
+            deadline = time.monotonic() + self.timeout
+            while time.monotonic() < deadline:
+                payloads, self._reply_cursor, _ = self.replies.read(self._reply_cursor)
+                for payload in payloads:
+                    reply = json.loads(payload)
+                    if reply['id'] == request_id:
+                        return reply['reply']
+                time.sleep(0.001)
+        return ('error', 'Owner worker did not answer')
+
+    def close(self):
+        # Tell the owner to drop this slot before it can be claimed again
+        self.requests.write(json.dumps({'id': 0, 'command': 'detach'}).encode())
+        if self.state_buf is not None:
+            _set_mailbox_pid(self.state_buf, self.index, 0)
+        time.sleep(0.05)
+        self.requests.close()
+        self.replies.close()
+
+
+class SharedElevatorState:
+    """
+    Owner or replica view of the shared car state
+
+    open() decides the role: exactly one worker succeeds in creating the state
+    segment (or takes it over when the previous owner stopped heartbeating).
+    A running replica does not take over a dead owner's role (see the module
+    docstring).
+    """
+
+    def __init__(self, prefix: str, shm: shared_memory.SharedMemory, telemetry: TelemetryRing, owner: bool):
+        self.prefix = prefix
+        self.shm = shm
+        self.buf = shm.buf
+        self.telemetry = telemetry
+        self.owner = owner
+        self.cars: Dict[str, ProcessCar] = {}
+        self.mailbox: Optional[Mailbox] = None
+        self._publish_lock = threading.Lock()
+        self._running = False
+        self._thread = None
+
+    @classmethod
+    def open(cls, prefix: str = 'elevator', telemetry_slots: int = 1024) -> 'SharedElevatorState':
+        name = f'{prefix}_state'
+        for _ in range(3):
+            try:
+                shm = shared_memory.SharedMemory(name=name, create=True, size=_STATE_SIZE)
+            except FileExistsError:
+                state = cls._attach(prefix, name)
+                if state is not None:
+                    return state
+                continue
+
+            try:
+                telemetry = TelemetryRing.create(telemetry_slots, 2048, f'{prefix}_telemetry')
+            except FileExistsError:
+                _unlink_stale(f'{prefix}_telemetry')
+                telemetry = TelemetryRing.create(telemetry_slots, 2048, f'{prefix}_telemetry')
+            _STATE_HEADER.pack_into(shm.buf, 0, MAGIC, os.getpid(), time.time())
+            print(f"Shared state owner (pid {os.getpid()})")
+            return cls(prefix, shm, telemetry, owner=True)
+        raise RuntimeError(f"Could not open shared state segment {name}")
+
+    @classmethod
+    def _attach(cls, prefix: str, name: str) -> Optional['SharedElevatorState']:
+        """Attach as a replica, or clear a dead owner's segment and return None"""
+        shm = shared_memory.SharedMemory(name=name)
+        deadline = time.monotonic() + 5.0
+        magic, pid, heartbeat = _STATE_HEADER.unpack_from(shm.buf, 0)
+        while magic != MAGIC and time.monotonic() < deadline:
+            # Owner is still creating the telemetry ring
+            time.sleep(0.05)
+            magic, pid, heartbeat = _STATE_HEADER.unpack_from(shm.buf, 0)
+
+        if magic != MAGIC or time.time() - heartbeat > OWNER_TIMEOUT:
+            print(f"Shared state owner (pid {pid}) is gone, taking over")
+            shm.close()
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+            return None
+
+        # The owner unlinks the segment; this worker's resource tracker must not at its exit
+        untrack(shm)
+        telemetry = TelemetryRing.attach(f'{prefix}_telemetry')
+        print(f"Shared state replica of owner pid {pid}")
+        return cls(prefix, shm, telemetry, owner=False)
+
+    # Owner side
+
+    def publish(self, kind: str, car_id: str, data: dict, status: Optional[dict] = None):
+        """Append a telemetry frame and, if given, replace the status snapshot"""
+        payload = json.dumps({'kind': kind, 'car_id': car_id, 'data': data}).encode()
+        with self._publish_lock:
+            self.telemetry.write(payload)
+            if status is not None:
+                self._write_status(json.dumps(status).encode())
+
+    def _write_status(self, payload: bytes):
+        if len(payload) > STATUS_CAPACITY:
+            return
+        seq = struct.unpack_from('<Q', self.buf, _STATUS_SEQ_OFFSET)[0]
+        struct.pack_into('<Q', self.buf, _STATUS_SEQ_OFFSET, seq + 1)  # odd: write in progress
+        self.buf[_STATUS_OFFSET:_STATUS_OFFSET + len(payload)] = payload
+        struct.pack_into('<I', self.buf, _STATUS_LENGTH_OFFSET, len(payload))
+        struct.pack_into('<Q', self.buf, _STATUS_SEQ_OFFSET, seq + 2)
+
+    def serve_commands(self, cars: Dict[str, object], poll_interval: float = 0.005):
+        """Execute replica commands against the owner's cars on a background thread"""
+        self._running = True
+        self._thread = threading.Thread(target=self._serve_loop, args=(cars, poll_interval),
+                                        name='shared-state-owner', daemon=True)
+        self._thread.start()
+
+    def _serve_loop(self, cars: Dict[str, object], poll_interval: float):
+        mailboxes: Dict[int, Tuple[TelemetryRing, TelemetryRing, int, int]] = {}
+        next_discovery = 0.0
+        emit = lambda kind, car_id, data: self.publish(kind, car_id, data)
+
+        while self._running:
+            now = time.monotonic()
+            if now >= next_discovery:
+                struct.pack_into('<d', self.buf, 8, time.time())
+                self._discover(mailboxes)
+                next_discovery = now + HEARTBEAT_INTERVAL
+
+            busy = False
+            for index, (requests, replies, cursor, pid) in list(mailboxes.items()):
+                payloads, cursor, _ = requests.read(cursor)
+                mailboxes[index] = (requests, replies, cursor, pid)
+                for payload in payloads:
+                    busy = True
+                    request = json.loads(payload)
+                    if request['command'] == 'detach':
+                        requests.close()
+                        replies.close()
+                        del mailboxes[index]
+                        break
+                    try:
+                        reply = execute_command(cars[request['car_id']], request['command'], request['args'], emit)
+                    except Exception as e:
+                        reply = ('error', str(e))
+                    replies.write(json.dumps({'id': request['id'], 'reply': reply}).encode())
+            if not busy:
+                time.sleep(poll_interval)
+
+        for requests, replies, _, _ in mailboxes.values():
+            requests.close()
+            replies.close()
+
+    def _discover(self, mailboxes: Dict[int, Tuple[TelemetryRing, TelemetryRing, int, int]]):
+        for index in range(MAX_MAILBOXES):
+            pid = _mailbox_pid(self.buf, index)
+            if index in mailboxes:
+                # Replica gone or its slot reclaimed by another one: let go of the old rings
+                if pid == mailboxes[index][3] and _pid_alive(pid):
+                    continue
+                requests, replies, _, _ = mailboxes.pop(index)
+                requests.close()
+                replies.close()
+            if pid == 0 or not _pid_alive(pid):
+                continue
+            try:
+                requests = TelemetryRing.attach(f'{self.prefix}_mbox{index}_cmd')
+            except FileNotFoundError:
+                continue
+            try:
+                replies = TelemetryRing.attach(f'{self.prefix}_mbox{index}_rep')
+            except FileNotFoundError:
+                # Replica is still creating it; pick it up on the next pass
+                requests.close()
+                continue
+            # Rings are new with each claim, so commands sent before this pass are served too
+            mailboxes[index] = (requests, replies, 0, pid)
+
+    # Replica side
+
+    def read_status(self) -> Optional[dict]:
+        """Consistent copy of the owner's status snapshot (seqlock read)"""
+        for _ in range(100):
+            seq = struct.unpack_from('<Q', self.buf, _STATUS_SEQ_OFFSET)[0]
+            if seq % 2:
+                continue
+            length = struct.unpack_from('<I', self.buf, _STATUS_LENGTH_OFFSET)[0]
+            payload = bytes(self.buf[_STATUS_OFFSET:_STATUS_OFFSET + length])
+            if struct.unpack_from('<Q', self.buf, _STATUS_SEQ_OFFSET)[0] == seq:
+                return json.loads(payload) if length else None
+        return None
+
+    @property
+    def owner_alive(self) -> bool:
+        if self.owner:
+            return True
+        _, _, heartbeat = _STATE_HEADER.unpack_from(self.buf, 0)
+        return time.time() - heartbeat <= OWNER_TIMEOUT
+
+    def car(self, car_id: str = 'car_1') -> ProcessCar:
+        """Replica proxy for one of the owner's cars, commanded through this worker's mailbox"""
+        if car_id not in self.cars:
+            if self.mailbox is None:
+                self.mailbox = Mailbox.claim(self.prefix, self.buf)
+            status = self.read_status() or {}
+            self.cars[car_id] = ProcessCar(self.mailbox, car_id, status)
+        return self.cars[car_id]
+
+    def follow(self, poll_interval: float = 0.005, on_frame: Optional[Callable[[str, str, dict], None]] = None):
+        """Replay retained telemetry, then keep dispatching new frames to the replica cars"""
+        self._running = True
+        self._thread = threading.Thread(target=self._follow_loop, args=(poll_interval, on_frame),
+                                        name='shared-state-replica', daemon=True)
+        self._thread.start()
+
+    def _follow_loop(self, poll_interval: float, on_frame):
+        cursor = max(0, self.telemetry.write_count - self.telemetry.slots)
+        while self._running:
+            payloads, cursor, _ = self.telemetry.read(cursor)
+            for payload in payloads:
+                try:
+                    frame = json.loads(payload)
+                    if on_frame is not None:
+                        on_frame(frame['kind'], frame['car_id'], frame['data'])
+                    car = self.cars.get(frame['car_id'])
+                    if car is not None:
+                        car._on_frame(frame['kind'], frame['data'])
+                except Exception as e:
+                    print(f"Error dispatching shared frame: {e}")
+            if not payloads:
+                time.sleep(poll_interval)
+
+    def close(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+        if self.mailbox is not None:
+            self.mailbox.close()
+        self.telemetry.close()
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
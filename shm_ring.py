@@ -0,0 +1,132 @@
+"""
+Single-producer ring buffer in shared memory
+Used to stream telemetry frames out of the car engine process without
+pickling them through a pipe. Each slot carries its own sequence number
+(odd while being written, even when complete), so a reader that is lapped by
+the writer detects the overwritten frames and counts them as dropped
+"""
+
+import os
+import struct
+from multiprocessing import resource_tracker, shared_memory
+from typing import List, Optional, Tuple
+
+# slots, slot_size, write_count
+_HEADER = struct.Struct('<IIQ')
+# sequence, payload length
+_SLOT_HEADER = struct.Struct('<QI')
+_WRITE_COUNT_OFFSET = 8
+
+
+class TelemetryRing:
+    """
+    Fixed-size frame ring in a multiprocessing.shared_memory segment
+
+    Exactly one process may write; any number may read, each with its own
+    cursor (the number of frames it has consumed so far).
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self.shm = shm
+        self.owner = owner
+        self.buf = shm.buf
+        self.slots, self.slot_size, _ = _HEADER.unpack_from(self.buf, 0)
+        self.max_payload = self.slot_size - _SLOT_HEADER.size
+
+    @classmethod
+    def create(cls, slots: int = 1024, slot_size: int = 2048, name: Optional[str] = None) -> 'TelemetryRing':
+        """New ring; with a name, raises FileExistsError if the segment already exists"""
+        shm = shared_memory.SharedMemory(name=name, create=True, size=_HEADER.size + slots * slot_size)
+        _HEADER.pack_into(shm.buf, 0, slots, slot_size, 0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> 'TelemetryRing':
+        """Existing ring; only its creator's close() unlinks it"""
+        shm = shared_memory.SharedMemory(name=name)
+        untrack(shm)
+        return cls(shm, owner=False)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def write_count(self) -> int:
+        return struct.unpack_from('<Q', self.buf, _WRITE_COUNT_OFFSET)[0]
+
+    def _slot_offset(self, index: int) -> int:
+        return _HEADER.size + (index % self.slots) * self.slot_size
+
+    def write(self, payload: bytes) -> bool:
+        """Append one frame; returns False (frame dropped) if it does not fit a slot"""
+        if len(payload) > self.max_payload:
+            return False
+        index = self.write_count
+        offset = self._slot_offset(index)
+        _SLOT_HEADER.pack_into(self.buf, offset, 2 * index + 1, len(payload))
+        start = offset + _SLOT_HEADER.size
+        self.buf[start:start + len(payload)] = payload
+        _SLOT_HEADER.pack_into(self.buf, offset, 2 * index + 2, len(payload))
+        struct.pack_into('<Q', self.buf, _WRITE_COUNT_OFFSET, index + 1)
+        return True
+
+    def _read_slot(self, index: int) -> Optional[bytes]:
+        offset = self._slot_offset(index)
+        expected = 2 * index + 2
+        sequence, length = _SLOT_HEADER.unpack_from(self.buf, offset)
+        if sequence != expected or length > self.max_payload:
+            return None
+        start = offset + _SLOT_HEADER.size
+        payload = bytes(self.buf[start:start + length])
+        # Re-check: the writer may have lapped us while we copied
+        if _SLOT_HEADER.unpack_from(self.buf, offset)[0] != expected:
+            return None
+        return payload
+
+    def read(self, cursor: int) -> Tuple[List[bytes], int, int]:
+        """Frames written since cursor, as (payloads, new_cursor, dropped)"""
+        head = self.write_count
+        dropped = 0
+        if head - cursor > self.slots:
+            dropped = head - cursor - self.slots
+            cursor = head - self.slots
+        payloads = []
+        for index in range(cursor, head):
+            payload = self._read_slot(index)
+            if payload is None:
+                dropped += 1
+            else:
+                payloads.append(payload)
+        return payloads, head, dropped
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def untrack(shm: shared_memory.SharedMemory):
+    """
+    Keep this process's resource tracker from unlinking a segment it attached to
+    On Python < 3.13 attaching registers the segment as if this process had
+    created it, and the tracker unlinks it when the process exits, under every
+    other process still using it. A tracker inherited from the parent (spawned
+    or forked workers) is shared with the creator and already holds the
+    segment; dropping it there would lose the creator's registration instead.
+    """
+    if os.name == 'posix' and _own_tracker():
+        resource_tracker.unregister(shm._name, 'shared_memory')
+
+
+def _own_tracker() -> bool:
+    """Whether this process started its resource tracker (attaching has made sure there is one)"""
+    pid = getattr(resource_tracker._resource_tracker, '_pid', None)
+    if pid is None:
+        return False  # fd handed down by a spawning parent
+    try:
+        os.waitpid(pid, os.WNOHANG)
+    except ChildProcessError:
+        return False  # copied from the parent by fork
+    return True
@@ -3,15 +3,23 @@ Simplified elevator controller for testing without MQTT broker
 This version simulates MQTT functionality for demonstration purposes
 """
 
+import sys
 import time
 import threading
 import asyncio
 import logging
 from typing import Optional, Callable
 from elevator_fuzzy_controller import ElevatorFuzzyController
+from control_scheduler import FixedRateScheduler
+from trip_handle import TripHandle
+from tracer import TRACER
+from structured_log import StructuredLogger, configure_logging
+from metrics import (COMPUTE_CONTROL_SECONDS, CONTROL_TICK_SECONDS, EMERGENCY_STOP_LATENCY_SECONDS,
+                     FLOOR_REQUEST_TO_START_SECONDS)
 import json
 
 logger = logging.getLogger(__name__)
+log = StructuredLogger(__name__)  # per-tick records, rate limited per site
 
 class SimpleElevatorController:
     """
@@ -19,8 +27,16 @@ class SimpleElevatorController:
     Simulates MQTT functionality for testing and demonstration
     """
     
-    def __init__(self):
-        self.controller = ElevatorFuzzyController()
+    # Movement tuning
+    tolerance = 0.02  # 2cm tolerance for precise stopping
+    max_iterations = 300  # Maximum 60 seconds at 200ms sampling
+    required_stable_iterations = 5  # Need 5 stable readings to stop (1 second)
+    min_movement_threshold = 0.001  # Minimum movement to consider progress (1mm)
+    
+    def __init__(self, controller: Optional[ElevatorFuzzyController] = None, car_id: str = "car_1"):
+        # Cars driven from the same thread (e.g. one event loop) may share a fuzzy controller
+        self.controller = controller or ElevatorFuzzyController()
+        self.car_id = car_id
         
         # Current elevator state
         self.current_floor = "terreo"
@@ -34,6 +50,19 @@ class SimpleElevatorController:
         # Movement simulation state
         self.simulation_thread = None
         self.stop_simulation = False
+        self.stop_event = threading.Event()  # wakes the control loop as soon as a stop is requested
+        self.stop_requested_at = None  # perf_counter() when the pending emergency stop was received
+        self.last_stop_latency = None  # seconds from emergency_stop receipt to the zero-power tick
+        self.request_time = None  # perf_counter() at the last accepted move_to_floor
+        self.catch_up_ticks = False  # after an overrun: False skips missed ticks, True runs them back to back
+        self.last_tick_stats = None  # FixedRateScheduler.stats() of the last movement
+        self.current_trip: Optional[TripHandle] = None
+        
+        # Per-movement tracking state, reset by _begin_movement
+        self.iteration = 0
+        self.stable_count = 0
+        self.position_history = []
+        self.startup_direction = 0
         
         # Callbacks
         self.position_callback: Optional[Callable] = None
@@ -61,206 +90,338 @@ class SimpleElevatorController:
     
     def disconnect(self):
         """Simulate MQTT disconnection"""
-        self.stop_simulation = True
+        self._cancel_movement()
         if self.simulation_thread and self.simulation_thread.is_alive():
             self.simulation_thread.join()
         print("Simulated MQTT connection closed")
     
-    def move_to_floor(self, target_floor: str):
-        """Initiate movement to target floor"""
+    def move_to_floor(self, target_floor: str) -> TripHandle:
+        """Initiate movement to target floor
+
+        Returns a TripHandle that is truthy if the movement started; use
+        result(timeout), await or cancel() on it to follow the trip.
+        """
+        trip = self._accept_request(target_floor)
+        if not trip:
+            return trip
+        
+        self._start_movement()
+        
+        # Publish status update
+        self._publish_status_update()
+        
+        return trip
+    
+    async def move_to_floor_async(self, target_floor: str) -> TripHandle:
+        """Start a movement and wait for it to finish without blocking the event loop"""
+        trip = self.move_to_floor(target_floor)
+        if trip:
+            await trip
+        return trip
+    
+    def _accept_request(self, target_floor: str) -> TripHandle:
+        """Validate a floor request and set up the target state for a new movement"""
         if self.is_moving:
             print("Elevator is already moving")
-            return False
+            return TripHandle.rejected(self.car_id, target_floor, "Elevator is already moving")
         
         try:
             # Validate floor
             target_position = self.controller.get_floor_position(target_floor)
-            
-            if abs(target_position - self.current_position) < 0.1:
-                print(f"Already at floor {target_floor}")
-                return False
-            
-            self.target_floor = target_floor
-            self.target_position = target_position
-            self.direction = 1 if target_position > self.current_position else -1
-            self.is_moving = True
-            self.previous_error = target_position - self.current_position
-              # Start simulation in a separate thread
-            self.stop_simulation = False
-            self.simulation_thread = threading.Thread(target=self._run_movement_simulation)
-            self.simulation_thread.start()
-            
-            # Publish status update
-            self._publish_status_update()
-            
-            return True
-            
         except ValueError as e:
             print(f"Invalid floor request: {e}")
-            return False
+            return TripHandle.rejected(self.car_id, target_floor, f"Invalid floor request: {e}")
+        
+        if abs(target_position - self.current_position) < 0.1:
+            print(f"Already at floor {target_floor}")
+            return TripHandle.rejected(self.car_id, target_floor, f"Already at floor {target_floor}")
+        
+        self.target_floor = target_floor
+        self.target_position = target_position
+        self.direction = 1 if target_position > self.current_position else -1
+        self.is_moving = True
+        self.previous_error = target_position - self.current_position
+        self.request_time = time.perf_counter()
+        self.stop_simulation = False
+        self.stop_event.clear()
+        self.stop_requested_at = None
+        
+        self.current_trip = TripHandle(self.car_id, self.current_floor, target_floor,
+                                       self.current_position, target_position)
+        self.current_trip.set_cancel_callback(self._cancel_movement)
+        return self.current_trip
+    
+    def _cancel_movement(self):
+        """Stop the running movement where it is (TripHandle.cancel, emergency_stop)"""
+        self.stop_simulation = True
+        self.stop_event.set()
+    
+    def _start_movement(self):
+        """Start the movement simulation in a separate thread"""
+        self.simulation_thread = threading.Thread(target=self._run_movement_simulation)
+        self.simulation_thread.start()
     
     def _run_movement_simulation(self):
         """Run the real-time movement simulation with Linear Acceleration System"""
-        tolerance = 0.02  # 2cm tolerance for precise stopping
-        max_iterations = 300  # Maximum 60 seconds at 200ms sampling
-        iteration = 0
-          # Linear Acceleration System tracking
-        movement_start_time = time.time()
-        startup_direction = self.direction  # Store initial direction for startup phase
-        
-        # Variables to track movement stability
-        position_history = []
-        stable_count = 0
-        required_stable_iterations = 5  # Need 5 stable readings to stop (1 second)
-        min_movement_threshold = 0.001  # Minimum movement to consider progress (1mm)
-        
-        print(f"Starting movement from {self.current_floor} to {self.target_floor}")
-        print(f"Linear Acceleration System: 0% → 31.5% over 2 seconds")
+        self._begin_movement()
+        scheduler = FixedRateScheduler(self.controller.sampling_time, catch_up=self.catch_up_ticks,
+                                       wake_event=self.stop_event)
         
         while (not self.stop_simulation and 
-               iteration < max_iterations):
+               self.iteration < self.max_iterations):
             
             try:
-                current_error = self.target_position - self.current_position
-                
-                # Check if we've reached the target with required precision
-                if abs(current_error) <= tolerance:
-                    stable_count += 1
-                    print(f"At target (count {stable_count}/{required_stable_iterations}), error: {abs(current_error)*1000:.1f}mm")
-                    if stable_count >= required_stable_iterations:
-                        print(f"Target reached with stable position. Final error: {abs(current_error)*1000:.1f}mm")
-                        break
-                else:
-                    stable_count = 0                # Check if we're in the Linear Acceleration System phase (first 2 seconds)
-                elapsed_time = time.time() - movement_start_time
-                startup_power = self.controller.compute_startup_power(elapsed_time, startup_direction)
-                
-                if startup_power is not None:
-                    # Linear Acceleration System active (0-2 seconds)
-                    motor_power = startup_power  # startup_power já é sempre positivo agora
-                    print(f"Startup phase: {elapsed_time:.1f}s, power: {motor_power:.1f}%, direction: {startup_direction}")
-                else:
-                    # Normal fuzzy control (after 2 seconds) - agora retorna potência sempre positiva
-                    motor_power, fuzzy_error = self.controller.compute_control(
-                        self.current_position, 
-                        self.target_position, 
-                        self.previous_error
-                    )
-                    
-                    # Direction baseada no erro, não na potência (que agora é sempre positiva)
-                    old_direction = self.direction
-                    self.direction = 1 if current_error > 0 else -1
-                    
-                    # Detect direction change (overshoot)
-                    if old_direction != 0 and old_direction != self.direction:
-                        print(f"Direction change detected (overshoot), power: {motor_power:.1f}%, new direction: {self.direction}")
-                
-                # Force stop if error is very small
-                if abs(current_error) <= tolerance:
-                    motor_power = 0
-                    print(f"Forcing stop - within tolerance")                # Apply minimum motor power threshold to avoid very slow movements
-                elif motor_power < 3.0:  # Below 3% motor power (sempre positivo)
-                    if abs(current_error) > tolerance * 2:  # Only if significantly far from target
-                        motor_power = 3.0  # Minimum positive power
-                        print(f"Applying minimum motor power: {motor_power}%")
-                    else:
-                        motor_power = 0  # Stop if close to target and low power
-                        print(f"Low power and close to target - stopping")
-                
-                # Update position - nova lógica: motor_power sempre positivo, k1 controla direção
-                old_position = self.current_position
-                # Direction baseada no erro para determinar k1
-                current_direction = 1 if current_error > 0 else -1
+                tick_start = time.perf_counter()
+                tick_mark = TRACER.mark()
+                if self.iteration == 0:
+                    FLOOR_REQUEST_TO_START_SECONDS.observe(tick_start - self.request_time)
                 
-                self.current_position = self.controller.update_position(
-                    self.current_position, 
-                    motor_power,  # Sempre positivo agora
-                    current_direction  # k1 será +1 ou -1 baseado na direção
-                )
+                if not self._control_step(scheduler.elapsed, 1 + scheduler.last_skipped):
+                    break
                 
-                # Track actual movement
-                actual_movement = abs(self.current_position - old_position)
-                
-                # Track position history for oscillation detection
-                position_history.append(self.current_position)
-                if len(position_history) > 10:  # Keep last 10 positions
-                    position_history.pop(0)
-                
-                # Check for oscillation (position bouncing around target)
-                if len(position_history) >= 6:
-                    recent_positions = position_history[-6:]
-                    position_variance = max(recent_positions) - min(recent_positions)
-                    if position_variance < tolerance * 2 and abs(current_error) < tolerance * 1.5:
-                        print(f"Oscillation detected, stopping. Variance: {position_variance*1000:.1f}mm")
-                        break
-                
-                # Check for stalled movement
-                if len(position_history) >= 8:
-                    recent_movement = abs(position_history[-1] - position_history[-8])
-                    if recent_movement < min_movement_threshold and abs(current_error) > tolerance:
-                        print(f"Movement stalled, recent movement: {recent_movement*1000:.1f}mm, error: {abs(current_error)*1000:.1f}mm")
-                        if abs(current_error) <= tolerance * 3:  # Close enough to target
-                            print("Close to target, stopping")
-                            break
-                        else:
-                            # Force a correction movement
-                            correction = tolerance/3 * (1 if current_error > 0 else -1)
-                            self.current_position += correction
-                            print(f"Applied correction: {correction*1000:.1f}mm")
-                
-                # Update previous error
-                self.previous_error = current_error
-                  # Create position update message
-                position_data = {
-                    'timestamp': time.time(),
-                    'current_position': self.current_position,
-                    'target_position': self.target_position,
-                    'current_floor': self._get_nearest_floor(),
-                    'target_floor': self.target_floor,                    'motor_power': motor_power,  # Sempre positivo agora
-                    'error': current_error,
-                    'direction': 'up' if current_error > 0 else ('down' if current_error < 0 else 'stopped'),
-                    'is_moving': True
-                }
-                
-                # Call position callback if set
-                self._safe_callback(self.position_callback, position_data)
-                
-                # Print progress - power sempre positivo, direction baseada no erro
-                if iteration % 10 == 0:  # Print every 2 seconds
-                    direction_str = "up" if current_error > 0 else ("down" if current_error < 0 else "stopped")
-                    print(f"Position: {self.current_position:.2f}m, Motor: {motor_power:.1f}%, Error: {current_error*1000:+.1f}mm, Dir: {direction_str}")
-                
-                iteration += 1
-                time.sleep(self.controller.sampling_time)
+                CONTROL_TICK_SECONDS.observe(time.perf_counter() - tick_start)
+                if tick_mark:
+                    TRACER.span('control_tick', tick_mark, args={'car_id': self.car_id, 'iteration': self.iteration})
+                sleep_mark = TRACER.mark()
+                scheduler.wait_next()
+                TRACER.span('sleep', sleep_mark)
                 
             except Exception as e:
                 print(f"Error in movement simulation: {e}")
                 break
         
+        self._finish_movement(scheduler.stats())
+    
+    def _begin_movement(self):
+        """Reset the per-movement tracking state before the first control tick"""
+        self.iteration = 0
+        # Linear Acceleration System tracking (ramp time comes from the tick schedule)
+        self.startup_direction = self.direction  # Store initial direction for startup phase
+        
+        # Variables to track movement stability
+        self.position_history = []
+        self.stable_count = 0
+        
+        print(f"Starting movement from {self.current_floor} to {self.target_floor}")
+        print(f"Linear Acceleration System: 0% → 31.5% over 2 seconds")
+    
+    def _fuzzy_control(self):
+        """Fuzzy motor power for the car's current state: (power, fuzzy error)"""
+        compute_start = time.perf_counter()
+        control = self.controller.compute_control(
+            self.current_position, 
+            self.target_position, 
+            self.previous_error
+        )
+        COMPUTE_CONTROL_SECONDS.observe(time.perf_counter() - compute_start)
+        return control
+    
+    def _control_step(self, elapsed_time: float, steps: int = 1, control=None) -> bool:
+        """Run one control tick; returns False when the movement should end
+
+        elapsed_time is the scheduled time since the movement started and drives
+        the Linear Acceleration System ramp. steps is the number of sampling
+        periods since the previous tick (more than 1 after skipped ticks): the
+        motor power is held over all of them, so the simulated position keeps
+        up with the schedule. control is a _fuzzy_control() result the caller
+        already computed for this tick, used instead of computing it here.
+        """
+        tolerance = self.tolerance
+        current_error = self.target_position - self.current_position
+        debug = log.isEnabledFor(logging.DEBUG)
+        
+        # Check if we've reached the target with required precision
+        if abs(current_error) <= tolerance:
+            self.stable_count += 1
+            if debug:
+                log.debug('control.at_target', "At target", car_id=self.car_id, count=self.stable_count,
+                          required=self.required_stable_iterations, error_mm=abs(current_error)*1000)
+            if self.stable_count >= self.required_stable_iterations:
+                log.info('control.target_reached', "Target reached with stable position",
+                         car_id=self.car_id, error_mm=abs(current_error)*1000)
+                return False
+        else:
+            self.stable_count = 0
+        
+        # Check if we're in the Linear Acceleration System phase (first 2 seconds)
+        mark = TRACER.mark()
+        startup_power = self.controller.compute_startup_power(elapsed_time, self.startup_direction)
+        mark = TRACER.span('startup_ramp', mark)
+        
+        if startup_power is not None:
+            # Linear Acceleration System active (0-2 seconds)
+            control_phase = 'startup'
+            motor_power = startup_power  # startup_power já é sempre positivo agora
+            if debug:
+                log.debug('control.startup', "Startup phase", rate=1.0, car_id=self.car_id,
+                          elapsed_s=elapsed_time, power=motor_power, direction=self.startup_direction)
+        else:
+            # Normal fuzzy control (after 2 seconds) - agora retorna potência sempre positiva
+            control_phase = 'fuzzy'
+            motor_power, fuzzy_error = control if control is not None else self._fuzzy_control()
+            mark = TRACER.span('fuzzy_compute', mark)
+            
+            # Direction baseada no erro, não na potência (que agora é sempre positiva)
+            old_direction = self.direction
+            self.direction = 1 if current_error > 0 else -1
+            
+            # Detect direction change (overshoot)
+            if old_direction != 0 and old_direction != self.direction:
+                log.info('control.overshoot', "Direction change detected (overshoot)", rate=1.0,
+                         car_id=self.car_id, power=motor_power, direction=self.direction)
+        
+        # Force stop if error is very small
+        if abs(current_error) <= tolerance:
+            motor_power = 0
+            if debug:
+                log.debug('control.forcing_stop', "Forcing stop - within tolerance", rate=1.0, car_id=self.car_id)
+        # Apply minimum motor power threshold to avoid very slow movements
+        elif motor_power < 3.0:  # Below 3% motor power (sempre positivo)
+            if abs(current_error) > tolerance * 2:  # Only if significantly far from target
+                motor_power = 3.0  # Minimum positive power
+                if debug:
+                    log.debug('control.min_power', "Applying minimum motor power", rate=1.0,
+                              car_id=self.car_id, power=motor_power)
+            else:
+                motor_power = 0  # Stop if close to target and low power
+                if debug:
+                    log.debug('control.low_power_stop', "Low power and close to target - stopping", rate=1.0,
+                              car_id=self.car_id)
+        
+        # Update position - nova lógica: motor_power sempre positivo, k1 controla direção
+        # Direction baseada no erro para determinar k1
+        current_direction = 1 if current_error > 0 else -1
+        
+        mark = TRACER.mark()
+        for _ in range(steps):
+            self.current_position = self.controller.update_position(
+                self.current_position, 
+                motor_power,  # Sempre positivo agora
+                current_direction  # k1 será +1 ou -1 baseado na direção
+            )
+        mark = TRACER.span('position_update', mark)
+        
+        # Track position history for oscillation detection
+        position_history = self.position_history
+        position_history.append(self.current_position)
+        if len(position_history) > 10:  # Keep last 10 positions
+            position_history.pop(0)
+        
+        # Check for oscillation (position bouncing around target)
+        if len(position_history) >= 6:
+            recent_positions = position_history[-6:]
+            position_variance = max(recent_positions) - min(recent_positions)
+            if position_variance < tolerance * 2 and abs(current_error) < tolerance * 1.5:
+                log.info('control.oscillation', "Oscillation detected, stopping",
+                         car_id=self.car_id, variance_mm=position_variance*1000)
+                return False
+        
+        # Check for stalled movement
+        if len(position_history) >= 8:
+            recent_movement = abs(position_history[-1] - position_history[-8])
+            if recent_movement < self.min_movement_threshold and abs(current_error) > tolerance:
+                log.info('control.stalled', "Movement stalled", rate=1.0, car_id=self.car_id,
+                         movement_mm=recent_movement*1000, error_mm=abs(current_error)*1000)
+                if abs(current_error) <= tolerance * 3:  # Close enough to target
+                    log.info('control.stalled_stop', "Close to target, stopping", car_id=self.car_id)
+                    return False
+                else:
+                    # Force a correction movement
+                    correction = tolerance/3 * (1 if current_error > 0 else -1)
+                    self.current_position += correction
+                    log.info('control.correction', "Applied correction", rate=1.0,
+                             car_id=self.car_id, correction_mm=correction*1000)
+        mark = TRACER.span('oscillation_stall_checks', mark)
+        
+        if self.current_trip is not None:
+            self.current_trip.record_tick(self.current_position, motor_power)
+        
+        # Update previous error
+        delta_error = abs(current_error) - abs(self.previous_error)
+        self.previous_error = current_error
+        
+        # Create position update message
+        position_data = {
+            'timestamp': time.time(),
+            'car_id': self.car_id,
+            'current_position': self.current_position,
+            'target_position': self.target_position,
+            'current_floor': self._get_nearest_floor(),
+            'target_floor': self.target_floor,
+            'motor_power': motor_power,  # Sempre positivo agora
+            'error': current_error,
+            'direction': 'up' if current_error > 0 else ('down' if current_error < 0 else 'stopped'),
+            'is_moving': True,
+            'delta_error': delta_error,
+            'control_phase': control_phase
+        }
+        
+        # Call position callback if set
+        mark = TRACER.mark()
+        self._safe_callback(self.position_callback, position_data)
+        TRACER.span('callback_dispatch', mark)
+        
+        # Print progress - power sempre positivo, direction baseada no erro
+        if self.iteration % 10 == 0:  # Print every 2 seconds
+            direction_str = "up" if current_error > 0 else ("down" if current_error < 0 else "stopped")
+            log.info('control.progress', "Position", rate=2.0, car_id=self.car_id, position=self.current_position,
+                     motor_power=motor_power, error_mm=current_error*1000, direction=direction_str)
+        
+        self.iteration += 1
+        return True
+    
+    def _finish_movement(self, tick_stats: dict):
+        """Settle the final state and notify listeners that the movement ended"""
         # Movement completed or stopped
+        emergency = self.stop_requested_at is not None
+        if emergency:
+            # This frame is the first zero-power command after the stop
+            self.last_stop_latency = time.perf_counter() - self.stop_requested_at
+            EMERGENCY_STOP_LATENCY_SECONDS.observe(self.last_stop_latency)
+            self.stop_requested_at = None
+        
+        self.last_tick_stats = tick_stats
         self.is_moving = False
         self.direction = 0
         self.current_floor = self._get_nearest_floor()
         
         final_data = {
             'timestamp': time.time(),
+            'car_id': self.car_id,
             'current_position': self.current_position,
             'target_position': self.target_position,
             'current_floor': self.current_floor,
             'target_floor': self.target_floor,
             'motor_power': 0,
-            'error': self.target_position - self.current_position,            'direction': 'stopped',
+            'error': self.target_position - self.current_position,
+            'direction': 'stopped',
             'is_moving': False,
             'movement_completed': True
         }
+        if emergency:
+            final_data['emergency_stopped'] = True
+            final_data['stop_latency_ms'] = self.last_stop_latency * 1000
         
         self._safe_callback(self.position_callback, final_data)
         
+        if emergency:
+            # Emergency stop abandons the target
+            self.target_floor = None
+            self.target_position = None
+        
         self._publish_status_update()
         
         print(f"Movement completed. Current floor: {self.current_floor}")
         print(f"Final position: {self.current_position:.2f}m")
-        print(f"Final error: {abs(self.target_position - self.current_position)*1000:.1f}mm")
+        print(f"Final error: {abs(final_data['error'])*1000:.1f}mm")
+        if emergency:
+            print(f"Emergency stop latency: {self.last_stop_latency*1000:.2f}ms")
+        stats = self.last_tick_stats
+        print(f"Control ticks: {stats['ticks']}, overruns: {stats['overruns']}, skipped: {stats['skipped_ticks']}, "
+              f"jitter mean/max: {stats['jitter_mean_s']*1000:.2f}/{stats['jitter_max_s']*1000:.2f}ms")
+        
+        if self.current_trip is not None:
+            self.current_trip.complete(self.current_position, tick_stats)
     
     def _get_nearest_floor(self) -> str:
         """Get the nearest floor name based on current position"""
@@ -279,6 +440,7 @@ class SimpleElevatorController:
         """Simulate publishing status update"""
         status_data = {
             'timestamp': time.time(),
+            'car_id': self.car_id,
             'current_floor': self.current_floor,
             'target_floor': self.target_floor,
             'is_moving': self.is_moving,
@@ -286,11 +448,24 @@ class SimpleElevatorController:
             'current_position': self.current_position
         }
         
-        print(f"DEBUG: Publishing status update - is_moving: {self.is_moving}, floor: {self.current_floor}")
+        log.debug('status.publish', "Publishing status update", car_id=self.car_id,
+                  is_moving=self.is_moving, floor=self.current_floor)
         self._safe_callback(self.status_callback, status_data)
     
-    def emergency_stop(self):
-        """Emergency stop the elevator"""
+    def emergency_stop(self, received_at: Optional[float] = None):
+        """Emergency stop the elevator
+
+        received_at is the perf_counter() timestamp at which the stop command
+        arrived; the latency to the first zero-power tick is measured from it.
+        """
+        if self.is_moving:
+            # The control loop wakes at once and publishes the zero-power frame itself
+            self.stop_requested_at = received_at if received_at is not None else time.perf_counter()
+            if self.current_trip is None or not self.current_trip.cancel():
+                self._cancel_movement()
+            print("Emergency stop executed!")
+            return
+        
         self.stop_simulation = True
         self.is_moving = False
         self.direction = 0
@@ -299,6 +474,7 @@ class SimpleElevatorController:
         
         emergency_data = {
             'timestamp': time.time(),
+            'car_id': self.car_id,
             'current_position': self.current_position,
             'current_floor': self._get_nearest_floor(),
             'emergency_stopped': True,
@@ -350,19 +526,17 @@ def test_simple_controller():
         # Test movement
         time.sleep(2)
         print("\n--- Testing movement to Andar 3 ---")
-        controller.move_to_floor('andar_3')
+        trip = controller.move_to_floor('andar_3')
         
         # Wait for movement to complete
-        while controller.is_moving:
-            time.sleep(1)
+        print(f"Trip KPIs: {trip.result(timeout=70)}")
         
         time.sleep(2)
         print("\n--- Testing movement back to Terreo ---")
-        controller.move_to_floor('terreo')
+        trip = controller.move_to_floor('terreo')
         
         # Wait for movement to complete
-        while controller.is_moving:
-            time.sleep(1)
+        print(f"Trip KPIs: {trip.result(timeout=70)}")
         
         print("\nTest completed successfully!")
         
@@ -372,5 +546,35 @@ def test_simple_controller():
         controller.disconnect()
         print("Controller disconnected")
 
+def test_emergency_stop_latency(repeats: int = 5, bound_ms: float = 50.0):
+    """Check that emergency_stop reaches a zero-power tick well within one sampling period"""
+    controller = SimpleElevatorController()
+    stop_frames = []
+    controller.set_position_callback(
+        lambda data: stop_frames.append(data) if data.get('emergency_stopped') else None)
+    
+    latencies = []
+    targets = ['andar_8', 'terreo']
+    for n in range(repeats):
+        trip = controller.move_to_floor(targets[n % 2])
+        assert trip, trip.reason
+        # Stop during the fuzzy phase, at a different offset inside the tick each time
+        time.sleep(2.5 + n * 0.037)
+        controller.emergency_stop(time.perf_counter())
+        kpis = trip.result(timeout=5)
+        
+        assert kpis['cancelled'], kpis
+        assert stop_frames and stop_frames[-1]['motor_power'] == 0
+        assert not controller.is_moving and controller.target_position is None
+        latencies.append(controller.last_stop_latency * 1000)
+    
+    print(f"Emergency stop latency (ms): {', '.join(f'{v:.2f}' for v in latencies)}")
+    assert max(latencies) < bound_ms, f"emergency stop took {max(latencies):.2f}ms (bound {bound_ms}ms)"
+    print("Emergency stop latency test passed")
+
 if __name__ == "__main__":
-    test_simple_controller()
+    configure_logging()
+    if len(sys.argv) > 1 and sys.argv[1] == 'emergency':
+        test_emergency_stop_latency()
+    else:
+        test_simple_controller()
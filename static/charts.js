@@ -0,0 +1,102 @@
+// Batched chart rendering for the elevator dashboard
+// Incoming frames are buffered and flushed at most once per animation frame
+// with Plotly.extendTraces, keeping only the last `maxPoints` samples visible.
+
+class ChartBatcher {
+    constructor(positionDiv, motorDiv, maxPoints = 100) {
+        this.positionDiv = positionDiv;
+        this.motorDiv = motorDiv;
+        this.maxPoints = maxPoints;
+        this.pending = [];
+        this.scheduled = false;
+        this.flushCount = 0;
+        this.flush = this.flush.bind(this);
+    }
+
+    // Recreate both charts from a list of movement_data points
+    reset(data) {
+        this.pending = [];
+        const recent = data.slice(-this.maxPoints);
+        const times = recent.map(d => new Date(d.timestamp * 1000));
+
+        const positionTrace = {
+            x: times,
+            y: recent.map(d => d.position),
+            type: 'scatter',
+            mode: 'lines',
+            name: 'Posição',
+            line: {color: '#007bff'}
+        };
+
+        const targetTrace = {
+            x: times,
+            y: recent.map(d => d.target_position),
+            type: 'scatter',
+            mode: 'lines',
+            name: 'Alvo',
+            line: {color: '#dc3545', dash: 'dash'}
+        };
+
+        const positionLayout = {
+            title: '',
+            xaxis: {title: 'Tempo'},
+            yaxis: {title: 'Posição (m)'},
+            margin: {t: 20, r: 20, b: 40, l: 50},
+            showlegend: true,
+            legend: {x: 0, y: 1}
+        };
+
+        Plotly.newPlot(this.positionDiv, [positionTrace, targetTrace], positionLayout);
+
+        const motorTrace = {
+            x: times,
+            y: recent.map(d => Math.abs(d.motor_power)),  // Show power as positive value
+            type: 'scatter',
+            mode: 'lines',
+            name: 'Potência',
+            line: {color: '#28a745'}
+        };
+
+        const motorLayout = {
+            title: '',
+            xaxis: {title: 'Tempo'},
+            yaxis: {title: 'Potência (%)'},
+            margin: {t: 20, r: 20, b: 40, l: 50}
+        };
+
+        Plotly.newPlot(this.motorDiv, [motorTrace], motorLayout);
+    }
+
+    // Queue one position frame; rendering happens on the next animation frame
+    push(timestamp, position, target, power) {
+        this.pending.push([timestamp, position, target, power]);
+        // Never hold more than one window of samples between flushes
+        if (this.pending.length > this.maxPoints) {
+            this.pending.splice(0, this.pending.length - this.maxPoints);
+        }
+        if (!this.scheduled) {
+            this.scheduled = true;
+            requestAnimationFrame(this.flush);
+        }
+    }
+
+    flush() {
+        this.scheduled = false;
+        if (this.pending.length === 0) {
+            return;
+        }
+        const batch = this.pending;
+        this.pending = [];
+
+        const times = batch.map(p => new Date(p[0]));
+        Plotly.extendTraces(this.positionDiv, {
+            x: [times, times],
+            y: [batch.map(p => p[1]), batch.map(p => p[2])]
+        }, [0, 1], this.maxPoints);
+        Plotly.extendTraces(this.motorDiv, {
+            x: [times],
+            y: [batch.map(p => p[3])]
+        }, [0], this.maxPoints);
+        this.flushCount += 1;
+    }
+}
@@ -0,0 +1,205 @@
+"""
+Structured logging for the control loop and web service hot paths
+Every call names its site (e.g. 'broadcast.sent'); a site may be rate limited
+(at most `rate` records per second) or sampled (one record in `sample`), and
+the records it suppressed are counted and reported on the next one it lets
+through. Records go to a QueueHandler and are formatted and written by a
+QueueListener thread, so the control loop and the event loop never block on
+stdout. A queued record still costs ~20 us against ~2 us for a print, so
+per-tick sites log at DEBUG behind an isEnabledFor check.
+
+    ELEVATOR_LOG_LEVEL=DEBUG     log level (default INFO)
+    ELEVATOR_LOG_FORMAT=json     one JSON object per line instead of text
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional, Tuple
+
+from metrics import REGISTRY
+
+LOG_RECORDS_SUPPRESSED = REGISTRY.counter(
+    'elevator_log_records_suppressed_total', 'Log records dropped by per-site rate limiting or sampling')
+
+_listener: Optional[QueueListener] = None
+
+
+class _Site:
+    """Rate limit and sampling state of one log site"""
+
+    __slots__ = ('tokens', 'updated', 'count', 'suppressed')
+
+    def __init__(self, rate: Optional[float]):
+        self.tokens = max(1.0, rate or 0.0)  # start with a full burst
+        self.updated = time.monotonic()
+        self.count = 0
+        self.suppressed = 0
+
+
+class StructuredLogger:
+    """
+    logging.Logger wrapper whose records carry a site name and key/value fields
+
+        log = StructuredLogger(__name__)
+        log.debug('position.received', "Position update received", rate=1.0, position=12.3)
+    """
+
+    def __init__(self, name: str):
+        self.logger = logging.getLogger(name)
+        self.sites = {}
+
+    def isEnabledFor(self, level: int) -> bool:
+        """Check before building the fields of a hot-path record"""
+        return self.logger.isEnabledFor(level)
+
+    def _admit(self, site: str, rate: Optional[float], sample: Optional[int]) -> Optional[int]:
+        """Records suppressed since the site's last one, or None to suppress this one
+
+        Sites are shared by threads without a lock: a race can only let an extra
+        record through or miscount a suppressed one.
+        """
+        state = self.sites.get(site)
+        if state is None:
+            state = self.sites.setdefault(site, _Site(rate))
+        if sample:
+            state.count += 1
+            if state.count % sample:
+                state.suppressed += 1
+                LOG_RECORDS_SUPPRESSED.inc()
+                return None
+        if rate:
+            now = time.monotonic()
+            state.tokens = min(max(1.0, rate), state.tokens + (now - state.updated) * rate)
+            state.updated = now
+            if state.tokens < 1.0:
+                state.suppressed += 1
+                LOG_RECORDS_SUPPRESSED.inc()
+                return None
+            state.tokens -= 1.0
+        suppressed = state.suppressed
+        state.suppressed = 0
+        return suppressed
+
+    def log(self, level: int, site: str, message: str, rate: Optional[float] = None,
+            sample: Optional[int] = None, **fields) -> bool:
+        """Emit one record unless the level is disabled or the site is over its limit"""
+        if not self.logger.isEnabledFor(level):
+            return False
+        suppressed = self._admit(site, rate, sample) if rate or sample else 0
+        if suppressed is None:
+            return False
+        if suppressed:
+            fields['suppressed'] = suppressed
+        self.logger.log(level, message, extra={'site': site, 'fields': fields})
+        return True
+
+    def debug(self, site: str, message: str, **kwargs) -> bool:
+        return self.log(logging.DEBUG, site, message, **kwargs)
+
+    def info(self, site: str, message: str, **kwargs) -> bool:
+        return self.log(logging.INFO, site, message, **kwargs)
+
+    def warning(self, site: str, message: str, **kwargs) -> bool:
+        return self.log(logging.WARNING, site, message, **kwargs)
+
+    def error(self, site: str, message: str, **kwargs) -> bool:
+        return self.log(logging.ERROR, site, message, **kwargs)
+
+
+def _format_field(value) -> str:
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    return str(value)
+
+
+class TextFormatter(logging.Formatter):
+    """'time LEVEL logger [site] message key=value ...'"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s %(message)s')
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        site = getattr(record, 'site', None)
+        if site is not None:
+            fields = ''.join(f" {key}={_format_field(value)}" for key, value in record.fields.items())
+            record.message = f"[{site}] {record.message}{fields}"
+        return super().formatMessage(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        site = getattr(record, 'site', None)
+        if site is not None:
+            entry['site'] = site
+            entry.update(record.fields)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread
+
+    The stock prepare() formats the message on the logging thread; records
+    without exception info are immutable enough to hand over as they are.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            return super().prepare(record)
+        return record
+
+
+def queue_handler(stream=None, fmt: str = 'text') -> Tuple[QueueHandler, QueueListener]:
+    """A queue handler and the (not yet started) listener writing its records to stream"""
+    records = queue.SimpleQueue()
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+    return _DeferredQueueHandler(records), QueueListener(records, output, respect_handler_level=True)
+
+
+def configure_logging(level: Optional[str] = None, fmt: Optional[str] = None,
+                      stream=None) -> Optional[QueueListener]:
+    """
+    Route the root logger through a queue to a background writer thread (idempotent)
+    Like logging.basicConfig, does nothing when the root logger already has
+    handlers (set up by the embedding application, a log config or pytest);
+    returns None then.
+    """
+    global _listener
+    root = logging.getLogger()
+    if _listener is not None or root.handlers:
+        return _listener
+    name = (level or os.environ.get('ELEVATOR_LOG_LEVEL', 'INFO')).upper()
+    # Validate before touching the root logger: getLevelName maps known names to their number
+    level = logging.getLevelName(name)
+    unknown = not isinstance(level, int)
+    if unknown:
+        level = logging.INFO
+    handler, _listener = queue_handler(stream, fmt or os.environ.get('ELEVATOR_LOG_FORMAT', 'text'))
+    root.addHandler(handler)
+    root.setLevel(level)
+    # ELEVATOR_LOG_LEVEL=DEBUG is meant for this service, not for library chatter
+    for library in ('asyncio', 'matplotlib', 'PIL', 'httpx', 'httpcore'):
+        logging.getLogger(library).setLevel(max(level, logging.INFO))
+    _listener.start()
+    # Flush what is still queued when the process exits
+    atexit.register(_listener.stop)
+    if unknown:
+        logging.getLogger(__name__).warning("Unknown log level %r, using INFO", name)
+    return _listener
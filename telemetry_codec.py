@@ -0,0 +1,181 @@
+"""
+Compact binary encoding of car telemetry frames
+Opt-in alternative to JSON for MQTT position/status payloads
+(ELEVATOR_MQTT_ENCODING=binary). A binary frame is
+
+    flag (0xB1) | schema version | frame kind | presence mask (u16) | fields
+
+where the fields present in the frame follow in FIELDS order, struct packed
+little endian: floats as float32 (a few micrometres at 30 m), floors as
+small integer ids, direction as -1/0/1. The first byte doubles as the content
+type: JSON text always starts with '{', so decode_payload() reads both and
+consumers keep working whichever encoding a car publishes.
+
+Frames with a key or value the schema does not cover are not encodable;
+encode_frame() returns None and the publisher sends them as JSON.
+"""
+
+import functools
+import json
+import math
+import struct
+from typing import Optional, Union
+
+CONTENT_BINARY = 0xB1
+SCHEMA_VERSION = 1
+FRAME_POSITION = 1
+FRAME_STATUS = 2
+FRAME_KINDS = {'position': FRAME_POSITION, 'status': FRAME_STATUS}
+
+_HEADER = struct.Struct('<BBBH')
+_NO_FLOOR = 255
+_DIRECTIONS = {'up': 1, 'down': -1, 'stopped': 0}
+_DIRECTION_NAMES = {value: name for name, value in _DIRECTIONS.items()}
+_PHASES = {'fuzzy': 1, 'startup': 2}
+_PHASE_NAMES = {value: name for name, value in _PHASES.items()}
+
+
+@functools.lru_cache(maxsize=256)
+def _floor_id(name) -> int:
+    if name is None:
+        return _NO_FLOOR
+    if name == 'terreo':
+        return 0
+    number = int(name[6:]) if name.startswith('andar_') and name[6:].isdigit() else _NO_FLOOR
+    if not 0 < number < _NO_FLOOR:
+        raise ValueError(f"Floor not encodable: {name}")
+    return number
+
+
+def _floor_name(floor_id: int):
+    if floor_id == _NO_FLOOR:
+        return None
+    return 'terreo' if floor_id == 0 else f'andar_{floor_id}'
+
+
+@functools.lru_cache(maxsize=256)
+def _car_number(car_id: str) -> int:
+    if not car_id.startswith('car_') or not car_id[4:].isdigit():
+        raise ValueError(f"Car id not encodable: {car_id}")
+    return int(car_id[4:])
+
+
+def _float(value) -> float:
+    return math.nan if value is None else float(value)
+
+
+def _optional_float(value: float):
+    return None if math.isnan(value) else value
+
+
+# (key, struct code, encode, decode); the order is the wire order and fixes the mask bits.
+# decode None: the unpacked value is used as is. Only target_position is ever None
+# among the floats (NaN on the wire); a None elsewhere makes the frame not encodable.
+FIELDS = [
+    ('timestamp', 'd', float, None),
+    ('car_id', 'H', _car_number, lambda number: f'car_{number}'),
+    ('current_position', 'f', float, None),
+    ('target_position', 'f', _float, _optional_float),
+    ('current_floor', 'B', _floor_id, _floor_name),
+    ('target_floor', 'B', _floor_id, _floor_name),
+    ('motor_power', 'f', float, None),
+    ('error', 'f', float, None),
+    ('delta_error', 'f', float, None),
+    ('direction', 'b', _DIRECTIONS.__getitem__, _DIRECTION_NAMES.__getitem__),
+    ('is_moving', '?', bool, None),
+    ('control_phase', 'B', _PHASES.__getitem__, _PHASE_NAMES.__getitem__),
+    ('movement_completed', '?', bool, None),
+    ('emergency_stopped', '?', bool, None),
+    ('stop_latency_ms', 'f', float, None),
+]
+_FIELD_BITS = {key: bit for bit, (key, _, _, _) in enumerate(FIELDS)}
+
+
+class _Layout:
+    """Wire layout of one presence mask; a car only ever produces a handful of them"""
+
+    def __init__(self, mask: int):
+        fields = [field for bit, field in enumerate(FIELDS) if mask & (1 << bit)]
+        self.struct = struct.Struct('<' + ''.join(code for _, code, _, _ in fields))
+        self.keys = tuple(key for key, _, _, _ in fields)
+        self.encoders = [(key, encode) for key, _, encode, _ in fields]
+        self.decoders = [(key, decode) for key, _, _, decode in fields if decode is not None]
+
+
+_layouts = {}  # mask -> _Layout
+_plans = {}  # (kind, frame keys in order) -> (header bytes, _Layout), so encoding skips the mask
+
+
+def _layout(mask: int) -> _Layout:
+    layout = _layouts.get(mask)
+    if layout is None:
+        layout = _layouts[mask] = _Layout(mask)
+    return layout
+
+
+def _plan(kind: str, keys: tuple):
+    mask = 0
+    for key in keys:
+        bit = _FIELD_BITS.get(key)
+        if bit is None:
+            return None
+        mask |= 1 << bit
+    plan = (_HEADER.pack(CONTENT_BINARY, SCHEMA_VERSION, FRAME_KINDS[kind], mask), _layout(mask))
+    if len(_plans) < 1024:
+        _plans[(kind, keys)] = plan
+    return plan
+
+
+def encode_frame(data: dict, kind: str = 'position') -> Optional[bytes]:
+    """Binary form of a telemetry frame, or None if the schema does not cover it"""
+    keys = tuple(data)
+    plan = _plans.get((kind, keys)) or _plan(kind, keys)
+    if plan is None:
+        return None
+    header, layout = plan
+    try:
+        return header + layout.struct.pack(*[encode(data[key]) for key, encode in layout.encoders])
+    except (ValueError, KeyError, TypeError, AttributeError, struct.error):
+        return None
+
+
+def decode_frame(payload: bytes) -> dict:
+    """Frame dict of a binary payload (same keys as the encoded frame)"""
+    try:
+        flag, version, kind, mask = _HEADER.unpack_from(payload)
+    except struct.error:
+        raise ValueError("Truncated telemetry frame")
+    if flag != CONTENT_BINARY:
+        raise ValueError("Not a binary telemetry frame")
+    if version != SCHEMA_VERSION:
+        raise ValueError(f"Unsupported telemetry schema version {version}")
+    layout = _layout(mask)
+    try:
+        frame = dict(zip(layout.keys, layout.struct.unpack_from(payload, _HEADER.size)))
+    except struct.error:
+        raise ValueError("Truncated telemetry frame")
+    for key, decode in layout.decoders:
+        frame[key] = decode(frame[key])
+    return frame
+
+
+def is_binary(payload: Union[bytes, str]) -> bool:
+    return isinstance(payload, (bytes, bytearray)) and len(payload) > 0 and payload[0] == CONTENT_BINARY
+
+
+def decode_payload(payload: Union[bytes, str]):
+    """Decode an MQTT payload in either encoding"""
+    if is_binary(payload):
+        return decode_frame(payload)
+    if isinstance(payload, (bytes, bytearray)):
+        payload = payload.decode()
+    return json.loads(payload)
+
+
+def encode_payload(data: dict, kind: str = 'position', encoding: str = 'json') -> Union[bytes, str]:
+    """Payload for a frame in the requested encoding, JSON when binary does not cover it"""
+    if encoding == 'binary':
+        encoded = encode_frame(data, kind)
+        if encoded is not None:
+            return encoded
+    return json.dumps(data)
@@ -0,0 +1,178 @@
+"""
+Sequence-numbered telemetry stream for WebSocket clients
+Every broadcast frame gets a monotonically increasing sequence number and is
+retained in a bounded buffer, so reconnecting clients can resume from the last
+frame they saw instead of receiving a full replay
+"""
+
+import json
+import math
+import threading
+import uuid
+from collections import deque
+from typing import List, Optional, Tuple
+
+
+class TelemetryStream:
+    """
+    Bounded, sequence-numbered buffer of serialized broadcast frames
+    """
+
+    def __init__(self, retain: int = 1000):
+        # Identifies this stream instance; a server restart resets the sequence,
+        # so clients holding a different stream_id must take a snapshot
+        self.stream_id = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self.frames: deque = deque(maxlen=retain)  # (seq, topic, car_id, serialized frame)
+        self._lock = threading.Lock()
+
+    def publish(self, message: dict) -> Tuple[int, str]:
+        """Assign the next sequence number to a message and retain its serialized form"""
+        topic = MESSAGE_TOPICS.get(message.get('type'))
+        data = message.get('data')
+        car_id = data.get('car_id') if isinstance(data, dict) else None
+        with self._lock:
+            self.seq += 1
+            message['seq'] = self.seq
+            text = json.dumps(message)
+            self.frames.append((self.seq, topic, car_id, text))
+            return self.seq, text
+
+    def frames_since(self, seq: int, stream_id: Optional[str] = None) -> Optional[List[Tuple[int, Optional[str], Optional[str], str]]]:
+        """Return the frames published after seq, or None if a snapshot is required
+
+        A snapshot is required when the client belongs to another stream instance,
+        claims a sequence number ahead of the server, or the gap is older than
+        the retained buffer.
+        """
+        with self._lock:
+            if stream_id is not None and stream_id != self.stream_id:
+                return None
+            if seq > self.seq:
+                return None
+            if seq == self.seq:
+                return []
+            oldest = self.frames[0][0] if self.frames else self.seq + 1
+            if seq + 1 < oldest:
+                return None
+            return [frame for frame in self.frames if frame[0] > seq]
+
+
+# Broadcast message types and the subscription topic each one belongs to
+MESSAGE_TOPICS = {
+    'status_update': 'status',
+    'position_update': 'position',
+    'fuzzy_update': 'fuzzy',
+}
+TOPICS = ('status', 'position', 'fuzzy')
+
+
+class Subscription:
+    """
+    Per-client topic selection with a maximum update rate per topic
+    Frames arriving faster than the allowed rate are coalesced: only the most
+    recent one is kept and delivered once the topic's interval has elapsed
+    """
+
+    def __init__(self, intervals: Optional[dict] = None, cars: Optional[list] = None):
+        # topic -> minimum seconds between frames (0 = every frame)
+        self.intervals = {'status': 0.0, 'position': 0.0} if intervals is None else intervals
+        self.cars = set(cars) if cars else None
+        self.last_sent = {}
+        self.pending = {}
+
+    @classmethod
+    def from_request(cls, topics, cars=None) -> 'Subscription':
+        """Build a subscription from a client request
+
+        ``topics`` may be a list of topic names (full rate), a dict mapping
+        topic to ``{"max_rate": hz}``, or a string like ``"status:1,position"``.
+        """
+        if isinstance(topics, str):
+            parsed = {}
+            for item in topics.split(','):
+                name, _, rate = item.strip().partition(':')
+                parsed[name] = {'max_rate': rate} if rate else {}
+            topics = parsed
+        elif isinstance(topics, (list, tuple)):
+            topics = {name: {} for name in topics}
+        
+        intervals = {}
+        for name, options in (topics or {}).items():
+            if name not in TOPICS:
+                raise ValueError(f"Unknown topic: {name}")
+            max_rate = (options or {}).get('max_rate')
+            if max_rate is not None:
+                try:
+                    max_rate = float(max_rate)
+                except (TypeError, ValueError):
+                    raise ValueError(f"Invalid max_rate for {name}: {max_rate!r}")
+                if not math.isfinite(max_rate) or max_rate < 0:
+                    raise ValueError(f"Invalid max_rate for {name}: {max_rate}")
+            intervals[name] = 1.0 / max_rate if max_rate else 0.0
+        return cls(intervals, cars)
+
+    def describe(self) -> dict:
+        """Effective subscription, as reported back to the client"""
+        return {
+            'topics': {name: {'max_rate': (1.0 / interval) if interval else None}
+                       for name, interval in self.intervals.items()},
+            'cars': sorted(self.cars) if self.cars else None
+        }
+
+    def wants(self, topic: str, car_id: Optional[str] = None) -> bool:
+        if topic not in self.intervals:
+            return False
+        return self.cars is None or car_id is None or car_id in self.cars
+
+    def offer(self, topic: str, car_id: Optional[str], text: str, now: float) -> Optional[str]:
+        """Return the frame if it may be sent now, otherwise keep it as pending"""
+        if not self.wants(topic, car_id):
+            return None
+        key = (topic, car_id)
+        interval = self.intervals[topic]
+        if interval and now - self.last_sent.get(key, float('-inf')) < interval:
+            self.pending[key] = text
+            return None
+        self.last_sent[key] = now
+        self.pending.pop(key, None)
+        return text
+
+    def due_pending(self, now: float) -> List[str]:
+        """Pop coalesced frames whose topic interval has elapsed
+
+        A coalesced frame goes out after newer frames of other topics, so its
+        seq is below what the client has seen; it is marked "coalesced" and
+        clients must neither drop it as a duplicate nor move their resume
+        position back to it.
+        """
+        due = []
+        for key, text in list(self.pending.items()):
+            if now - self.last_sent.get(key, float('-inf')) >= self.intervals[key[0]]:
+                self.last_sent[key] = now
+                del self.pending[key]
+                # text is a serialized JSON object: add the flag without parsing it again
+                due.append(text[:-1] + ', "coalesced": true}')
+        return due
+
+    def next_flush_delay(self, now: float) -> Optional[float]:
+        """Seconds until the earliest pending frame becomes due, or None"""
+        delays = [self.last_sent[key] + self.intervals[key[0]] - now for key in self.pending]
+        return max(0.0, min(delays)) if delays else None
+
+    def filter_replay(self, frames: List[Tuple[int, str, Optional[str], str]]) -> List[Tuple[int, str]]:
+        """Select the replayed frames this subscription wants
+
+        Rate-limited topics only replay their most recent frame.
+        """
+        latest = {}
+        for seq, topic, car_id, _ in frames:
+            if topic is not None and self.intervals.get(topic):
+                latest[(topic, car_id)] = seq
+        selected = []
+        for seq, topic, car_id, text in frames:
+            if topic is None:
+                selected.append((seq, text))
+            elif self.wants(topic, car_id) and (not self.intervals[topic] or latest[(topic, car_id)] == seq):
+                selected.append((seq, text))
+        return selected
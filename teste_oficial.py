@@ -16,7 +16,9 @@ Autor: Sistema de Controle Fuzzy VILLARTA COMPAQ Slim
 import time
 import asyncio
 from simple_elevator_controller import SimpleElevatorController
-import json
+from structured_log import configure_logging
+from result_stream import ResultStreamWriter
+import os
 
 class TesteOficial:
     def __init__(self):
@@ -38,8 +40,12 @@ class TesteOficial:
         self.controller.set_position_callback(self._callback_posicao)
         self.controller.set_status_callback(self._callback_status)
         
-        # Dados para coleta de métricas
-        self.dados_movimento = []
+        # Resultados gravados à medida que chegam (result_stream.py), aberto em executar_todos_testes
+        self.stream = None
+        self.nome_arquivo = None
+        
+        # Dados para coleta de métricas; as amostras vão direto para o arquivo
+        self.amostras = 0
         self.tempo_inicio = None
         self.potencia_maxima = 0
         self.erro_final = 0
@@ -48,13 +54,14 @@ class TesteOficial:
         """Callback para atualizações de posição durante o movimento"""
         if self.tempo_inicio:
             tempo_decorrido = data['timestamp'] - self.tempo_inicio
-            self.dados_movimento.append({
+            self.stream.sample(self.teste_atual + 1, {
                 'tempo': tempo_decorrido,
                 'posicao': data['current_position'],
                 'potencia': abs(data['motor_power']),  # Sempre positiva conforme projeto
                 'erro': abs(data['error']),
                 'direcao': data['direction']
             })
+            self.amostras += 1
             
             # Atualizar potência máxima
             potencia_abs = abs(data['motor_power'])
@@ -62,7 +69,7 @@ class TesteOficial:
                 self.potencia_maxima = potencia_abs
                 
             # Imprimir progresso a cada 2 segundos
-            if len(self.dados_movimento) % 10 == 0:
+            if self.amostras % 10 == 0:
                 print(f"  Tempo: {tempo_decorrido:.1f}s | Posição: {data['current_position']:.2f}m | "
                       f"Potência: {potencia_abs:.1f}% | Erro: {abs(data['error'])*1000:.1f}mm")
     
@@ -95,7 +102,7 @@ class TesteOficial:
         self._posicionar_elevador(cenario['origem'])
         
         # Resetar dados de coleta
-        self.dados_movimento = []
+        self.amostras = 0
         self.potencia_maxima = 0
         self.erro_final = 0
         self.tempo_inicio = time.time()
@@ -112,25 +119,24 @@ class TesteOficial:
         print(f"⏱️  Iniciando movimento...")
         
         # Executar movimento
-        sucesso = self.controller.move_to_floor(cenario['destino'])
+        viagem = self.controller.move_to_floor(cenario['destino'])
         
-        if not sucesso:
+        if not viagem:
             print("❌ Falha ao iniciar movimento!")
             return False
         
         # Aguardar conclusão do movimento
         timeout = 60  # 60 segundos de timeout
-        tempo_inicial = time.time()
-        
-        while self.controller.is_moving:
-            time.sleep(0.1)
-            if time.time() - tempo_inicial > timeout:
-                print("⏰ Timeout! Parando movimento...")
-                self.controller.emergency_stop()
-                break
+        try:
+            viagem.result(timeout=timeout)
+        except TimeoutError:
+            print("⏰ Timeout! Parando movimento...")
+            viagem.cancel()
+            viagem.result(timeout=5)
         
         # Coletar resultados
-        tempo_total = time.time() - self.tempo_inicio
+        fim = time.time()
+        tempo_total = fim - self.tempo_inicio
         
         resultado = {
             'teste': self.teste_atual + 1,
@@ -142,11 +148,14 @@ class TesteOficial:
             'tempo_total_s': tempo_total,
             'erro_final_mm': self.erro_final * 1000,
             'potencia_maxima_pct': self.potencia_maxima,
-            'dados_movimento': self.dados_movimento.copy(),
+            'amostras': self.amostras,  # dados_movimento: linhas 'amostra' do arquivo
+            'inicio_ts': self.tempo_inicio,
+            'fim_ts': fim,
             'sucesso': bool(self.erro_final < 0.05)  # Erro menor que 5cm = sucesso
         }
         
         self.resultados.append(resultado)
+        self.stream.result(resultado)
         
         # Resumo do teste
         print(f"\n📊 RESUMO DO TESTE:")
@@ -167,7 +176,16 @@ class TesteOficial:
         # Conectar controlador
         self.controller.connect()
         
+        # Arquivo de resultados gravado durante o teste
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        self.nome_arquivo = f"analysis/test_results/resultados_teste_oficial_{timestamp}.jsonl"
+        self.stream = ResultStreamWriter(self.nome_arquivo)
+        self.stream.start(timestamp=time.time(), data_teste=time.strftime("%Y-%m-%d %H:%M:%S"),
+                          total_testes=len(self.cenarios), cenarios=[c['nome'] for c in self.cenarios])
+        print(f"💾 Gravando resultados em: {self.nome_arquivo}")
+        
         sucessos = 0
+        interrompido = True
         
         try:
             for cenario in self.cenarios:
@@ -181,11 +199,14 @@ class TesteOficial:
                     time.sleep(3)
             
             # Relatório final
+            interrompido = False
             self._gerar_relatorio_final(sucessos)
             
         except KeyboardInterrupt:
             print("\n🛑 Testes interrompidos pelo usuário")
+            print(f"💾 Resultados parciais em: {self.nome_arquivo}")
         finally:
+            self.stream.close(interrupted=interrompido)
             self.controller.disconnect()
     
     def _gerar_relatorio_final(self, sucessos):
@@ -234,36 +255,38 @@ class TesteOficial:
             print("⚠️  SISTEMA NECESSITA AJUSTES. Taxa de sucesso < 80%")
     
     def _salvar_resultados(self):
-        """Salva os resultados em arquivo JSON"""
-        timestamp = time.strftime("%Y%m%d_%H%M%S")
-        nome_arquivo = f"resultados_teste_oficial_{timestamp}.json"
-        
-        dados_completos = {
-            'timestamp': time.time(),
-            'data_teste': time.strftime("%Y-%m-%d %H:%M:%S"),
-            'total_testes': len(self.cenarios),
-            'sucessos': sum(1 for r in self.resultados if r['sucesso']),
-            'taxa_sucesso_pct': (sum(1 for r in self.resultados if r['sucesso']) / len(self.cenarios)) * 100,
-            'resultados': self.resultados        }
-        
-        # Create test results directory if it doesn't exist
-        import os
-        os.makedirs("analysis/test_results", exist_ok=True)
+        """Fecha o arquivo de resultados e gera as cópias para análise"""
+        sucessos = sum(1 for r in self.resultados if r['sucesso'])
+        self.stream.finish(timestamp=time.time(), sucessos=sucessos,
+                           taxa_sucesso_pct=(sucessos / len(self.cenarios)) * 100, interrompido=False)
+        self.stream.close()
+        print(f"💾 Resultados salvos em: {self.nome_arquivo} ({self.stream.samples_written} amostras)")
         
-        # Update filename to save in organized folder
-        nome_arquivo = f"analysis/test_results/resultados_teste_oficial_{timestamp}.json"
+        # Cópia colunar para análise (trajectory_file.py): ~10x menor, carrega sem parse de JSON.
+        # Lê o teste inteiro para a memória; testes de longa duração são convertidos à parte.
+        from trajectory_file import convert
+        if os.path.getsize(self.nome_arquivo) <= 64 * 1024 * 1024:
+            try:
+                convert(self.nome_arquivo)
+            except Exception as e:
+                print(f"⚠️  Arquivo de trajetórias não gerado: {e}")
+        else:
+            print(f"ℹ️  Para gerar as trajetórias: python trajectory_file.py convert {self.nome_arquivo}")
         
-        try:
-            with open(nome_arquivo, 'w', encoding='utf-8') as f:
-                json.dump(dados_completos, f, indent=2, ensure_ascii=False)
-            print(f"💾 Resultados salvos em: {nome_arquivo}")
-        except Exception as e:
-            print(f"❌ Erro ao salvar resultados: {e}")
+        # Histórico de viagens (trip_store.py), com ponteiro para a trajetória no arquivo
+        from trip_store import TripStore
+        store = TripStore.from_env()
+        if store is not None:
+            try:
+                print(f"🗃️  {store.ingest_results(self.nome_arquivo)} viagens registradas em {store.path}")
+            finally:
+                store.close()
 
 def main():
     """Função principal"""
     print("Sistema de Teste Oficial - Elevador Fuzzy Controller")
     print("Pressione Ctrl+C a qualquer momento para interromper")
+    configure_logging()
     
     teste = TesteOficial()
     teste.executar_todos_testes()
@@ -0,0 +1,161 @@
+"""
+Opt-in span tracer with Chrome trace-event export
+Spans are written into a buffer preallocated at import time, so tracing a
+control tick allocates nothing; when the buffer is full the oldest spans are
+overwritten. The export loads in chrome://tracing or https://ui.perfetto.dev
+
+    ELEVATOR_TRACE=1                   enable tracing
+    ELEVATOR_TRACE_FILE=trace.json     export path (default elevator_trace_<pid>.json)
+    ELEVATOR_TRACE_SPANS=100000        buffer capacity
+
+With tracing on, the trace is written when the process exits and can be
+downloaded from a running server at /api/trace. Engine worker processes
+inherit the environment and write their own file: processes started through
+multiprocessing (the process engine, uvicorn workers) add their pid to the
+name, e.g. trace_4242.json next to the server's trace.json.
+"""
+
+import atexit
+import itertools
+import json
+import multiprocessing
+import os
+import threading
+import time
+from array import array
+from typing import Optional
+
+_SPAN = 0  # complete event ('X'): nests with the other spans of its thread
+_ASYNC = 1  # async pair ('b'/'e'): may overlap, e.g. a frame waiting in a queue
+
+
+class Tracer:
+    """
+    Fixed-capacity span recorder
+
+    Phases of a loop are traced by chaining marks:
+
+        mark = TRACER.mark()                     # 0 when tracing is off
+        ...
+        mark = TRACER.span('fuzzy_compute', mark)  # records [mark, now], returns now
+    """
+
+    def __init__(self, capacity: int = 100000, enabled: bool = False):
+        self.enabled = enabled
+        self.capacity = capacity
+        # Parallel columns; a slot is claimed with next(counter), which is atomic under the GIL
+        self._names = [None] * capacity
+        self._categories = [None] * capacity
+        self._args = [None] * capacity
+        self._kinds = bytearray(capacity)
+        self._starts = array('q', bytes(8 * capacity))
+        self._durations = array('q', bytes(8 * capacity))
+        self._threads = array('Q', bytes(8 * capacity))
+        self._counter = itertools.count()
+        self._thread_names = {}
+        self.recorded = 0  # spans recorded so far, including the ones already overwritten
+
+    def mark(self) -> int:
+        """Timestamp to start a span at (perf_counter_ns), or 0 when tracing is off"""
+        return time.perf_counter_ns() if self.enabled else 0
+
+    def span(self, name: str, start: int, category: str = 'control', args: Optional[dict] = None) -> int:
+        """Record a span from start to now; returns now so the next phase can start there"""
+        if not start:
+            return 0
+        end = time.perf_counter_ns()
+        self._record(_SPAN, name, category, start, end - start, args)
+        return end
+
+    def async_span(self, name: str, start: int, category: str = 'control', args: Optional[dict] = None) -> int:
+        """Like span, for intervals that overlap others on the same thread"""
+        if not start:
+            return 0
+        end = time.perf_counter_ns()
+        self._record(_ASYNC, name, category, start, end - start, args)
+        return end
+
+    def _record(self, kind: int, name: str, category: str, start: int, duration: int, args):
+        thread = threading.get_ident()
+        if thread not in self._thread_names:
+            self._thread_names[thread] = threading.current_thread().name
+        number = next(self._counter)
+        index = number % self.capacity
+        self._kinds[index] = kind
+        self._names[index] = name
+        self._categories[index] = category
+        self._args[index] = args
+        self._starts[index] = start
+        self._durations[index] = duration
+        self._threads[index] = thread
+        self.recorded = number + 1
+
+    def reset(self):
+        self._counter = itertools.count()
+        self.recorded = 0
+
+    def to_chrome_trace(self) -> dict:
+        """Spans still in the buffer as a Chrome trace-event document"""
+        pid = os.getpid()
+        recorded = self.recorded
+        first = max(0, recorded - self.capacity)
+        events = []
+        for number in range(first, recorded):
+            index = number % self.capacity
+            name = self._names[index]
+            if name is None:
+                continue
+            start_us = self._starts[index] / 1000
+            duration_us = self._durations[index] / 1000
+            event = {'name': name, 'cat': self._categories[index], 'pid': pid,
+                     'tid': self._threads[index], 'ts': start_us}
+            if self._args[index]:
+                event['args'] = self._args[index]
+            if self._kinds[index] == _ASYNC:
+                events.append(dict(event, ph='b', id=number))
+                events.append({'name': name, 'cat': event['cat'], 'pid': pid, 'tid': event['tid'],
+                               'ts': start_us + duration_us, 'ph': 'e', 'id': number})
+            else:
+                events.append(dict(event, ph='X', dur=duration_us))
+        events.sort(key=lambda e: e['ts'])
+
+        metadata = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': f'elevator ({pid})'}}]
+        for thread, thread_name in list(self._thread_names.items()):
+            metadata.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread,
+                             'args': {'name': thread_name}})
+        return {'traceEvents': metadata + events, 'displayTimeUnit': 'ms',
+                'otherData': {'spans_recorded': recorded, 'spans_overwritten': first}}
+
+    def export(self, path: str) -> str:
+        with open(path, 'w') as f:
+            json.dump(self.to_chrome_trace(), f)
+        return path
+
+
+TRACE_ENABLED = os.environ.get('ELEVATOR_TRACE') == '1'
+
+
+def _trace_file() -> str:
+    path = os.environ.get('ELEVATOR_TRACE_FILE')
+    if not path:
+        return f'elevator_trace_{os.getpid()}.json'
+    if multiprocessing.current_process().name == 'MainProcess':
+        return path
+    # Child processes inherit ELEVATOR_TRACE_FILE; one file per process
+    stem, extension = os.path.splitext(path)
+    return f'{stem}_{os.getpid()}{extension}'
+
+
+TRACE_FILE = _trace_file()
+# The buffer is only allocated when tracing is on
+TRACER = Tracer(int(os.environ.get('ELEVATOR_TRACE_SPANS', '100000')) if TRACE_ENABLED else 1,
+                enabled=TRACE_ENABLED)
+
+
+def _export_at_exit():
+    if TRACER.recorded:
+        print(f"Trace with {min(TRACER.recorded, TRACER.capacity)} spans written to {TRACER.export(TRACE_FILE)}")
+
+
+if TRACE_ENABLED:
+    atexit.register(_export_at_exit)
@@ -0,0 +1,299 @@
+"""
+Columnar trajectory files for teste_oficial results
+A resultados_teste_oficial_*.json run stores each scenario's dados_movimento as
+indented JSON dicts, keys repeated in every sample. A .traj file keeps the same
+run as one column per sample key and scenario:
+
+    magic 'ETRJ' | version (u8) | header length (u32) | zlib'd JSON header | columns
+
+The header holds the run's metadata (the results file without the samples)
+and, for every scenario, each column's dtype, codec and byte range. Numeric
+columns are float64 (or float32 with --float32, a few micrometres on the
+position), lossless apart from that. Their codecs work on the values' bit
+patterns, then shuffle byte planes and zlib them:
+
+    delta   second-order integer differences (default; smooth series such as
+            position and time turn into small numbers)
+    xor     each value XORed with the previous one
+    raw     uncompressed, read straight from the memory map without a copy
+
+String columns (direcao) are uint8 codes of a category list.
+
+    python trajectory_file.py convert analysis/test_results/*.json
+    python trajectory_file.py info analysis/test_results/resultados_teste_oficial_20250625_120813.traj
+
+    with TrajectoryFile(path) as run:
+        position = run.column(4, 'posicao')      # numpy array, 5th scenario
+    results = load_results(path)                 # .jsonl, .json or .traj, same dict
+"""
+
+import argparse
+import glob
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from result_stream import read_result_stream
+
+MAGIC = b'ETRJ'
+VERSION = 1
+_PREAMBLE = struct.Struct('<4sBI')
+_ALIGN = 8
+CODECS = ('delta', 'xor', 'raw')
+_UINT = {4: np.uint32, 8: np.uint64}
+
+
+def _encode_floats(values: np.ndarray, codec: str) -> bytes:
+    if codec == 'raw':
+        return values.tobytes()
+    bits = values.view(_UINT[values.itemsize])
+    coded = bits.copy()
+    if codec == 'xor':
+        coded[1:] ^= bits[:-1]
+    else:
+        # Unsigned arithmetic wraps, so the differences are exact whatever the values
+        coded[1:] -= bits[:-1]
+        coded[2:] -= (bits[1:-1] - bits[:-2])
+    # Byte planes: the high (sign/exponent) bytes of consecutive samples end up next to each other
+    planes = coded.view(np.uint8).reshape(len(values), values.itemsize).T
+    return zlib.compress(planes.tobytes(), 9)
+
+
+def _decode_floats(buffer, dtype: np.dtype, count: int, codec: str) -> np.ndarray:
+    if codec == 'raw':
+        return np.frombuffer(buffer, dtype=dtype, count=count)
+    uint = _UINT[dtype.itemsize]
+    planes = np.frombuffer(zlib.decompress(buffer), dtype=np.uint8).reshape(dtype.itemsize, count)
+    coded = planes.T.copy().view(uint).ravel()
+    if codec == 'xor':
+        return np.bitwise_xor.accumulate(coded).view(dtype)
+    coded[1:] = np.cumsum(coded[1:], dtype=uint)
+    return np.cumsum(coded, dtype=uint).view(dtype)
+
+
+def _columns_of(samples: List[dict]) -> Dict[str, list]:
+    columns = {key: [] for key in (samples[0] if samples else {})}
+    for sample in samples:
+        if sample.keys() != columns.keys():
+            raise ValueError("Samples of a trajectory must all have the same keys")
+        for key, value in sample.items():
+            columns[key].append(value)
+    return columns
+
+
+def write_trajectory_file(path: str, results: dict, float_dtype: str = 'float64', codec: str = 'delta') -> int:
+    """Write a teste_oficial results dict as a .traj file; returns the file size"""
+    if codec not in CODECS:
+        raise ValueError(f"Unknown codec: {codec}")
+    run = dict(results)
+    run['resultados'] = [dict(resultado) for resultado in results['resultados']]
+    blocks, trajectories, offset = [], [], 0
+    for resultado in run['resultados']:
+        samples = resultado.pop('dados_movimento', [])
+        described = []
+        for name, values in _columns_of(samples).items():
+            if all(isinstance(value, str) for value in values):
+                categories = sorted(set(values))
+                if len(categories) > 255:
+                    raise ValueError(f"Too many distinct values in column {name}")
+                codes = np.array([categories.index(value) for value in values], dtype=np.uint8)
+                data, column = zlib.compress(codes.tobytes(), 9), {'dtype': 'uint8', 'codec': 'zlib',
+                                                                   'categories': categories}
+            elif all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+                data = _encode_floats(np.array(values, dtype=float_dtype), codec)
+                column = {'dtype': float_dtype, 'codec': codec}
+            else:
+                raise ValueError(f"Column {name} is neither numeric nor text")
+            padding = -len(data) % _ALIGN
+            column.update(name=name, offset=offset, size=len(data))
+            blocks.append(data + b'\0' * padding)
+            described.append(column)
+            offset += len(data) + padding
+        trajectories.append({'samples': len(samples), 'columns': described})
+
+    header = zlib.compress(json.dumps({'run': run, 'trajectories': trajectories}).encode(), 9)
+    header += b' ' * (-(_PREAMBLE.size + len(header)) % _ALIGN)  # columns start 8-byte aligned
+    with open(path, 'wb') as f:
+        f.write(_PREAMBLE.pack(MAGIC, VERSION, len(header)))
+        f.write(header)
+        for block in blocks:
+            f.write(block)
+    return _PREAMBLE.size + len(header) + offset
+
+
+class TrajectoryFile:
+    """
+    Memory-mapped .traj file
+
+    Only the header is parsed on open; columns are decoded when asked for.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_length = _PREAMBLE.unpack_from(self._map)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError(f"Not a trajectory file: {path}")
+        if version != VERSION:
+            self._map.close()
+            raise ValueError(f"Unsupported trajectory file version {version}: {path}")
+        # decompressobj: the alignment padding after the zlib stream is ignored
+        header = zlib.decompressobj().decompress(self._map[_PREAMBLE.size:_PREAMBLE.size + header_length])
+        header = json.loads(header)
+        self.run = header['run']
+        self.trajectories = header['trajectories']
+        self._data_start = _PREAMBLE.size + header_length
+
+    def __len__(self):
+        return len(self.trajectories)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        try:
+            self._map.close()
+        except BufferError:
+            pass  # 'raw' columns still in use point into the map; it is unmapped when they go
+
+    def column_names(self, index: int) -> List[str]:
+        return [column['name'] for column in self.trajectories[index]['columns']]
+
+    def column(self, index: int, name: str) -> np.ndarray:
+        """One column of a scenario's samples; text columns come back as an object array"""
+        trajectory = self.trajectories[index]
+        for column in trajectory['columns']:
+            if column['name'] == name:
+                break
+        else:
+            raise KeyError(name)
+        start = self._data_start + column['offset']
+        buffer = memoryview(self._map)[start:start + column['size']]
+        if 'categories' in column:
+            codes = np.frombuffer(zlib.decompress(buffer), dtype=np.uint8)
+            return np.array(column['categories'], dtype=object)[codes]
+        return _decode_floats(buffer, np.dtype(column['dtype']), trajectory['samples'], column['codec'])
+
+    def trajectory(self, index: int) -> Dict[str, np.ndarray]:
+        return {name: self.column(index, name) for name in self.column_names(index)}
+
+    def samples(self, index: int) -> List[dict]:
+        """A scenario's samples as in dados_movimento"""
+        columns = {name: values.tolist() for name, values in self.trajectory(index).items()}
+        return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+    def to_results(self) -> dict:
+        """The run as the results JSON has it"""
+        results = dict(self.run)
+        results['resultados'] = [dict(resultado, dados_movimento=self.samples(index))
+                                 for index, resultado in enumerate(self.run['resultados'])]
+        return results
+
+
+def load_results(path: str) -> dict:
+    """A teste_oficial run from its .jsonl stream, .json or .traj file"""
+    if path.endswith('.traj'):
+        with TrajectoryFile(path) as run:
+            return run.to_results()
+    if path.endswith('.jsonl'):
+        return read_result_stream(path)
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def open_trajectory(pointer: str) -> Dict[str, np.ndarray]:
+    """Columns of a '<results file>#<index>' pointer (trip_store.py); prefers a converted .traj"""
+    path, _, index = pointer.rpartition('#')
+    traj_path = os.path.splitext(path)[0] + '.traj'
+    if os.path.exists(traj_path):
+        with TrajectoryFile(traj_path) as run:
+            return {name: values.copy() for name, values in run.trajectory(int(index)).items()}
+    samples = load_results(path)['resultados'][int(index)]['dados_movimento']
+    return {name: np.array(values) for name, values in _columns_of(samples).items()}
+
+
+def convert(json_path: str, output: Optional[str] = None, float_dtype: str = 'float64', codec: str = 'delta',
+            verify: bool = True) -> str:
+    """Write the .traj twin of a results file; verify reads it back and compares"""
+    results = load_results(json_path)
+    output = output or os.path.splitext(json_path)[0] + '.traj'
+    write_trajectory_file(output, results, float_dtype, codec)
+    if verify:
+        converted = load_results(output)
+        for original, stored in zip(results['resultados'], converted['resultados']):
+            if not _same_samples(original['dados_movimento'], stored['dados_movimento'], float_dtype):
+                raise ValueError(f"{output} does not read back as {json_path}")
+    return output
+
+
+def _same_samples(original: List[dict], stored: List[dict], float_dtype: str) -> bool:
+    if len(original) != len(stored):
+        return False
+    tolerance = 0.0 if float_dtype == 'float64' else 1e-6
+    for expected, actual in zip(original, stored):
+        for key, value in expected.items():
+            if isinstance(value, str):
+                if actual[key] != value:
+                    return False
+            elif abs(actual[key] - value) > tolerance * max(1.0, abs(value)):
+                return False
+    return True
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Columnar trajectory files for teste_oficial results')
+    commands = parser.add_subparsers(dest='command', required=True)
+    converter = commands.add_parser('convert', help='write a .traj next to each results file')
+    converter.add_argument('files', nargs='*', help='default: analysis/test_results/*.json and *.jsonl')
+    converter.add_argument('--float32', action='store_true', help='store numeric columns as float32 (lossy)')
+    converter.add_argument('--codec', choices=CODECS, default='delta', help='numeric column codec')
+    info = commands.add_parser('info', help='describe a .traj file')
+    info.add_argument('file')
+    args = parser.parse_args(argv)
+
+    if args.command == 'info':
+        with TrajectoryFile(args.file) as run:
+            print(f"{args.file}: {run.run.get('data_teste')}, {len(run)} trajectories")
+            for index, trajectory in enumerate(run.trajectories):
+                columns = ', '.join(f"{column['name']} ({column['dtype']}/{column['codec']}, {column['size']} B)"
+                                    for column in trajectory['columns'])
+                print(f"  #{index} {run.run['resultados'][index].get('cenario', '')}: "
+                      f"{trajectory['samples']} samples: {columns}")
+        return 0
+
+    files = args.files or sorted(glob.glob(os.path.join('analysis', 'test_results', '*.json*')))
+    failures = 0
+    for path in files:
+        try:
+            output = convert(path, float_dtype='float32' if args.float32 else 'float64',
+                             codec=args.codec)
+        except (ValueError, KeyError) as e:
+            print(f"{path}: skipped ({e})")
+            failures += 1
+            continue
+        json_size, traj_size = os.path.getsize(path), os.path.getsize(output)
+        start = time.perf_counter()
+        load_results(output)
+        traj_load = time.perf_counter() - start
+        start = time.perf_counter()
+        load_results(path)
+        json_load = time.perf_counter() - start
+        print(f"{path} -> {output}: {json_size} -> {traj_size} bytes ({json_size / traj_size:.1f}x), "
+              f"load {json_load * 1000:.2f} -> {traj_load * 1000:.2f} ms")
+    return 1 if failures and failures == len(files) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+"""
+Handle for a single elevator trip
+Returned by move_to_floor so callers can block on, await or cancel a trip and
+read its KPIs instead of polling is_moving
+"""
+
+import asyncio
+import threading
+import time
+from typing import Callable, List, Optional
+
+# Called with every accepted trip once it finishes, whichever car ran it (see add_trip_listener)
+_trip_listeners: List[Callable[['TripHandle'], None]] = []
+
+
+def add_trip_listener(listener: Callable[['TripHandle'], None]):
+    """Call listener(handle) for every accepted trip of this process when it finishes"""
+    _trip_listeners.append(listener)
+
+
+def remove_trip_listener(listener: Callable[['TripHandle'], None]):
+    if listener in _trip_listeners:
+        _trip_listeners.remove(listener)
+
+
+class TripHandle:
+    """
+    Completion handle and KPI accumulator for one move_to_floor request
+
+    A handle is truthy when the request was accepted, so existing
+    ``if controller.move_to_floor(...)`` checks keep working.
+    """
+
+    def __init__(self, car_id: str, origin_floor: Optional[str], target_floor: Optional[str],
+                 start_position: float = 0.0, target_position: float = 0.0,
+                 accepted: bool = True, reason: Optional[str] = None):
+        self.car_id = car_id
+        self.origin_floor = origin_floor
+        self.target_floor = target_floor
+        self.start_position = start_position
+        self.target_position = target_position
+        self.accepted = accepted
+        self.reason = reason
+        self.start_time = time.perf_counter()
+        self.started_at = time.time()  # wall clock, for trip history
+
+        # Accumulated while the trip runs
+        self.ticks = 0
+        self.peak_power = 0.0
+        self.max_overshoot = 0.0
+
+        self.kpis: Optional[dict] = None
+        self._cancel_requested = False
+        self._cancel_callback: Optional[Callable[[], None]] = None
+        self._done = threading.Event()
+        self._done_callbacks: List[Callable[['TripHandle'], None]] = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def rejected(cls, car_id: str, target_floor: Optional[str], reason: str) -> 'TripHandle':
+        """An already-finished handle for a request that never started"""
+        handle = cls(car_id, None, target_floor, accepted=False, reason=reason)
+        handle.kpis = {'car_id': car_id, 'target_floor': target_floor,
+                       'completed': False, 'cancelled': False, 'reason': reason}
+        handle._done.set()
+        return handle
+
+    def __bool__(self) -> bool:
+        return self.accepted
+
+    def __repr__(self) -> str:
+        state = 'done' if self.done() else 'running'
+        return f"TripHandle({self.car_id}: {self.origin_floor} -> {self.target_floor}, {state})"
+
+    # Recording (called by the car's control loop)
+
+    def record_tick(self, position: float, motor_power: float):
+        self.ticks += 1
+        self.peak_power = max(self.peak_power, abs(motor_power))
+        if self.target_position >= self.start_position:
+            overshoot = position - self.target_position
+        else:
+            overshoot = self.target_position - position
+        self.max_overshoot = max(self.max_overshoot, overshoot)
+
+    def set_cancel_callback(self, callback: Callable[[], None]):
+        self._cancel_callback = callback
+
+    def complete(self, final_position: float, tick_stats: Optional[dict] = None):
+        """Finish the trip, compute its KPIs and wake every waiter"""
+        distance = abs(self.target_position - self.start_position)
+        kpis = {
+            'car_id': self.car_id,
+            'origin_floor': self.origin_floor,
+            'target_floor': self.target_floor,
+            'start_position': self.start_position,
+            'target_position': self.target_position,
+            'final_position': final_position,
+            'trip_time_s': time.perf_counter() - self.start_time,
+            'final_error_mm': abs(self.target_position - final_position) * 1000,
+            'peak_power_pct': self.peak_power,
+            'overshoot_pct': (self.max_overshoot / distance) * 100 if distance else 0.0,
+            'ticks': self.ticks,
+            'started_at': self.started_at,
+            'cancelled': self._cancel_requested,
+            'completed': not self._cancel_requested,
+            'tick_stats': tick_stats
+        }
+        self.resolve(kpis)
+
+    def resolve(self, kpis: dict):
+        """Finish the trip with KPIs computed elsewhere (e.g. by a car in another process)"""
+        if kpis.get('cancelled'):
+            self._cancel_requested = True
+        with self._lock:
+            if self._done.is_set():
+                return
+            self.kpis = kpis
+            self._done.set()
+            callbacks, self._done_callbacks = self._done_callbacks, []
+        for callback in callbacks + (_trip_listeners if self.accepted else []):
+            try:
+                callback(self)
+            except Exception as e:
+                print(f"Trip callback error: {e}")
+
+    # Waiting and cancellation
+
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def cancelled(self) -> bool:
+        return self._cancel_requested
+
+    def cancel(self) -> bool:
+        """Ask the car to stop this trip; returns False if it already finished"""
+        if self.done():
+            return False
+        self._cancel_requested = True
+        if self._cancel_callback is not None:
+            self._cancel_callback()
+        return True
+
+    def result(self, timeout: Optional[float] = None) -> dict:
+        """Block until the trip finishes and return its KPIs"""
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"Trip to {self.target_floor} still running after {timeout}s")
+        return self.kpis
+
+    def add_done_callback(self, callback: Callable[['TripHandle'], None]):
+        """Call callback(handle) when the trip finishes (immediately if it already has)"""
+        with self._lock:
+            if not self._done.is_set():
+                self._done_callbacks.append(callback)
+                return
+        callback(self)
+
+    def __await__(self):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake(handle):
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(handle.kpis))
+
+        self.add_done_callback(wake)
+        return future.__await__()
@@ -0,0 +1,352 @@
+"""
+Append-only trip history
+One SQLite row per finished trip: car, origin and target floor, wall-clock
+start and end, the TripHandle KPIs, where the trip came from (a live car or a
+teste_oficial run) and a pointer to its trajectory (for teste_oficial,
+'<results file>#<index in resultados>'). Rows are never updated or deleted;
+triggers reject both.
+
+Trips are written by a background thread, so the car's control thread only
+enqueues a tuple when a trip ends. The route index covers the analytics
+queries, e.g. the p95 trip time of andar_8 -> terreo over the last week:
+
+    store = TripStore('analysis/trip_history.sqlite3')
+    add_trip_listener(store.record_trip)          # every trip of this process
+    store.trip_time_percentile('andar_8', 'terreo', since=time.time() - 7 * 86400, q=0.95)
+
+    python trip_store.py import analysis/test_results/*.jsonl
+    python trip_store.py stats --from andar_8 --to terreo --days 7
+
+    ELEVATOR_TRIP_DB=analysis/trip_history.sqlite3   store path (empty: no trip history)
+"""
+
+import argparse
+import glob
+import math
+import os
+import pathlib
+import queue
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+from metrics import REGISTRY
+
+TRIPS_STORED = REGISTRY.counter('elevator_trips_stored_total', 'Trips appended to the trip history store')
+TRIP_STORE_WRITE_SECONDS = REGISTRY.histogram(
+    'elevator_trip_store_write_seconds', 'Time to append and commit one batch of trips')
+
+DEFAULT_PATH = os.path.join('analysis', 'trip_history.sqlite3')
+
+_COLUMNS = ('car_id', 'origin_floor', 'target_floor', 'started_at', 'finished_at', 'trip_time_s',
+            'final_error_mm', 'peak_power_pct', 'overshoot_pct', 'ticks', 'completed', 'source', 'trajectory')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS trips (
+    id INTEGER PRIMARY KEY,
+    car_id TEXT NOT NULL,
+    origin_floor TEXT,
+    target_floor TEXT,
+    started_at REAL NOT NULL,
+    finished_at REAL NOT NULL,
+    trip_time_s REAL NOT NULL,
+    final_error_mm REAL,
+    peak_power_pct REAL,
+    overshoot_pct REAL,
+    ticks INTEGER,
+    completed INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    trajectory TEXT
+);
+-- Route and time range, with the trip time in the index so percentiles never read the table
+CREATE INDEX IF NOT EXISTS trips_route ON trips (origin_floor, target_floor, started_at, completed, trip_time_s);
+CREATE INDEX IF NOT EXISTS trips_started ON trips (started_at);
+-- One row per trajectory: importing a results file twice adds nothing
+CREATE UNIQUE INDEX IF NOT EXISTS trips_trajectory ON trips (trajectory);
+CREATE TRIGGER IF NOT EXISTS trips_no_update BEFORE UPDATE ON trips
+BEGIN SELECT RAISE(ABORT, 'trips is append-only'); END;
+CREATE TRIGGER IF NOT EXISTS trips_no_delete BEFORE DELETE ON trips
+BEGIN SELECT RAISE(ABORT, 'trips is append-only'); END;
+"""
+
+_INSERT = f"INSERT OR IGNORE INTO trips ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})"
+
+
+def _run_pointer(path: str) -> str:
+    """File part of the trajectory pointers of a results file; a .traj stands for its source"""
+    if path.endswith('.traj'):
+        path = _traj_source(path)
+    return os.path.relpath(path).replace(os.sep, '/')
+
+
+def _traj_source(path: str) -> str:
+    """The .jsonl or .json results file a .traj was converted from, whether or not it is still there"""
+    stem = os.path.splitext(path)[0]
+    for extension in ('.jsonl', '.json'):
+        if os.path.exists(stem + extension):
+            return stem + extension
+    from trajectory_file import TrajectoryFile
+    with TrajectoryFile(path) as run:
+        # Only results streams have each trip's start time
+        streamed = any('inicio_ts' in resultado for resultado in run.run['resultados'])
+    return stem + ('.jsonl' if streamed else '.json')
+
+
+def read_result_trips(path: str) -> List[dict]:
+    """Trips of a resultados_teste_oficial_* file (.jsonl, .json or .traj) as trip rows, in scenario order
+
+    Results streams have each trip's start time. The older .json files
+    only have the time the run was saved; start times are rebuilt
+    backwards from it with the runner's 3 s pause between scenarios, so
+    they are approximate.
+    """
+    from trajectory_file import load_results
+    run = load_results(path)
+    pointer = _run_pointer(path)
+    finished_at = run['timestamp'] - 3.0
+    trips = []  # completed: 'sucesso', i.e. stopped within 5 cm of the floor
+    for index in range(len(run['resultados']) - 1, -1, -1):
+        resultado = run['resultados'][index]
+        trip_time = resultado['tempo_total_s']
+        started_at = resultado.get('inicio_ts', finished_at - trip_time)
+        trips.append(dict(zip(_COLUMNS, (
+            'car_1', resultado['origem'], resultado['destino'], started_at, started_at + trip_time,
+            trip_time, resultado['erro_final_mm'], resultado['potencia_maxima_pct'],
+            TripStore._overshoot(resultado), len(resultado['dados_movimento']),
+            int(resultado['sucesso']), 'teste_oficial', f"{pointer}#{index}"))))
+        finished_at = started_at - 3.0
+    return trips[::-1]
+
+
+def percentile(ordered: list, q: float) -> float:
+    """Nearest-rank percentile of a sorted list; q in (0, 1]"""
+    if not 0 < q <= 1:
+        raise ValueError(f"percentile q must be in (0, 1], got {q}")
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+class TripStore:
+    """
+    SQLite trip history with a background writer
+
+    record_trip() and append() only enqueue; queries see a trip once the
+    writer has committed it (flush() waits for that). A readonly store opens
+    an existing database for queries only.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, readonly: bool = False):
+        self.path = path
+        self.readonly = readonly
+        self._read_lock = threading.Lock()
+        if readonly:
+            self._db = sqlite3.connect(pathlib.Path(path).absolute().as_uri() + '?mode=ro', uri=True,
+                                       check_same_thread=False)
+            self._writer = None
+            return
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = self._connect()
+        self._db.executescript(_SCHEMA)
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name='trip-store', daemon=True)
+        self._writer.start()
+
+    @classmethod
+    def from_env(cls) -> Optional['TripStore']:
+        path = os.environ.get('ELEVATOR_TRIP_DB', DEFAULT_PATH)
+        return cls(path) if path else None
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        # WAL: readers are not blocked by the writer; NORMAL is durable across process crashes
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    # Writing
+
+    def record_trip(self, trip, source: str = 'live', trajectory: Optional[str] = None):
+        """Append a finished TripHandle (usable as a trip_handle listener)"""
+        kpis = trip.kpis
+        if not kpis:
+            return
+        started_at = kpis.get('started_at', getattr(trip, 'started_at', time.time() - kpis['trip_time_s']))
+        self.append((kpis['car_id'], kpis['origin_floor'], kpis['target_floor'], started_at,
+                     started_at + kpis['trip_time_s'], kpis['trip_time_s'], kpis['final_error_mm'],
+                     kpis['peak_power_pct'], kpis['overshoot_pct'], kpis['ticks'], int(kpis['completed']),
+                     source, trajectory))
+
+    def append(self, row: tuple):
+        """Queue one row in _COLUMNS order"""
+        if self.readonly:
+            raise ValueError(f"Trip store {self.path} is open read-only")
+        self._queue.put(row)
+
+    def _write_loop(self):
+        db = self._connect()
+        while True:
+            rows = [self._queue.get()]
+            while True:
+                try:
+                    rows.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in rows
+            rows = [row for row in rows if row is not None]
+            if rows:
+                start = time.perf_counter()
+                try:
+                    with db:
+                        stored = db.executemany(_INSERT, rows).rowcount
+                    TRIPS_STORED.inc(stored)
+                except sqlite3.Error as e:
+                    print(f"Trip store write error: {e}")
+                TRIP_STORE_WRITE_SECONDS.observe(time.perf_counter() - start)
+            for _ in range(len(rows) + stop):
+                self._queue.task_done()
+            if stop:
+                db.close()
+                return
+
+    def flush(self):
+        """Wait until every queued trip is committed"""
+        if self._writer is not None:
+            self._queue.join()
+
+    def close(self):
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+        self._db.close()
+
+    # teste_oficial results
+
+    def ingest_results(self, path: str) -> int:
+        """Queue the trips of a resultados_teste_oficial_* file (see read_result_trips); returns how many"""
+        trips = read_result_trips(path)
+        for trip in trips:
+            self.append(tuple(trip[column] for column in _COLUMNS))
+        return len(trips)
+
+    @staticmethod
+    def _overshoot(resultado) -> Optional[float]:
+        samples = resultado['dados_movimento']
+        if not samples or not resultado.get('distancia_m'):
+            return None
+        # 'erro' is unsigned in the results files: overshoot is the error regained after its minimum
+        errors = [sample['erro'] for sample in samples]
+        lowest = errors.index(min(errors))
+        return (max(errors[lowest:]) - errors[lowest]) / resultado['distancia_m'] * 100
+
+    # Queries
+
+    def _query(self, sql: str, params=()) -> list:
+        with self._read_lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def trip_times(self, origin: str, target: str, since: float = 0.0, until: Optional[float] = None,
+                   completed_only: bool = True) -> List[float]:
+        """Sorted trip times of one route started in [since, until)"""
+        sql = ("SELECT trip_time_s FROM trips WHERE origin_floor = ? AND target_floor = ? "
+               "AND started_at >= ? AND started_at < ?")
+        if completed_only:
+            sql += " AND completed = 1"
+        rows = self._query(sql, (origin, target, since, until if until is not None else math.inf))
+        return sorted(row[0] for row in rows)
+
+    def trip_time_percentile(self, origin: str, target: str, since: float = 0.0, until: Optional[float] = None,
+                             q: float = 0.95) -> Optional[float]:
+        times = self.trip_times(origin, target, since, until)
+        return percentile(times, q) if times else None
+
+    def route_summary(self, since: float = 0.0, until: Optional[float] = None, q: float = 0.95) -> List[dict]:
+        """Trip count, mean and q-percentile trip time of every route"""
+        rows = self._query(
+            "SELECT origin_floor, target_floor, trip_time_s FROM trips "
+            "WHERE started_at >= ? AND started_at < ? AND completed = 1 "
+            "ORDER BY origin_floor, target_floor, trip_time_s",
+            (since, until if until is not None else math.inf))
+        routes = {}
+        for origin, target, trip_time in rows:
+            routes.setdefault((origin, target), []).append(trip_time)
+        return [{'origin': origin, 'target': target, 'trips': len(times),
+                 'mean_s': sum(times) / len(times), f'p{round(q * 100)}_s': percentile(times, q)}
+                for (origin, target), times in routes.items()]
+
+    def count(self) -> int:
+        return self._query("SELECT COUNT(*) FROM trips")[0][0]
+
+    def has_run(self, path: str) -> bool:
+        """Whether the trips of a teste_oficial results file were imported"""
+        return bool(self._query("SELECT 1 FROM trips WHERE trajectory = ?", (f"{_run_pointer(path)}#0",)))
+
+    def run_trips(self, path: str) -> List[dict]:
+        """The imported trips of a teste_oficial results file, in scenario order"""
+        pointer = _run_pointer(path)
+        # '$' follows '#': a range scan of the trajectory index over '<file>#...'
+        rows = self._query(
+            "SELECT trajectory, origin_floor, target_floor, started_at, trip_time_s, final_error_mm, "
+            "peak_power_pct, overshoot_pct, completed FROM trips WHERE trajectory >= ? AND trajectory < ?",
+            (f"{pointer}#", f"{pointer}$"))
+        keys = ('trajectory', 'origin_floor', 'target_floor', 'started_at', 'trip_time_s', 'final_error_mm',
+                'peak_power_pct', 'overshoot_pct', 'completed')
+        trips = [dict(zip(keys, row)) for row in rows]
+        return sorted(trips, key=lambda trip: int(trip['trajectory'].rpartition('#')[2]))
+
+
+def _quantile(text: str) -> float:
+    q = float(text)
+    if not 0 < q <= 1:
+        raise argparse.ArgumentTypeError(f"expected a quantile in (0, 1], got {text}")
+    return q
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Trip history store')
+    parser.add_argument('--db', default=os.environ.get('ELEVATOR_TRIP_DB') or DEFAULT_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+    importer = commands.add_parser('import', help='append teste_oficial results files')
+    importer.add_argument('files', nargs='*', help='default: analysis/test_results/*.json and *.jsonl')
+    stats = commands.add_parser('stats', help='trip time percentiles')
+    stats.add_argument('--from', dest='origin')
+    stats.add_argument('--to', dest='target')
+    stats.add_argument('--days', type=float, help='only trips started in the last DAYS days')
+    stats.add_argument('--q', type=_quantile, default=0.95)
+    args = parser.parse_args(argv)
+
+    store = TripStore(args.db)
+    try:
+        if args.command == 'import':
+            files = args.files or sorted(glob.glob(os.path.join('analysis', 'test_results', '*.json*')))
+            for path in files:
+                try:
+                    print(f"{path}: {store.ingest_results(path)} trips")
+                except (ValueError, KeyError) as e:
+                    print(f"{path}: skipped ({e})")
+            store.flush()
+            print(f"{store.count()} trips in {args.db}")
+            return
+        since = time.time() - args.days * 86400 if args.days else 0.0
+        if args.origin and args.target:
+            start = time.perf_counter()
+            times = store.trip_times(args.origin, args.target, since)
+            elapsed = time.perf_counter() - start
+            if not times:
+                print(f"No trips {args.origin} -> {args.target}")
+                return
+            print(f"{args.origin} -> {args.target}: {len(times)} trips, "
+                  f"p{round(args.q * 100)} {percentile(times, args.q):.2f}s, "
+                  f"median {percentile(times, 0.5):.2f}s (query {elapsed * 1000:.3f}ms)")
+            return
+        print(f"{'origin':<10}{'target':<10}{'trips':>6}{'mean':>9}{'p' + str(round(args.q * 100)):>9}")
+        for route in store.route_summary(since, q=args.q):
+            values = list(route.values())
+            print(f"{route['origin']:<10}{route['target']:<10}{route['trips']:>6}{route['mean_s']:>8.2f}s"
+                  f"{values[-1]:>8.2f}s")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()